@@ -1,17 +1,33 @@
 from crewai import Agent
 from toolkits.tools import SearchMilvusTool, AlertCaseManagerTool, summarize_chunk_and_commit, ModelGuardrailTool
 from toolkits.redis_store import fetch_unsummarized_tail, fetch_all_history, get_summary, peek_next_n, peek_remaining, set_state_if, purge_user_session
-from openai import OpenAI
+from toolkits.redis_store import (
+    ltm_index_add,
+    ltm_index_bind_collection,
+    ltm_index_build,
+    ltm_index_drop_older,
+    ltm_index_is_built,
+    ltm_index_oldest,
+    ltm_index_remove,
+)
 import os
-from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection
+import threading
+from pymilvus import connections, Collection
 try:
     # utility 於較新版本提供 has_collection 等 API
     from pymilvus import utility  # type: ignore
 except Exception:  # pragma: no cover
     utility = None  # 後續以舊法回退
-from embedding import safe_to_vector
+from embedding import embedding_dim, safe_to_vector
+from toolkits import ltm_rerank, mem_vectors
+from utils.db_connectors import get_user_profile
+from utils.llm_client import get_openai_client
 import time
-from typing import Dict, Any
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, Optional
 
 STM_MAX_CHARS = int(os.getenv("STM_MAX_CHARS", 1800))
 SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", 3000))
@@ -19,21 +35,45 @@ REFINE_CHUNK_ROUNDS = int(os.getenv("REFINE_CHUNK_ROUNDS", 20))
 SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", 5))
 
 MEM_COLLECTION = os.getenv("MEM_COLLECTION", "user_memory")
-def _get_embedding_dim():
-    """動態獲取 embedding 維度，避免硬編碼造成不匹配"""
+@lru_cache(maxsize=1)
+def mem_dim() -> int:
+    """
+    記憶向量維度：MEM_DIM 優先，否則依目前 embedding 提供者（再套用 MEM_VECTOR_DIM 截短）；
+    第一次建表/寫入時才決定，不在 import 時查詢。
+    """
+    if os.getenv("MEM_DIM"):
+        return int(os.getenv("MEM_DIM"))
     try:
-        test_vec = safe_to_vector("test")
-        return len(test_vec) if test_vec else 1536
+        return mem_vectors.target_dim(embedding_dim())
     except Exception:
-        return 1536
+        return mem_vectors.target_dim(1536)
 
-MEM_DIM = int(os.getenv("MEM_DIM", str(_get_embedding_dim())))
 MEM_THRESHOLD = float(os.getenv("MEM_THRESHOLD", "0.80"))
-MEM_TOPK = int(os.getenv("MEM_TOPK", "1"))
+# LTM 保留策略：每人最多 MEM_KEEP_N 筆（寫入時增量處理）；MEM_MAX_AGE_DAYS 由排程批次刪除；
+# MEM_CONSOLIDATE=1 時超出的舊記錄先合併成一筆摘要，而不是直接刪掉
+MEM_KEEP_N = int(os.getenv("MEM_KEEP_N", "30"))
+MEM_MAX_AGE_DAYS = int(os.getenv("MEM_MAX_AGE_DAYS", "0"))
+MEM_CONSOLIDATE = os.getenv("MEM_CONSOLIDATE", "0") == "1"
+MEM_CONSOLIDATE_BATCH = int(os.getenv("MEM_CONSOLIDATE_BATCH", "5"))
+KNOWN_USERS_LOCAL_MAX = int(os.getenv("KNOWN_USERS_LOCAL_MAX", "100000"))
+MEM_TOPK = int(os.getenv("MEM_TOPK", "3"))  # 最多放入 prompt 的記憶筆數
+MEM_CANDIDATES = int(os.getenv("MEM_CANDIDATES", "10"))  # 一次向 Milvus 取回、供本地重排的候選數
+MEM_CONTEXT_CHARS = int(os.getenv("MEM_CONTEXT_CHARS", "800"))
+CONTEXT_POOL_WORKERS = int(os.getenv("CONTEXT_POOL_WORKERS", "32"))
+
+# 上下文組裝用的共用執行緒池（只放葉節點工作，不在池內等待池內工作，避免飽和時死結）
+_CONTEXT_POOL = ThreadPoolExecutor(max_workers=CONTEXT_POOL_WORKERS, thread_name_prefix="ctx")
 
 _mem_col = None
+_mem_col_lock = threading.Lock()
 
 def _ensure_mem_col() -> Collection:
+    if _mem_col:
+        return _mem_col
+    with _mem_col_lock:
+        return _init_mem_col()
+
+def _init_mem_col() -> Collection:
     global _mem_col
     if _mem_col:
         return _mem_col
@@ -57,64 +97,147 @@ def _ensure_mem_col() -> Collection:
             except Exception:
                 exists = False
         if not exists:
-            fields = [
-                FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-                FieldSchema(name="user_id", dtype=DataType.VARCHAR, max_length=64),
-                FieldSchema(name="updated_at", dtype=DataType.INT64),
-                FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=8192),
-                FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=MEM_DIM),
-            ]
-            schema = CollectionSchema(fields, description="per-user memory (text + embedding)")
-            col = Collection(name=MEM_COLLECTION, schema=schema)
-            # 向量索引 + user_id 索引
-            col.create_index("embedding", {"index_type":"HNSW","metric_type":"COSINE","params":{"M":16,"efConstruction":200}})
-            try:
-                col.create_index("user_id", {"index_type":"TRIE"})
-            except Exception:
-                # 某些版本不支援 TRIE，忽略即可
-                pass
+            # 向量格式依 MEM_VECTOR_MODE（float32 / float16 / int8），見 toolkits/mem_vectors.py
+            mem_vectors.create_memory_collection(MEM_COLLECTION, mem_dim())
         _mem_col = Collection(MEM_COLLECTION)
+        _check_mem_dim(_mem_col)
+        try:
+            if ltm_index_bind_collection(MEM_COLLECTION):
+                print(f"[mem] MEM_COLLECTION 已切換為 {MEM_COLLECTION}，LTM 記錄索引將重建")
+        except Exception:
+            pass
         _mem_col.load()
         return _mem_col
     except Exception as e:
         print(f"[mem ensure error] {e}")
         return None
-def _prune_user_memory(user_id: str, keep: int = 30) -> int:
-    """
-    保留同一 user_id 最新的 keep 筆（依 updated_at），多的刪掉。
-    回傳刪除的筆數。
-    """
-    col = _ensure_mem_col()
-    if not col:
-        return 0
+def ensure_memory_collection() -> None:
+    """暖機用：連線並載入 user_memory，失敗時拋出例外。"""
+    if _ensure_mem_col() is None:
+        raise RuntimeError(f"無法載入 {MEM_COLLECTION}")
+
+def _check_mem_dim(col: Collection) -> None:
+    """既有 collection 的向量維度/格式與目前設定不符時提醒（換提供者或模式需改 MEM_COLLECTION 或執行遷移）。"""
     try:
-        # 抓出這個 user_id 的 id 與 updated_at
-        rows = col.query(
-            expr=f'user_id == "{user_id}"',
-            output_fields=["id", "updated_at"],
-            limit=10000  # 足夠大即可；資料量更大時再做分頁
-        )
+        for f in col.schema.fields:
+            if f.name == "embedding":
+                dim = int(f.params.get("dim", mem_dim()))
+                if dim != mem_dim():
+                    print(f"[mem ensure warning] {MEM_COLLECTION} 維度為 {dim}，"
+                          f"但目前 embedding 提供者為 {mem_dim()} 維；請設定新的 MEM_COLLECTION 或重建")
+                if f.dtype != mem_vectors.vector_dtype():
+                    print(f"[mem ensure warning] {MEM_COLLECTION} 的向量型別為 {f.dtype.name}，"
+                          f"與 MEM_VECTOR_MODE={mem_vectors.MEM_VECTOR_MODE} 不符；請用 migrate_memory_vectors.py 遷移")
+        if mem_vectors.MEM_PARTITION_KEY and not mem_vectors.uses_partition_key(col):
+            print(f"[mem ensure warning] {MEM_COLLECTION} 不是 partition key 佈局；"
+                  f"請用 migrate_memory_vectors.py migrate --partition-key 遷移")
     except Exception:
-        return 0
+        pass
+
+def _scan_user_memory(col: Collection, user_id: str) -> list:
+    """全量讀出某使用者的 (id, updated_at)；只在索引冷啟動或 Redis 不可用時使用。"""
+    rows = col.query(
+        expr=f'user_id == "{user_id}"',
+        output_fields=["id", "updated_at"],
+        limit=10000  # 足夠大即可；資料量更大時再做分頁
+    )
+    return [(r["id"], r.get("updated_at", 0)) for r in rows if "id" in r]
 
-    if not rows or len(rows) <= keep:
+def _delete_memories(col: Collection, user_id: str, ids: list) -> int:
+    if not ids:
         return 0
+    # 主鍵欄位名就是 schema 的 name（你定義的是 "id"）
+    col.delete(expr=f"id in [{','.join(map(str, ids))}]")
+    try:
+        ltm_index_remove(user_id, ids)
+    except Exception:
+        pass
+    return len(ids)
 
+def _prune_by_scan(col: Collection, user_id: str, keep: int) -> int:
+    """Redis 不可用時的退路：掃描該使用者全部記錄，刪掉最舊的超出部分。"""
+    try:
+        rows = _scan_user_memory(col, user_id)
+    except Exception:
+        return 0
+    if len(rows) <= keep:
+        return 0
     # 依 updated_at 由舊到新
-    rows.sort(key=lambda r: r.get("updated_at", 0))
-    n_over = len(rows) - keep
-    to_delete_ids = [r["id"] for r in rows[:n_over] if "id" in r]
-
-    if not to_delete_ids:
+    rows.sort(key=lambda r: r[1])
+    try:
+        return _delete_memories(col, user_id, [i for i, _ in rows[:len(rows) - keep]])
+    except Exception as e:
+        print(f"[prune memory delete error] {e}")
         return 0
 
-    # 主鍵欄位名就是 schema 的 name（你定義的是 "id"）
+def _consolidate_memories(col: Collection, user_id: str, victims: list) -> int:
+    """把最舊的幾筆記錄合併成一筆摘要（時間戳沿用其中最新者），再刪除原記錄。"""
+    ids = [i for i, _ in victims]
+    rows = col.query(expr=f"id in [{','.join(map(str, ids))}]", output_fields=["id", "text", "updated_at"])
+    texts = [r["text"] for r in sorted(rows, key=lambda r: r.get("updated_at", 0)) if (r.get("text") or "").strip()]
+    if texts:
+        client = get_openai_client()
+        res = client.chat.completions.create(
+            model=os.getenv("MODEL_NAME","gpt-4o-mini"), temperature=0.3,
+            messages=[{"role":"system","content":"你是臨床心理與健康管理顧問。"},{"role":"user","content":"以下是同一位長輩較舊的幾段長期記憶，請整合為不超過 180 字、條列式摘要（每行以 • 開頭），保留仍可能有用的健康狀況、用藥、生活事件：\n\n" + "\n".join(texts)}],
+        )
+        merged = (res.choices[0].message.content or "").strip()
+        vec = safe_to_vector(merged)
+        if not merged or not vec:
+            return 0  # 合併失敗就先保留，下次寫入再試
+        ts = max(t for _, t in victims)
+        ins = col.insert([[user_id], [ts], [merged], [mem_vectors.encode(vec, mem_dim())]])
+        ltm_index_add(user_id, [(pk, ts) for pk in (getattr(ins, "primary_keys", None) or [])])
+    _delete_memories(col, user_id, ids)
+    return len(ids)
+
+def _prune_user_memory(user_id: str, keep: int = MEM_KEEP_N, new_rows: Optional[list] = None) -> int:
+    """
+    套用每人筆數上限。以 Redis 中的每人索引（id → updated_at）計數並找出最舊的記錄，
+    寫入路徑上只處理超出的那幾筆；索引不存在時（冷啟動）掃描一次重建。回傳刪除的筆數。
+    只有索引本身出錯才退回掃描刪除；合併（LLM）或刪除失敗時本次不修剪，留待下次寫入。
+    """
+    col = _ensure_mem_col()
+    if not col or keep <= 0:
+        return 0
     try:
-        col.delete(expr=f"id in [{','.join(map(str, to_delete_ids))}]")
+        if not ltm_index_is_built(user_id):
+            ltm_index_build(user_id, _scan_user_memory(col, user_id))
+        count = ltm_index_add(user_id, new_rows or [])
+        over = count - keep
+        if over <= 0:
+            return 0
+        # 累積到一批再合併，避免每次寫入都呼叫 LLM；合併 over+1 筆成 1 筆後剛好回到上限
+        if MEM_CONSOLIDATE and over < MEM_CONSOLIDATE_BATCH:
+            return 0
+        victims = ltm_index_oldest(user_id, over + 1 if MEM_CONSOLIDATE else over)
     except Exception as e:
-        print(f"[prune memory delete error] {e}")
+        print(f"[prune memory index error] {e}")
+        if MEM_CONSOLIDATE:
+            return 0  # 掃描刪除會丟失原本要合併保留的資訊
+        return _prune_by_scan(col, user_id, keep)
+    try:
+        if MEM_CONSOLIDATE:
+            return _consolidate_memories(col, user_id, victims)
+        return _delete_memories(col, user_id, [i for i, _ in victims])
+    except Exception as e:
+        print(f"[prune memory error] {e}（本次保留原記錄，下次寫入再試）")
+        return 0
+
+def apply_memory_retention(max_age_days: int = MEM_MAX_AGE_DAYS) -> int:
+    """年齡保留策略：一次以運算式批次刪除所有使用者中過舊的記錄（供排程呼叫）。回傳刪除筆數。"""
+    if max_age_days <= 0:
+        return 0
+    col = _ensure_mem_col()
+    if not col:
         return 0
-    return len(to_delete_ids)
+    cutoff = int(time.time() * 1000) - max_age_days * 86400 * 1000
+    res = col.delete(expr=f"updated_at < {cutoff}")
+    try:
+        ltm_index_drop_older(cutoff)
+    except Exception as e:
+        print(f"[retention index error] {e}")
+    return int(getattr(res, "delete_count", 0) or 0)
 
 def _append_memory(user_id: str, text: str, vec: list) -> int:
     col = _ensure_mem_col()
@@ -122,56 +245,122 @@ def _append_memory(user_id: str, text: str, vec: list) -> int:
         return 0
     ms = int(time.time()*1000)
     # 按 schema 順序插入（跳過 auto_id 主鍵）
-    col.insert([[user_id], [ms], [text], [vec]])
-    _prune_user_memory(user_id)
+    res = col.insert([[user_id], [ms], [text], [mem_vectors.encode(vec, mem_dim())]])
+    _prune_user_memory(user_id, new_rows=[(pk, ms) for pk in (getattr(res, "primary_keys", None) or [])])
     return 1
 
-def _search_memory_top1(user_id: str, qv: list, threshold: float = MEM_THRESHOLD):
+def _search_memories(user_id: str, qv: list, threshold: float = MEM_THRESHOLD) -> str:
+    """
+    一次取回 MEM_CANDIDATES 筆候選（含向量），過濾低於 threshold 的相似度後，
+    以「相似度 + 新近度」與 MMR 在本地重排，挑最多 MEM_TOPK 筆並依 MEM_CONTEXT_CHARS 打包。
+    """
     col = _ensure_mem_col()
     if not col or not qv:
         return ""
     try:
         res = col.search(
-            data=[qv], anns_field="embedding",
-            param={"metric_type":"COSINE","params":{"ef":64}},
-            limit=max(MEM_TOPK,1),
+            data=[mem_vectors.encode(qv, mem_dim())], anns_field="embedding",
+            param=mem_vectors.search_params(),
+            limit=max(MEM_CANDIDATES, MEM_TOPK, 1),
             expr=f'user_id == "{user_id}"',
-            output_fields=["text"]
+            output_fields=["text", "updated_at", "embedding"]
         )
-        if res and len(res[0])>0:
-            h = res[0][0]  # 取第一筆
-            if getattr(h, "score", 0.0) >= threshold:
-                try:
-                    text = h.entity.get("text") or ""
-                    # 過濾掉空字串的記錄
-                    return text if text.strip() else ""
-                except Exception:
-                    return ""
     except Exception as e:
         print(f"[mem search error] {e}")
-    return ""
+        return ""
+    hits = [h for h in (res[0] if res else [])
+            if getattr(h, "score", 0.0) >= threshold and (h.entity.get("text") or "").strip()]
+    if not hits:
+        return ""
+    sims = np.array([h.score for h in hits], dtype=np.float32)
+    stamps = np.array([h.entity.get("updated_at") or 0 for h in hits], dtype=np.int64)
+    try:
+        vecs = np.vstack([mem_vectors.as_float_vector(h.entity.get("embedding")) for h in hits])
+    except Exception:
+        vecs = None
+    scores = ltm_rerank.relevance(sims, stamps, int(time.time() * 1000))
+    order = ltm_rerank.mmr(scores, vecs, max(MEM_TOPK, 1))
+    return ltm_rerank.pack(
+        [hits[i].entity.get("text") for i in order], [int(stamps[i]) for i in order], MEM_CONTEXT_CHARS
+    )
+
+# 已知使用者：行程內集合在前，Redis（LTM 記錄索引的 ltm:indexed 集合）在後，
+# 每位使用者最多只對 Milvus 探查一次；搜尋在沒有任何記錄時本來就回空，不再需要空記錄佔位。
+_known_users: "OrderedDict[str, None]" = OrderedDict()
+_known_users_lock = threading.Lock()
+
+def _is_known_user(user_id: str) -> bool:
+    with _known_users_lock:
+        if user_id in _known_users:
+            _known_users.move_to_end(user_id)
+            return True
+    return False
+
+def _remember_user(user_id: str) -> None:
+    with _known_users_lock:
+        _known_users[user_id] = None
+        while len(_known_users) > KNOWN_USERS_LOCAL_MAX:
+            _known_users.popitem(last=False)
 
 def _ensure_user_exists(user_id: str) -> None:
-    """確保該 user_id 在 Collection 中存在，如果不存在則建立空記錄"""
-    col = _ensure_mem_col()
-    if not col:
+    """第一次見到該使用者時掃描一次其記錄並建立 LTM 索引（供保留策略使用）；之後直接略過。"""
+    if _is_known_user(user_id):
         return
     try:
-        cnt = col.query(expr=f'user_id == "{user_id}"', output_fields=["id"], limit=1)
+        if ltm_index_is_built(user_id):
+            _remember_user(user_id)
+            return
     except Exception:
-        cnt = []
-    if cnt:
+        return  # Redis 不可用時不探查，下次再試
+    col = _ensure_mem_col()
+    if not col:
         return
-    
-    # 建立空記錄：只有 user_id 和 updated_at，text 和 embedding 為空值
     try:
-        ms = int(time.time() * 1000)
-        # 插入空記錄：text 為空字串，embedding 為零向量
-        zero_vec = [0.0] * MEM_DIM
-        col.insert([[user_id], [ms], [""], [zero_vec]])
-        print(f"[mem] 為 {user_id} 建立空記錄")
+        ltm_index_build(user_id, _scan_user_memory(col, user_id))
+        _remember_user(user_id)
     except Exception as e:
-        print(f"[mem] 建立空記錄失敗: {e}")
+        print(f"[mem] 建立 {user_id} 的記錄索引失敗: {e}")
+
+def _placeholder_rows(col: Collection, batch: int) -> list:
+    """先以 Strong 一致性完整列出所有空記錄，再統一刪除（邊查邊刪會讀到尚未生效的刪除而重複計算）。"""
+    expr, fields = 'text == ""', ["id", "user_id"]
+    if hasattr(col, "query_iterator"):
+        it = col.query_iterator(batch_size=batch, expr=expr, output_fields=fields, consistency_level="Strong")
+        rows = []
+        try:
+            while True:
+                page = it.next()
+                if not page:
+                    return rows
+                rows.extend(page)
+        finally:
+            it.close()
+    rows, offset = [], 0
+    while True:
+        page = col.query(expr=expr, output_fields=fields, offset=offset, limit=batch, consistency_level="Strong")
+        rows.extend(page)
+        offset += len(page)
+        if len(page) < batch:
+            return rows
+
+def cleanup_placeholder_rows(batch: int = 10000) -> int:
+    """批次刪除舊版留下的空記錄（text 為空、零向量），並同步移出 LTM 索引。回傳刪除筆數。"""
+    col = _ensure_mem_col()
+    if not col:
+        return 0
+    rows = list({r["id"]: r for r in _placeholder_rows(col, batch)}.values())
+    for i in range(0, len(rows), batch):
+        chunk = rows[i:i + batch]
+        by_user: Dict[str, list] = {}
+        for r in chunk:
+            by_user.setdefault(r.get("user_id", ""), []).append(r["id"])
+        col.delete(expr=f"id in [{','.join(str(r['id']) for r in chunk)}]")
+        for uid, ids in by_user.items():
+            try:
+                ltm_index_remove(uid, ids)
+            except Exception:
+                pass
+    return len(rows)
 
 
 # ---- Prompt 構建 ----
@@ -181,39 +370,73 @@ def _shrink_tail(text: str, max_chars: int) -> str:
     tail = text[-max_chars:]; idx = tail.find("--- ")
     return tail[idx:] if idx != -1 else tail
 
-def build_prompt_from_redis(user_id: str, k: int = 6, current_input: str = "") -> Dict[str, Any]:
-    """
-    修改此函式，使其回傳一個包含不同記憶層次的字典，而非單一字串。
-    """
+def _read_history_context(user_id: str, k: int) -> Dict[str, str]:
     summary, _ = get_summary(user_id)
     summary_text = _shrink_tail(summary, SUMMARY_MAX_CHARS) if summary else "無"
-    
+
     rounds = fetch_unsummarized_tail(user_id, k=max(k,1))
     def render(rs): return "\n".join([f"長輩：{r['input']}\n金孫：{r['output']}" for r in rs])
-    
+
     stm_text = render(rounds)
     # 此處的 token 限制邏輯維持不變
     while len(stm_text) > STM_MAX_CHARS and len(rounds) > 1:
         rounds = rounds[1:]; stm_text = render(rounds)
     if len(stm_text) > STM_MAX_CHARS and rounds: stm_text = stm_text[-STM_MAX_CHARS:]
     if not stm_text: stm_text = "無"
+    return {"summary_text": summary_text, "stm_text": stm_text}
+
+def _retrieve_ltm(user_id: str, current_input: str):
+    """回傳 (查詢向量, LTM 文字)；查詢向量同時供語意回答快取使用，避免重複 embedding。"""
+    if not current_input:
+        return [], "無"
+    qv = safe_to_vector(current_input)
+    if qv:
+        mem_txt = _search_memories(user_id, qv, threshold=MEM_THRESHOLD)
+        if mem_txt and mem_txt.strip():
+            return qv, mem_txt
+    return qv, "無"
+
+class ContextAssembly:
+    """
+    並行組裝一則訊息所需的上下文。Profile（PostgreSQL）、MTM/STM（Redis）、
+    LTM-RAG（embedding + Milvus）與 _ensure_user_exists（僅首次見到的使用者）互不相依，建構時即同時送出；
+    呼叫端可在 Guardrail 判定前先啟動，若被攔截則 discard() 丟棄結果。
+    """
+
+    def __init__(self, user_id: str, current_input: str = "", k: int = 6):
+        self._futures = {
+            "profile": _CONTEXT_POOL.submit(get_user_profile, user_id),
+            "history": _CONTEXT_POOL.submit(_read_history_context, user_id, k),
+            "ltm": _CONTEXT_POOL.submit(_retrieve_ltm, user_id, current_input),
+        }
+        if not _is_known_user(user_id):
+            self._futures["ensure"] = _CONTEXT_POOL.submit(_ensure_user_exists, user_id)
 
-    # --- 記憶檢索 (LTM-RAG) ---
-    _ensure_user_exists(user_id)
-    ltm_rag_result = "無"
-    if current_input:
-        qv = safe_to_vector(current_input)
-        if qv:
-            mem_txt = _search_memory_top1(user_id, qv, threshold=MEM_THRESHOLD)
-            if mem_txt and mem_txt.strip():
-                ltm_rag_result = mem_txt
-    
-    # 回傳一個結構化的字典
-    return {
-        "summary_text": summary_text,
-        "stm_text": stm_text,
-        "ltm_rag_result": ltm_rag_result
-    }
+    def profile(self) -> dict:
+        return self._futures["profile"].result()
+
+    def prompt_context(self) -> Dict[str, Any]:
+        history = self._futures["history"].result()
+        return {
+            "summary_text": history["summary_text"],
+            "stm_text": history["stm_text"],
+            "ltm_rag_result": self._futures["ltm"].result()[1],
+        }
+
+    def query_vector(self) -> list:
+        return self._futures["ltm"].result()[0]
+
+    def discard(self) -> None:
+        # 尚未開始的直接取消；執行中的讓它跑完，結果不再使用
+        for fut in self._futures.values():
+            fut.cancel()
+
+def build_prompt_from_redis(user_id: str, k: int = 6, current_input: str = "") -> Dict[str, Any]:
+    """
+    修改此函式，使其回傳一個包含不同記憶層次的字典，而非單一字串。
+    各層記憶改由 ContextAssembly 並行讀取。
+    """
+    return ContextAssembly(user_id, current_input=current_input, k=k).prompt_context()
 
 # ---- Agents ----
 
@@ -228,15 +451,17 @@ def create_guardrail_agent() -> Agent:
         verbose=False
     )
 
-def create_health_companion(user_id: str) -> Agent:
-    return Agent(role="健康陪伴者", goal="以台語關懷長者健康與心理狀況，必要時通報", backstory="你是會講台語的金孫型陪伴機器人，回覆溫暖務實。", tools=[SearchMilvusTool(), AlertCaseManagerTool()], memory=True, verbose=False)
+def create_health_companion(user_id: Optional[str] = None) -> Agent:
+    # Agent 由 AgentManager 的共用池跨使用者重用；個人記憶一律經 Prompt（STM/MTM/LTM/Profile）注入，
+    # 因此不開 Agent 內建 memory，避免狀態殘留到下一位使用者。user_id 僅為相容舊呼叫而保留。
+    return Agent(role="健康陪伴者", goal="以台語關懷長者健康與心理狀況，必要時通報", backstory="你是會講台語的金孫型陪伴機器人，回覆溫暖務實。", tools=[SearchMilvusTool(), AlertCaseManagerTool()], memory=False, verbose=False)
 
 # ---- Refine（map-reduce over 全量 QA） ----
 
 def refine_summary(user_id: str) -> None:
     all_rounds = fetch_all_history(user_id)
     if not all_rounds: return
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    client = get_openai_client()
     # 1) 分片
     chunks = [all_rounds[i:i+REFINE_CHUNK_ROUNDS] for i in range(0, len(all_rounds), REFINE_CHUNK_ROUNDS)]
     partials = []
@@ -259,10 +484,15 @@ def refine_summary(user_id: str) -> None:
 
 # ---- Finalize：補分段摘要 → Refine → Purge ----
 
-def finalize_session(user_id: str) -> None:
+def summarize_session(user_id: str) -> None:
+    """收尾的 LLM 部分（補分段摘要 → Refine）；不動 STM，可在使用者的 lane 之外執行。"""
     set_state_if(user_id, expect="ACTIVE", to="FINALIZING")
     start, remaining = peek_remaining(user_id)
     if remaining:
         summarize_chunk_and_commit(user_id, start_round=start, history_chunk=remaining)
     refine_summary(user_id)
+
+
+def finalize_session(user_id: str) -> None:
+    summarize_session(user_id)
     purge_user_session(user_id)
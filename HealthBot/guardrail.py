@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import Counter
+
+from crewai import Crew, Task
+
+from HealthBot.agent import create_guardrail_agent
+from toolkits.agent_pool import AgentPool
+from toolkits.guard_cache import GuardVerdictCache
+from toolkits.preclassifier import preclassify
+from toolkits.tools import (
+    GUARDRAIL_ERROR_REASON,
+    GUARDRAIL_PROMPT_VERSION,
+    classify_guardrail,
+    guard_model_name,
+)
+
+# direct：直接呼叫 classify_guardrail（單次 LLM）；crew：沿用 Guardrail Agent + Crew 編排（兩次以上 LLM）
+GUARDRAIL_MODE = os.getenv("GUARDRAIL_MODE", "direct").lower()
+
+_guard_pool = None
+# 判定快取：key 含模式、模型與 prompt 版本，任一變更即自然失效
+verdict_cache = GuardVerdictCache(
+    model=f"{GUARDRAIL_MODE}:{guard_model_name()}",
+    prompt_version=GUARDRAIL_PROMPT_VERSION,
+)
+_tier_counts = Counter()  # 各層處理的輸入數：local_ok / local_block / llm
+_tier_lock = threading.Lock()
+
+
+_guard_pool_lock = threading.Lock()
+
+
+def _get_guard_pool() -> AgentPool:
+    global _guard_pool
+    if _guard_pool is None:
+        with _guard_pool_lock:
+            if _guard_pool is None:
+                _guard_pool = AgentPool(create_guardrail_agent, name="guardrail")
+    return _guard_pool
+
+
+def prewarm_guardrail() -> None:
+    """暖機：crew 模式預先建好一個 Guardrail Agent；direct 模式不需 Agent。"""
+    if GUARDRAIL_MODE == "crew":
+        _get_guard_pool().prewarm(1)
+
+
+def _kickoff(description: str, expected_output: str) -> str:
+    with _get_guard_pool().lease() as guard:
+        task = Task(description=description, expected_output=expected_output, agent=guard)
+        return (Crew(agents=[guard], tasks=[task], verbose=False).kickoff().raw or "").strip()
+
+
+def _cached(scope: str, text: str, judge) -> str:
+    verdict = verdict_cache.get(scope, text)
+    if verdict is not None:
+        return verdict
+    verdict = judge(text)
+    # 服務錯誤時的保守攔截不可快取
+    if GUARDRAIL_ERROR_REASON not in verdict:
+        verdict_cache.put(scope, text, verdict)
+    return verdict
+
+
+def check_input(text: str) -> str:
+    """
+    輸入守衛：回 OK 或 BLOCK: <原因>。
+    先經本地前置分類（詞庫 + 小分類器），確定無害或明確自傷意圖時不呼叫 LLM；
+    其餘才查判定快取 / LLM（模稜兩可的自傷字詞會作為提示一併交給 LLM）。
+    """
+    verdict, detail = preclassify(text)
+    tier = "llm" if verdict is None else ("local_ok" if verdict == "OK" else "local_block")
+    with _tier_lock:
+        _tier_counts[tier] += 1
+    if verdict is not None:
+        return verdict
+    hint = detail.split(":", 1)[1] if detail.startswith("self_harm_hint:") else ""
+    return _cached("in", text, lambda t: _judge_input(t, hint))
+
+
+def check_output(text: str) -> str:
+    """輸出守衛（AI 生成訊息）：回 OK 或 REJECT: <原因>。"""
+    return _cached("out", text, _judge_output)
+
+
+def _judge_input(text: str, hint: str = "") -> str:
+    if GUARDRAIL_MODE == "crew":
+        return _kickoff(
+            (
+                f"判斷是否需要攔截：「{text}」。"
+                + (f"本地詞庫偵測到可能的自傷相關字詞（{hint}），請確認是否為本人自傷意圖。" if hint else "")
+                + "務必使用 model_guardrail 工具進行判斷；"
+                "安全回 OK；需要攔截時回 BLOCK: <原因>（僅此兩種）。"
+            ),
+            "OK 或 BLOCK: <原因>",
+        )
+    return classify_guardrail(text, hint=hint)
+
+
+def _judge_output(text: str) -> str:
+    if GUARDRAIL_MODE == "crew":
+        return _kickoff(
+            f"請檢查以下由 AI 生成的關懷訊息是否合規：'{text}'",
+            "合規回覆'OK'，不合規回覆'REJECT: <原因>'",
+        )
+    verdict = classify_guardrail(text, source="AI 生成的關懷訊息")
+    if verdict.startswith("BLOCK:"):
+        return "REJECT:" + verdict[len("BLOCK:"):]
+    return "OK"
+
+
+def guard_stats() -> dict:
+    return {
+        "mode": GUARDRAIL_MODE,
+        "agents": _guard_pool.stats() if _guard_pool else None,
+        "cache": verdict_cache.stats(),
+        "tiers": dict(_tier_counts),
+    }
@@ -5,7 +5,11 @@ from apscheduler.jobstores.redis import RedisJobStore
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
 from dotenv import load_dotenv
-from tasks import check_and_trigger_dynamic_care, patrol_silent_users
+from tasks import (
+    check_and_trigger_dynamic_care,
+    patrol_silent_users,
+    run_memory_retention,
+)
 
 load_dotenv()
 TAIPEI_TZ = pytz.timezone("Asia/Taipei")
@@ -35,6 +39,13 @@ def main():
         name="巡檢長期沉默使用者",
         replace_existing=True,
     )
+    scheduler.add_job(
+        run_memory_retention,
+        trigger=CronTrigger(hour=3, minute=30),
+        id="memory_retention_job",
+        name="長期記憶保留策略",
+        replace_existing=True,
+    )
 
     print("🚀 主動關懷排程服務已啟動...")
     scheduler.print_jobs()
@@ -3,26 +3,22 @@ import os
 import time
 from datetime import datetime
 
-from crewai import Agent, Crew, Task
 from dotenv import load_dotenv
-from openai import OpenAI
 
 from toolkits.redis_store import append_proactive_round
 from utils.db_connectors import get_milvus_collection, get_postgres_connection
 from utils.line_pusher import send_line_message
+from utils.llm_client import get_openai_client
 
 load_dotenv()
 
 # --- 初始化 ---
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
 LTM_COLLECTION_NAME = os.getenv("MEM_COLLECTION", "user_memory")
 try:
-    from HealthBot.agent import create_guardrail_agent
-
-    guardrail_agent = create_guardrail_agent()
+    from HealthBot.guardrail import check_output
 except ImportError:
-    guardrail_agent = None
+    check_output = None
 
 
 def get_proactive_care_prompt_template() -> str:
@@ -251,7 +247,7 @@ def execute_proactive_care(user: dict):
 
     # 3. 呼叫 LLM
     try:
-        response = client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model=MODEL_NAME,
             messages=[{"role": "user", "content": final_prompt}],
             temperature=0.7,
@@ -268,14 +264,8 @@ def execute_proactive_care(user: dict):
 
     # 4. 輸出守衛檢查
     final_care_msg = care_msg_draft
-    if guardrail_agent:
-        guard_task = Task(
-            description=f"請檢查以下由 AI 生成的關懷訊息是否合規：'{care_msg_draft}'",
-            agent=guardrail_agent,
-            expected_output="合規回覆'OK'，不合規回覆'REJECT: <原因>'",
-        )
-        guard_crew = Crew(agents=[guardrail_agent], tasks=[guard_task], verbose=False)
-        guard_result = (guard_crew.kickoff().raw or "").strip()
+    if check_output:
+        guard_result = check_output(care_msg_draft)
 
         if guard_result.startswith("REJECT"):
             print(f"🛡️ 輸出守衛攔截了對 {line_user_id} 的訊息: {guard_result}")
@@ -330,3 +320,26 @@ def patrol_silent_users():
     print(f"[巡檢任務] 發現 {len(users_to_care)} 位符合條件的使用者。")
     for user in users_to_care:
         execute_proactive_care(user)
+
+
+def run_memory_retention():
+    """每日凌晨執行：清除舊版空記錄，並依 MEM_MAX_AGE_DAYS 批次刪除過舊的長期記憶。"""
+    from HealthBot.agent import (
+        MEM_MAX_AGE_DAYS,
+        apply_memory_retention,
+        cleanup_placeholder_rows,
+    )
+
+    try:
+        removed = cleanup_placeholder_rows()
+        if removed:
+            print(f"[保留策略] 已清除 {removed} 筆空記錄。")
+    except Exception as e:
+        print(f"❌ [保留策略] 清除空記錄失敗: {e}")
+    if MEM_MAX_AGE_DAYS <= 0:
+        return
+    print(f"\n[保留策略] 刪除 {MEM_MAX_AGE_DAYS} 天前的長期記憶...")
+    try:
+        print(f"[保留策略] 已刪除 {apply_memory_retention()} 筆。")
+    except Exception as e:
+        print(f"❌ [保留策略] 執行失敗: {e}")
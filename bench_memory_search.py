@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+user_memory 過濾搜尋延遲基準：flat（單一 HNSW + user_id 過濾）vs user_id partition key 佈局
+
+使用方法:
+python bench_memory_search.py --users 100,1000,5000 --per-user 30 --dim 256 --queries 200
+
+對每個使用者數建立兩個暫存 collection（合成的單位向量，每人 --per-user 筆），
+以 user_id == "..." 過濾做 top-1 搜尋，回報 p50 / p95 / 平均延遲（ms）。結束時刪除暫存 collection。
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from pymilvus import connections, utility
+
+from toolkits import mem_vectors
+
+load_dotenv()
+
+MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
+
+
+def build(name: str, users: int, per_user: int, dim: int, partition_key: bool, num_partitions: int, rng):
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    col = mem_vectors.create_memory_collection(name, dim, "float32", partition_key, num_partitions)
+    now = int(time.time() * 1000)
+    batch = 5000
+    total = users * per_user
+    for start in range(0, total, batch):
+        n = min(batch, total - start)
+        vecs = rng.normal(size=(n, dim)).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        ids = [f"bench_u{(start + i) // per_user}" for i in range(n)]
+        col.insert([ids, [now] * n, ["bench"] * n, vecs.tolist()])
+    col.flush()
+    col.load()
+    return col
+
+
+def measure(col, users: int, dim: int, queries: int, rng):
+    lat = []
+    params = mem_vectors.search_params("float32")
+    for _ in range(queries):
+        uid = f"bench_u{rng.integers(users)}"
+        q = rng.normal(size=dim).astype(np.float32)
+        q /= np.linalg.norm(q)
+        t0 = time.perf_counter()
+        col.search(data=[q.tolist()], anns_field="embedding", param=params, limit=1,
+                   expr=f'user_id == "{uid}"', output_fields=["text"])
+        lat.append((time.perf_counter() - t0) * 1000)
+    lat = np.array(lat)
+    return np.percentile(lat, 50), np.percentile(lat, 95), lat.mean()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="user_memory 過濾搜尋延遲基準")
+    ap.add_argument("--users", default="100,1000,5000")
+    ap.add_argument("--per-user", type=int, default=30)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--num-partitions", type=int, default=mem_vectors.MEM_NUM_PARTITIONS)
+    ap.add_argument("--keep", action="store_true", help="保留暫存 collection")
+    args = ap.parse_args()
+
+    connections.connect(alias="default", uri=MILVUS_URI)
+    rng = np.random.default_rng(0)
+    print(f"{'使用者數':>8}{'筆數':>9}  {'佈局':<16}{'p50':>8}{'p95':>8}{'平均':>8}  (ms)")
+    for users in [int(u) for u in args.users.split(",")]:
+        for partition_key in (False, True):
+            name = f"bench_mem_{'pk' if partition_key else 'flat'}_{users}"
+            col = build(name, users, args.per_user, args.dim, partition_key, args.num_partitions, rng)
+            measure(col, users, args.dim, 10, rng)  # 暖身
+            p50, p95, avg = measure(col, users, args.dim, args.queries, rng)
+            layout = f"partition×{args.num_partitions}" if partition_key else "flat"
+            print(f"{users:>8}{users * args.per_user:>9}  {layout:<16}{p50:>8.2f}{p95:>8.2f}{avg:>8.2f}")
+            if not args.keep:
+                utility.drop_collection(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,8 @@ import os
 from pymilvus import connections, Collection
 from dotenv import load_dotenv
 
+from toolkits.redis_store import ltm_index_reset
+
 load_dotenv()
 
 MEM_COLLECTION = os.getenv("MEM_COLLECTION", "user_memory")
@@ -40,6 +42,13 @@ def check_collection_exists():
         print(f"❌ Collection '{MEM_COLLECTION}' 不存在或無法載入: {e}")
         return None
 
+def _reset_index(user_ids=None):
+    """直接刪除 Milvus 記錄後，讓 Redis 中的每人記錄索引在下次寫入時重建"""
+    try:
+        ltm_index_reset(user_ids)
+    except Exception as e:
+        print(f"⚠️  無法重設記錄索引（下次寫入前請確認 Redis 可用）: {e}")
+
 def clear_all_data(col: Collection):
     """清空所有資料"""
     try:
@@ -62,6 +71,7 @@ def clear_all_data(col: Collection):
             all_ids = [r["id"] for r in all_records]
             col.delete(expr=f"id in [{','.join(map(str, all_ids))}]")
             print(f"✅ 已刪除 {len(all_ids)} 筆記錄")
+            _reset_index()
         else:
             print("❌ 取消操作")
             
@@ -96,6 +106,7 @@ def clear_user_data(col: Collection, user_id: str):
             user_ids = [r["id"] for r in user_records]
             col.delete(expr=f"id in [{','.join(map(str, user_ids))}]")
             print(f"✅ 已刪除使用者 '{user_id}' 的 {len(user_ids)} 筆記錄")
+            _reset_index([user_id])
         else:
             print("❌ 取消操作")
             
@@ -132,6 +143,7 @@ def clear_empty_records(col: Collection):
             empty_ids = [r["id"] for r in empty_records]
             col.delete(expr=f"id in [{','.join(map(str, empty_ids))}]")
             print(f"✅ 已刪除 {len(empty_ids)} 筆空記錄")
+            _reset_index(list(user_counts))
         else:
             print("❌ 取消操作")
             
@@ -1,10 +1,27 @@
-import os
-from openai import OpenAI
 from typing import Union, List
 from dotenv import load_dotenv
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))  # 請設置環境變數
+from toolkits.embed_batcher import EMBED_BATCH_MAX, EMBED_BATCHING, EmbeddingBatcher
+from toolkits.embedding_cache import EmbeddingCache
+from toolkits.embedding_providers import get_provider
+
+# 提供者由 EMBED_PROVIDER 決定（openai / local / hash），快取以提供者名稱區隔命名空間
+provider = get_provider()
+embedding_cache = EmbeddingCache(provider.name)
+
+
+def embedding_dim() -> int:
+    """目前提供者的向量維度；MEM_DIM 與 Milvus schema 以此為準。"""
+    return provider.dim
+
+
+def _embed_remote(texts: List[str]) -> List[List[float]]:
+    return provider.embed(texts)
+
+
+# 並行的單筆請求在此合併成一次呼叫（OpenAI 省 RPM；本機模型則是批次推論）
+embedding_batcher = EmbeddingBatcher(_embed_remote)
 
 def to_vector(text: Union[str, List[str]], normalize: bool = True) -> List[float]:
     if isinstance(text, str):
@@ -14,13 +31,17 @@ def to_vector(text: Union[str, List[str]], normalize: bool = True) -> List[float
     else:
         raise TypeError("輸入必須為 str 或 List[str]")
 
-    # 呼叫 OpenAI API
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=inputs
-    )
-
-    vectors = [r.embedding for r in response.data]
+    # 先查快取，只把未命中（且去重後）的文字送去提供者
+    vectors = embedding_cache.get_many(inputs)
+    misses = list(dict.fromkeys(t for t, v in zip(inputs, vectors) if v is None))
+    if misses:
+        # 少量未命中（熱路徑上的單句）交給微批次派送；大批量（例如匯入知識庫）直接呼叫
+        if EMBED_BATCHING and len(misses) < EMBED_BATCH_MAX:
+            fetched = dict(zip(misses, embedding_batcher.embed_many(misses)))
+        else:
+            fetched = dict(zip(misses, _embed_remote(misses)))
+        embedding_cache.put_many(misses, [fetched[t] for t in misses])
+        vectors = [v if v is not None else fetched[t] for t, v in zip(inputs, vectors)]
 
     # 單一輸入時回傳一維向量
     if isinstance(text, str):
@@ -33,4 +54,4 @@ def safe_to_vector(text, normalize: bool = True):
         return to_vector(text, normalize=normalize)
     except Exception as e:
         print(f"[embedding error] {e}")
-        return []
\ No newline at end of file
+        return []
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+啟動成本報告：在子行程以 `python -X importtime` 匯入指定模組，並在匯入期間封鎖網路連線。
+
+使用方法:
+python import_report.py                 # 預設檢查 main（chatbot-app 的進入點）
+python import_report.py main worker ProactiveCare.tasks --top 15 --budget 1.0
+
+輸出:
+- 各頂層套件的累計匯入時間（由大到小）
+- 本專案模組各自的匯入時間
+- 匯入期間嘗試的網路連線（應為 0）
+超出 --budget 秒或有網路連線時以非 0 結束碼退出，可放進 CI 或容器健康檢查。
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+PROJECT_ROOTS = {"main", "worker", "embedding", "HealthBot", "toolkits", "utils", "ProactiveCare"}
+
+# 子行程：攔截 socket 連線（記錄後拒絕），再匯入目標模組
+_CHILD = r"""
+import socket, sys
+attempts = []
+def _blocked(self, address, *a, **k):
+    attempts.append(repr(address))
+    raise OSError("network disabled during import")
+socket.socket.connect = _blocked
+socket.socket.connect_ex = _blocked
+sys.stderr.write("IMPORT_REPORT_BEGIN\n"); sys.stderr.flush()
+for name in sys.argv[1:]:
+    __import__(name)
+print("NETWORK_ATTEMPTS=" + "|".join(attempts))
+"""
+
+
+def run(modules):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD, *modules],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    rows = []  # (模組, 自身 us, 累計 us, 巢狀深度)
+    other = []
+    started = False  # 直譯器啟動（site 等）與 socket 攔截本身不計入
+    for line in proc.stderr.splitlines():
+        if line == "IMPORT_REPORT_BEGIN":
+            started = True
+            continue
+        if not started or not line.startswith("import time:") or "imported package" in line:
+            other.append(line)
+            continue
+        # 格式：import time:  自身 us |  累計 us | <縮排>模組名
+        self_us, cum_us, name = line.split(":", 1)[1].split("|", 2)
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), int(self_us), int(cum_us), depth))
+    attempts = []
+    for line in proc.stdout.splitlines():
+        if line.startswith("NETWORK_ATTEMPTS="):
+            attempts = [a for a in line.split("=", 1)[1].split("|") if a]
+    return proc.returncode, rows, attempts, other
+
+
+def main():
+    ap = argparse.ArgumentParser(description="匯入成本與匯入期間網路存取報告")
+    ap.add_argument("modules", nargs="*", default=["main"])
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--budget", type=float, default=1.0, help="總匯入時間上限（秒）")
+    args = ap.parse_args()
+
+    code, rows, attempts, other = run(args.modules)
+    if code != 0:
+        print("❌ 匯入失敗：")
+        print("\n".join(l for l in other if l.strip())[-4000:])
+        sys.exit(code)
+
+    # -X importtime 只計「第一次」匯入；頂層（深度最淺）的累計時間加總即為總成本
+    min_depth = min(d for _, _, _, d in rows) if rows else 0
+    per_root = defaultdict(int)
+    for name, _, cum, depth in rows:
+        if depth == min_depth:
+            per_root[name.split(".")[0]] += cum
+    total_s = sum(per_root.values()) / 1e6
+
+    print(f"📦 匯入 {', '.join(args.modules)}：共 {total_s:.3f}s")
+    print(f"\n依頂層套件（前 {args.top}）:")
+    for name, us in sorted(per_root.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {us / 1000:9.1f} ms  {name}")
+
+    print("\n本專案模組（自身 / 累計）:")
+    for name, self_us, cum, _ in sorted(rows, key=lambda r: -r[2]):
+        if name.split(".")[0] in PROJECT_ROOTS:
+            print(f"  {self_us / 1000:9.1f} / {cum / 1000:9.1f} ms  {name}")
+
+    print(f"\n🌐 匯入期間的網路連線嘗試：{len(attempts)}")
+    for a in attempts:
+        print(f"  - {a}")
+
+    ok = not attempts and total_s <= args.budget
+    print("\n✅ 符合啟動預算" if ok else f"\n⚠️ 未達標（預算 {args.budget:.2f}s，需 0 次網路連線）")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
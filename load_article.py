@@ -1,57 +1,247 @@
-from pymilvus import Collection, CollectionSchema, FieldSchema, DataType, connections, utility
+#!/usr/bin/env python3
+"""
+衛教知識庫（copd_qa）增量匯入
+
+使用方法:
+python load_article.py                              # 預設匯入 COPD_QA.xlsx
+python load_article.py COPD_QA.xlsx extra_qa.csv    # 多個來源檔（.xlsx / .xls / .csv）
+python load_article.py --dry-run                    # 只列出新增 / 變更 / 刪除筆數
+python load_article.py --rebuild                    # 刪除重建 collection（schema 變更時使用）
+
+每列以「來源檔 + 類別 + 問題」產生穩定主鍵，並以全部欄位內容計算雜湊：
+- 只有新增或內容變更的列才重新向量化，分批（--batch-size）upsert
+- 來源檔中已不存在的列依主鍵刪除（--prune-sources 另外刪除未列出的來源檔的資料）
+- 每批寫入後即為檢查點：中斷後重跑，已寫入的批次雜湊相同會自動略過
+- 寫入前先在 Redis 設「未完成」標記，版本遞增與本地索引匯出完成才清除；
+  中斷後重跑即使沒有差異也會補做，快取與索引不會停在舊內容
+collection 不會被刪除，匯入期間知識查詢照常可用。
+"""
+
+import argparse
+import hashlib
+import os
+import time
+from typing import Dict, List
+
 import pandas as pd
-from embedding import to_vector  # 保留你的向量化邏輯
-
-# 連接到 Milvus
-connections.connect(uri="http://localhost:19530")
-
-# 讀取 Excel QA 表格
-df = pd.read_excel("COPD_QA.xlsx")
-
-# 整理欄位
-categories = df["類別"].astype(str).tolist()
-questions = df["問題（Q）"].astype(str).tolist()
-answers = df["回答（A）"].astype(str).tolist()
-keywords = df["關鍵詞"].fillna("").astype(str).tolist()
-notes = df["注意事項 / 補充說明"].fillna("").astype(str).tolist()
-
-# 合併 Q + A 作為語意輸入向量
-combined_texts = [q + " " + a for q, a in zip(questions, answers)]
-vectors = to_vector(combined_texts)
-VECTOR_DIM = len(vectors[0])
-
-# 建立 Collection schema
-collection_name = "copd_qa"
-if utility.has_collection(collection_name):
-    Collection(collection_name).drop()
-
-fields = [
-    FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-    FieldSchema(name="category", dtype=DataType.VARCHAR, max_length=100),
-    FieldSchema(name="question", dtype=DataType.VARCHAR, max_length=512),
-    FieldSchema(name="answer", dtype=DataType.VARCHAR, max_length=2048),
-    FieldSchema(name="keywords", dtype=DataType.VARCHAR, max_length=512),
-    FieldSchema(name="notes", dtype=DataType.VARCHAR, max_length=512),
-    FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=VECTOR_DIM),
-]
-schema = CollectionSchema(fields=fields, description="COPD QA 資料集")
-collection = Collection(name=collection_name, schema=schema)
-
-# 插入資料
-collection.insert([
-    categories,
-    questions,
-    answers,
-    keywords,
-    notes,
-    vectors
-])
-
-# 建立向量索引
-collection.create_index(
-    field_name="embedding",
-    index_params={"metric_type": "COSINE", "index_type": "IVF_FLAT", "params": {"nlist": 128}},
+from dotenv import load_dotenv
+from pymilvus import Collection, CollectionSchema, FieldSchema, DataType, connections, utility
+
+from embedding import embedding_dim, to_vector  # 保留你的向量化邏輯
+from toolkits.kb_local_index import KB_LOCAL_INDEX, export_from_milvus, exported_version
+from toolkits.redis_store import (
+    bump_kb_version,
+    clear_kb_dirty,
+    get_kb_version,
+    is_kb_dirty,
+    mark_kb_dirty,
 )
 
-collection.load()
-print(f"✅ 已載入 {len(questions)} 筆 QA 資料至 Milvus collection: {collection_name}")
\ No newline at end of file
+load_dotenv()
+
+MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
+COLLECTION_NAME = "copd_qa"
+DEFAULT_SOURCES = ["COPD_QA.xlsx"]
+
+# 來源欄位 → collection 欄位
+COLUMNS = {
+    "類別": "category",
+    "問題（Q）": "question",
+    "回答（A）": "answer",
+    "關鍵詞": "keywords",
+    "注意事項 / 補充說明": "notes",
+}
+CONTENT_FIELDS = list(COLUMNS.values())
+
+
+def row_id(source: str, category: str, question: str, seq: int = 0) -> int:
+    """穩定主鍵：同一來源檔的同一題永遠對應同一個 id（63 位元正整數）。"""
+    key = f"{source}\x1f{category}\x1f{question}\x1f{seq}"
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big") & ((1 << 63) - 1)
+
+
+def content_hash(row: Dict) -> str:
+    return hashlib.sha1("\x1f".join(row[f] for f in CONTENT_FIELDS).encode("utf-8")).hexdigest()
+
+
+def read_source(path: str) -> List[Dict]:
+    df = pd.read_csv(path) if path.lower().endswith(".csv") else pd.read_excel(path)
+    missing = [c for c in COLUMNS if c not in df.columns]
+    if missing:
+        raise SystemExit(f"❌ {path} 缺少欄位: {missing}")
+    source = os.path.basename(path)
+    rows, seen = [], {}
+    for rec in df[list(COLUMNS)].fillna("").astype(str).itertuples(index=False):
+        row = {field: value.strip() for field, value in zip(CONTENT_FIELDS, rec)}
+        if not row["question"]:
+            continue
+        # 同一來源檔出現重複題目時以出現序號區分，主鍵仍然穩定
+        dup_key = (row["category"], row["question"])
+        seq = seen.get(dup_key, 0)
+        seen[dup_key] = seq + 1
+        row["id"] = row_id(source, row["category"], row["question"], seq)
+        row["source"] = source
+        row["content_hash"] = content_hash(row)
+        rows.append(row)
+    return rows
+
+
+def create_collection(dim: int) -> Collection:
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="source", dtype=DataType.VARCHAR, max_length=256),
+        FieldSchema(name="content_hash", dtype=DataType.VARCHAR, max_length=64),
+        FieldSchema(name="category", dtype=DataType.VARCHAR, max_length=100),
+        FieldSchema(name="question", dtype=DataType.VARCHAR, max_length=512),
+        FieldSchema(name="answer", dtype=DataType.VARCHAR, max_length=2048),
+        FieldSchema(name="keywords", dtype=DataType.VARCHAR, max_length=512),
+        FieldSchema(name="notes", dtype=DataType.VARCHAR, max_length=512),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
+    ]
+    schema = CollectionSchema(fields=fields, description="COPD QA 資料集")
+    col = Collection(name=COLLECTION_NAME, schema=schema)
+    col.create_index(
+        field_name="embedding",
+        index_params={"metric_type": "COSINE", "index_type": "IVF_FLAT", "params": {"nlist": 128}},
+    )
+    return col
+
+
+def open_collection(rebuild: bool) -> Collection:
+    if utility.has_collection(COLLECTION_NAME):
+        col = Collection(COLLECTION_NAME)
+        names = {f.name for f in col.schema.fields}
+        if rebuild:
+            col.drop()
+        elif "content_hash" not in names:
+            raise SystemExit(f"❌ {COLLECTION_NAME} 是舊版 schema（auto_id、無 content_hash）；請執行一次 --rebuild")
+        else:
+            col.load()
+            return col
+    col = create_collection(embedding_dim())
+    col.load()
+    return col
+
+
+def existing_hashes(col: Collection, batch: int = 1000) -> Dict[int, Dict]:
+    """目前 collection 中每個主鍵的 {source, content_hash}（即上次寫入到哪裡的檢查點）。"""
+    out, fields = {}, ["id", "source", "content_hash"]
+    if hasattr(col, "query_iterator"):
+        it = col.query_iterator(batch_size=batch, expr="id >= 0", output_fields=fields,
+                                consistency_level="Strong")
+        try:
+            while True:
+                rows = it.next()
+                if not rows:
+                    break
+                out.update({r["id"]: r for r in rows})
+        finally:
+            it.close()
+        return out
+    offset = 0
+    while True:
+        rows = col.query(expr="id >= 0", output_fields=fields, offset=offset, limit=batch,
+                         consistency_level="Strong")
+        if not rows:
+            break
+        out.update({r["id"]: r for r in rows})
+        offset += len(rows)
+    return out
+
+
+def upsert_batch(col: Collection, rows: List[Dict], vectors) -> None:
+    data = [
+        [r["id"] for r in rows],
+        [r["source"] for r in rows],
+        [r["content_hash"] for r in rows],
+        [r["category"] for r in rows],
+        [r["question"] for r in rows],
+        [r["answer"] for r in rows],
+        [r["keywords"] for r in rows],
+        [r["notes"] for r in rows],
+        vectors,
+    ]
+    if hasattr(col, "upsert"):
+        col.upsert(data)
+    else:  # 舊版 pymilvus：先刪後插，主鍵相同故仍可重跑
+        col.delete(f"id in {[r['id'] for r in rows]}")
+        col.insert(data)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="copd_qa 增量匯入")
+    ap.add_argument("sources", nargs="*", default=DEFAULT_SOURCES)
+    ap.add_argument("--batch-size", type=int, default=64, help="每批向量化 / upsert 的列數")
+    ap.add_argument("--prune-sources", action="store_true", help="一併刪除未列在本次來源檔中的資料")
+    ap.add_argument("--rebuild", action="store_true", help="刪除並重建 collection")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    rows: List[Dict] = []
+    for path in args.sources:
+        src_rows = read_source(path)
+        print(f"📄 {path}: {len(src_rows)} 筆")
+        rows.extend(src_rows)
+
+    # 同一來源檔被重複列出時主鍵相同，只保留一份
+    wanted = {r["id"]: r for r in rows}
+
+    connections.connect(uri=MILVUS_URI)
+    col = open_collection(args.rebuild and not args.dry_run)
+    current = existing_hashes(col)
+
+    sources = {os.path.basename(p) for p in args.sources}
+    changed = [r for r in wanted.values() if current.get(r["id"], {}).get("content_hash") != r["content_hash"]]
+    stale = [
+        doc_id for doc_id, r in current.items()
+        if doc_id not in wanted and (args.prune_sources or r["source"] in sources)
+    ]
+    print(f"🧮 共 {len(wanted)} 筆：未變更 {len(wanted) - len(changed)}、"
+          f"新增/變更 {len(changed)}、刪除 {len(stale)}")
+    if args.dry_run:
+        return
+
+    if changed or stale:
+        mark_kb_dirty()
+
+    t0, done = time.time(), 0
+    for i in range(0, len(changed), args.batch_size):
+        batch = changed[i:i + args.batch_size]
+        # 合併 Q + A 作為語意輸入向量
+        vectors = to_vector([r["question"] + " " + r["answer"] for r in batch])
+        upsert_batch(col, batch, vectors)
+        done += len(batch)
+        print(f"  ⬆️ {done}/{len(changed)} 筆（{time.time() - t0:.1f}s）")
+
+    for i in range(0, len(stale), 1000):
+        col.delete(f"id in {stale[i:i + 1000]}")
+    if stale:
+        print(f"🗑️ 已刪除 {len(stale)} 筆過時資料")
+
+    if not changed and not stale:
+        if is_kb_dirty():
+            print("↩️ 上次匯入在遞增版本前中斷，補做版本更新")
+        else:
+            # 內容一致；只確認本地索引已匯出到目前版本
+            kb_version = get_kb_version()
+            if KB_LOCAL_INDEX and exported_version() != kb_version:
+                print(f"📦 已補匯出本地索引: {export_from_milvus(col, kb_version)}")
+            print("✅ 知識庫內容無變更")
+            return
+
+    col.flush()
+    # 知識庫內容已變更 → 遞增版本，讓語意回答快取與本地索引失效
+    try:
+        kb_version = bump_kb_version()
+        print(f"🔄 知識庫版本更新為 {kb_version}")
+        if KB_LOCAL_INDEX:
+            # 匯出行程內索引（mmap .npy + metadata），worker 偵測到新版本時直接載入
+            print(f"📦 已匯出本地索引: {export_from_milvus(col, kb_version)}")
+        clear_kb_dirty()
+    except Exception as e:
+        print(f"⚠️ 無法更新知識庫版本（已保留未完成標記，重跑即可補做）: {e}")
+    print(f"✅ 已同步 {len(wanted)} 筆 QA 資料至 Milvus collection: {COLLECTION_NAME}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ import time
 from typing import Optional
 
 from crewai import Crew, Task
-from flask import Flask, abort, request
+from flask import Flask, abort, jsonify, request
 from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import (
@@ -18,27 +18,65 @@ from linebot.v3.messaging import (
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
 from pymilvus import connections
 
+from embedding import embedding_batcher, embedding_cache, to_vector
 from HealthBot.agent import (
-    build_prompt_from_redis,
-    create_guardrail_agent,
+    ContextAssembly,
     create_health_companion,
+    ensure_memory_collection,
     finalize_session,
+    summarize_session,
 )
+from HealthBot.guardrail import check_input, guard_stats, prewarm_guardrail
 from toolkits.redis_store import (
+    IDLE_TRACKING,
+    PROCESSING_LEASE_MS,
     append_audio_segment,
     append_round,
+    claim_webhook_event,
+    ensure_job_group,
     get_audio_result,
     get_redis,
+    last_active_ms,
     make_request_id,
+    peek_audio_segments,
     peek_next_n,
-    read_and_clear_audio_segments,
+    purge_user_session,
+    reclaim_failed_webhook_event,
     set_audio_result,
     set_state_if,
+    set_webhook_event_status,
+    state_key,
+    touch_idle,
+    trim_audio_segments,
     try_register_request,
+    webhook_event_key,
+    xack_job,
     xadd_alert,
+    xadd_job,
+    xclaim_stale_jobs,
+    xread_jobs,
 )
-from toolkits.tools import summarize_chunk_and_commit
-from utils.db_connectors import get_user_profile
+from toolkits.agent_pool import AgentPool
+from toolkits.answer_cache import answer_cache, is_knowledge_query
+from toolkits.coalesce import COALESCE_ENABLED, CoalesceScheduler, note_message
+from toolkits.context import (
+    begin_turn,
+    bind_user_id,
+    end_turn,
+    reset_user_id,
+    turn_has,
+    turn_note,
+)
+from toolkits.executor import UserLaneExecutor
+from toolkits.idle_scheduler import ClusterIdleFinalizer, IdleScheduler
+from toolkits.kb_keyword_index import get_keyword_index, milvus_rows
+from toolkits.kb_local_index import get_local_index
+from toolkits.state_lease import processing_leases
+from toolkits.tools import generate_kb_answer, get_qa_collection, summarize_chunk_and_commit
+from toolkits.warmup import WarmupRunner
+from utils.db_connectors import get_postgres_connection
+from utils.line_pusher import reply_or_push, warm_line_connection
+from utils.llm_client import get_openai_client
 from datetime import datetime
 import json
 
@@ -85,26 +123,46 @@ line_config = Configuration(access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN",
 line_handler = WebhookHandler(
     os.getenv("LINE_CHANNEL_SECRET", "")
 )  # 請在 .env 和 LINE Console 中補上 Channel Secret
+_line_api = None
+_line_api_lock = threading.Lock()
+
+
+def get_line_api() -> MessagingApi:
+    """共用的 MessagingApi（底層連線池跨請求重用），第一次使用時才建立。"""
+    global _line_api
+    if _line_api is None:
+        with _line_api_lock:
+            if _line_api is None:
+                _line_api = MessagingApi(ApiClient(line_config))
+    return _line_api
 
 SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", 5))
+# inline：webhook 內直接跑完整流程；queue：webhook 只驗簽並寫入 Redis Stream，由 worker.py 處理
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline").lower()
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 300))
+RUN_IDLE_FINALIZER = os.getenv("RUN_IDLE_FINALIZER", "1") == "1"
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_CLAIM_IDLE_MS = int(os.getenv("JOB_CLAIM_IDLE_MS", 300000))
+JOB_MAX_INFLIGHT = int(os.getenv("JOB_MAX_INFLIGHT", 32))
 
 
 class AgentManager:
-    def __init__(self):
-        self.guardrail_agent = create_guardrail_agent()
-        self.health_agent_cache = {}
+    """
+    Agent 不再綁定使用者：Companion 使用有上限的共用池，每次請求借出一個獨佔使用
+    （CrewAI Agent 非執行緒安全），用完歸還給任何使用者重用。Guardrail 由 HealthBot.guardrail 管理。
+    """
 
-    def get_guardrail(self):
-        return self.guardrail_agent
+    def __init__(self):
+        self.health_pool = AgentPool(create_health_companion, name="companion")
 
-    def get_health_agent(self, user_id: str):
-        if user_id not in self.health_agent_cache:
-            self.health_agent_cache[user_id] = create_health_companion(user_id)
-        return self.health_agent_cache[user_id]
+    def lease_health_agent(self):
+        return self.health_pool.lease()
 
-    def release_health_agent(self, user_id: str):
-        if user_id in self.health_agent_cache:
-            del self.health_agent_cache[user_id]
+    def stats(self) -> dict:
+        return {
+            "guardrail": guard_stats(),
+            "companion": self.health_pool.stats(),
+        }
 
 
 # ---- Persist & maybe summarize ----
@@ -140,39 +198,38 @@ def handle_user_message(
         append_audio_segment(user_id, audio_id, query)
         return "👌 已收到語音片段"
 
-    # 2) 音檔級鎖：一次且只一次處理同一段音檔
+    # 2) 音檔級鎖：一次且只一次處理同一段音檔；上次處理失敗（FAILED）的可由重試重新取得。
+    #    PROCESSING 只有短 TTL、處理期間持續續約：處理中的行程當掉時鎖會自動過期，接手的重試可重新取得
     lock_id = f"{user_id}#audio:{audio_id}"
-    if not set_state_if(lock_id, expect="", to="PROCESSING"):
+    if not (
+        set_state_if(lock_id, expect="", to="PROCESSING", ttl_ms=PROCESSING_LEASE_MS)
+        or set_state_if(lock_id, expect="FAILED", to="PROCESSING", ttl_ms=PROCESSING_LEASE_MS)
+    ):
         # 可能已處理或處理中 → 回快取或提示
         cached = get_audio_result(user_id, audio_id)
         return cached or "我正在處理你的語音，請稍等一下喔。"
+    processing_leases.hold(state_key(lock_id))
 
+    # 以請求範圍的 context 傳遞使用者 ID 供工具使用（不寫入行程層級環境變數）
+    ctx_token = bind_user_id(user_id)
+    turn_token = begin_turn()
+    segments = []
     try:
-        # 3) 合併之前緩衝的 partial → 最終要處理的全文
-        head = read_and_clear_audio_segments(user_id, audio_id)
+        # 3) 合併之前緩衝的 partial → 最終要處理的全文（成功後才清除緩衝，失敗重試時仍在）
+        segments = peek_audio_segments(user_id, audio_id)
+        head = " ".join(p for p in segments if p)
         full_text = (head + " " + query).strip() if head else query
 
         # 4)【核心流程】
-        # 設置環境變數供工具使用
-        os.environ["CURRENT_USER_ID"] = user_id
-
-        # a. 呼叫 Guardrail
-        guard = agent_manager.get_guardrail()
-        guard_task = Task(
-            description=(
-                f"判斷是否需要攔截：「{full_text}」。"
-                "務必使用 model_guardrail 工具進行判斷；"
-                "安全回 OK；需要攔截時回 BLOCK: <原因>（僅此兩種）。"
-            ),
-            expected_output="OK 或 BLOCK: <原因>",
-            agent=guard,
-        )
-        guard_res = (
-            Crew(agents=[guard], tasks=[guard_task], verbose=False).kickoff().raw or ""
-        ).strip()
+        # 4.0) 與 Guardrail 同時先行組裝上下文（Profile / MTM / STM / LTM-RAG），若被攔截就丟棄
+        assembly = ContextAssembly(user_id, current_input=full_text, k=6)
+
+        # a. 呼叫 Guardrail（預設直接呼叫分類器，GUARDRAIL_MODE=crew 時走 Crew 編排）
+        guard_res = check_input(full_text)
         if guard_res.startswith("BLOCK:"):
+            assembly.discard()
             reason = guard_res[6:].strip()
-            # 檢查是否涉及自傷風險，需要通報個管師
+            # 檢查是否涉及自傷風險，需要通報個管師（本地詞庫命中明確自傷意圖時原因即含「自傷」，不經 LLM）
             if any(k in reason for k in ["自傷", "自殺", "傷害自己", "緊急"]):
                 xadd_alert(
                     user_id=user_id,
@@ -184,15 +241,22 @@ def handle_user_message(
             log_session(user_id, full_text, reply)
             return reply
 
+        # 4.1) 知識型問題先查語意回答快取：命中就直接重用先前有知識庫依據的回答
+        knowledge_q = is_knowledge_query(full_text)
+        if knowledge_q:
+            cached_answer = answer_cache.lookup(assembly.query_vector())
+            if cached_answer:
+                assembly.discard()
+                set_audio_result(user_id, audio_id, cached_answer)
+                log_session(user_id, full_text, cached_answer)
+                return cached_answer
+
         # 4.2) 【新增】在所有 Agent 運作前，優先讀取使用者畫像 (Profile)
-        profile_data = get_user_profile(user_id)
+        profile_data = assembly.profile()
         profile_str = json.dumps(profile_data, ensure_ascii=False, indent=2) if profile_data else "尚無使用者畫像資訊"
         # 4.3) 建構基礎上下文（包含自動 LTM-RAG）
-        ctx = build_prompt_from_redis(user_id, k=6, current_input=full_text)
-        # 4.4) 建立 Companion Agent 並組合最終任務
-        care_agent = agent_manager.get_health_agent(user_id)
-        
-        # 組合所有資訊到模板中
+        ctx = assembly.prompt_context()
+        # 4.4) 組合最終任務（使用者個人狀態全部來自 Prompt，Agent 由共用池借出）
         final_description = COMPANION_PROMPT_TEMPLATE.format(
             now=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             profile_data=profile_str,
@@ -202,51 +266,140 @@ def handle_user_message(
             query=full_text
         )
 
-        task = Task(
-            description=final_description,
-            expected_output="一句簡潔、溫暖、符合金孫人設的中文回覆。",
-            agent=care_agent,
-        )
-        
-        # CrewAI 執行任務。Agent 會在此步驟中自主決定是否使用 SearchMilvusTool
-        # 其結果會被 CrewAI 自動注入到後續的思考鏈中
-        res = (Crew(agents=[care_agent], tasks=[task], verbose=False).kickoff().raw or "")
+        with agent_manager.lease_health_agent() as care_agent:
+            task = Task(
+                description=final_description,
+                expected_output="一句簡潔、溫暖、符合金孫人設的中文回覆。",
+                agent=care_agent,
+            )
 
-        # 5) 結果快取與狀態更新
+            # CrewAI 執行任務。Agent 會在此步驟中自主決定是否使用 SearchMilvusTool
+            # 其結果會被 CrewAI 自動注入到後續的思考鏈中
+            res = (Crew(agents=[care_agent], tasks=[task], verbose=False).kickoff().raw or "")
+
+        # 5) 結果快取與狀態更新：本輪確實查到衛教知識的知識型問題，另於背景生成
+        #    只依知識庫、不含使用者上下文的通用回答寫入快取（個人化回覆 res 不進快取）
+        if knowledge_q and turn_has("kb_grounded"):
+            kb_context = turn_note("kb_context")
+            answer_cache.store_generated(
+                full_text, assembly.query_vector(), lambda: generate_kb_answer(full_text, kb_context)
+            )
         set_audio_result(user_id, audio_id, res)
         log_session(user_id, full_text, res)
         return res
 
+    except Exception:
+        # 失敗：鎖標為 FAILED 讓重試 / 重送能重新處理，緩衝片段保留
+        set_state_if(lock_id, expect="PROCESSING", to="FAILED")
+        raise
     finally:
-        set_state_if(lock_id, expect="PROCESSING", to="FINALIZED")
+        processing_leases.release(state_key(lock_id))
+        end_turn(turn_token)
+        reset_user_id(ctx_token)
+        # 成功才會從 PROCESSING 轉為 FINALIZED（失敗時已是 FAILED），並移除已處理的片段
+        if set_state_if(lock_id, expect="PROCESSING", to="FINALIZED"):
+            trim_audio_segments(user_id, audio_id, len(segments))
 
 
-class UserSession:
-    def __init__(self, user_id: str, agent_manager: AgentManager, timeout: int = 300):
-        self.user_id = user_id
-        self.agent_manager = agent_manager
-        self.timeout = timeout
-        self.last_active_time = None
-        self.stop_event = threading.Event()
-        threading.Thread(target=self._watchdog, daemon=True).start()
+agent_manager = AgentManager()
+# 同一使用者依序處理、不同使用者平行處理
+lane_executor = UserLaneExecutor()
+# 連發訊息合併：安靜期在計時執行緒上等待，到期才排入 lane（lane 上不 sleep）
+coalescer = CoalesceScheduler(lane_executor.submit) if COALESCE_ENABLED else None
 
-    def update_activity(self):
-        self.last_active_time = time.time()
 
-    def _watchdog(self):
-        while not self.stop_event.is_set():
-            time.sleep(5)
-            if self.last_active_time and (
-                time.time() - self.last_active_time > self.timeout
-            ):
-                print(f"\n⏳ 閒置超過 {self.timeout}s，開始收尾...")
-                finalize_session(self.user_id)
-                self.agent_manager.release_health_agent(self.user_id)
-                self.stop_event.set()
+def _purge_if_idle(user_id: str, is_active) -> None:
+    # 在 lane 上執行（不與處理中的訊息交錯）：摘要期間使用者又傳訊息就保留 STM
+    if is_active(user_id):
+        set_state_if(user_id, expect="FINALIZING", to="ACTIVE")
+        print(f"[Idle] {user_id} 已重新活躍，保留短期記憶")
+        return
+    purge_user_session(user_id)
 
 
-agent_manager = AgentManager()
-session_pool = {}
+def _on_session_idle(user_id: str) -> None:
+    if IDLE_TRACKING == "redis":
+        # 收尾由 ClusterIdleFinalizer 負責
+        return
+    if idle_scheduler.is_live(user_id):
+        return
+    print(f"\n⏳ {user_id} 閒置超過 {SESSION_IDLE_TIMEOUT}s，開始收尾...")
+    # 多次 LLM 呼叫的摘要在收尾執行緒池上執行，不佔用 lane（同 lane 的其他使用者不被阻塞）；
+    # 只有最後的 purge 排入該使用者的 lane
+    summarize_session(user_id)
+    lane_executor.submit(user_id, _purge_if_idle, user_id, idle_scheduler.is_live).result()
+
+
+def _cluster_user_active(user_id: str) -> bool:
+    # 認領時已移出閒置集合；之後任何 replica 收到訊息都會以新的時間重新寫入
+    last = last_active_ms(user_id)
+    return last is not None and last > time.time() * 1000 - SESSION_IDLE_TIMEOUT * 1000
+
+
+def _on_cluster_idle(user_id: str) -> None:
+    # 認領後使用者可能又傳了訊息：重新確認仍閒置才收尾，purge 前在 lane 上再確認一次
+    if _cluster_user_active(user_id):
+        print(f"[Idle] {user_id} 已重新活躍，略過收尾")
+        return
+    print(f"\n⏳ [叢集] {user_id} 閒置超過 {SESSION_IDLE_TIMEOUT}s，開始收尾...")
+    summarize_session(user_id)
+    lane_executor.submit(user_id, _purge_if_idle, user_id, _cluster_user_active).result()
+
+
+# 全行程共用一個閒置計時器（取代每位使用者一條 watchdog 執行緒）
+idle_scheduler = IdleScheduler(SESSION_IDLE_TIMEOUT, _on_session_idle)
+cluster_finalizer = (
+    ClusterIdleFinalizer(SESSION_IDLE_TIMEOUT, _on_cluster_idle).start()
+    if IDLE_TRACKING == "redis" and RUN_IDLE_FINALIZER
+    else None
+)
+
+
+def touch_session(user_id: str) -> None:
+    idle_scheduler.touch(user_id)  # 更新活動時間
+    if IDLE_TRACKING == "redis":
+        # 收到訊息當下就寫入叢集閒置集合，收尾者重新確認時才看得到處理中的對話
+        touch_idle(user_id)
+
+
+def _warm_postgres() -> None:
+    conn = get_postgres_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+    finally:
+        conn.close()
+
+
+def _warm_line() -> None:
+    get_line_api().get_bot_info()  # SDK 連線池（inline 回覆）
+    warm_line_connection()  # requests 連線池（queue 模式 reply/push）
+
+
+def _warm_knowledge_base() -> None:
+    # 本地索引（KB_LOCAL_INDEX=1）可用時不必載入 Milvus collection
+    local = get_local_index(get_qa_collection)
+    if local is not None:
+        get_keyword_index(lambda: local.rows)
+    else:
+        get_keyword_index(milvus_rows(get_qa_collection()))
+
+
+def _warm_agents() -> None:
+    agent_manager.health_pool.prewarm(1)
+    prewarm_guardrail()
+
+
+# 開機暖機：各依賴平行預熱，全部完成前 /healthz/ready 回 503
+warmup = WarmupRunner()
+warmup.register("redis", lambda: get_redis().ping())
+warmup.register("postgres", _warm_postgres)
+warmup.register("milvus:user_memory", ensure_memory_collection)
+warmup.register("milvus:copd_qa", _warm_knowledge_base)
+warmup.register("openai", lambda: get_openai_client().models.retrieve(os.getenv("MODEL_NAME", "gpt-4o-mini")))
+warmup.register("embedding", lambda: to_vector("暖機"))
+warmup.register("agents", _warm_agents)
+warmup.register("line", _warm_line, required=os.getenv("WARMUP_REQUIRE_LINE", "1") == "1")
 
 
 # --- Flask Webhook 端點 ---
@@ -256,43 +409,275 @@ def webhook():
     body = request.get_data(as_text=True)
 
     try:
-        line_handler.handle(body, signature)
+        if WEBHOOK_MODE == "queue":
+            enqueue_webhook_events(body, signature)
+        else:
+            outcomes = dispatch_webhook_events(body, signature)
+            if "failed" in outcomes.values():
+                # 回非 2xx 讓 LINE 重送；已完成的事件重送時會被 webhookEventId 去重
+                return "PARTIAL FAILURE", 500
     except InvalidSignatureError:
         abort(400)
 
     return "OK"
 
 
-@line_handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event):
+@app.route("/healthz/ready", methods=["GET"])
+def readiness():
+    # 以 WSGI 伺服器啟動時不會經過 run_app()，由第一次探測觸發暖機
+    warmup.start()
+    stats = warmup.stats()
+    return jsonify(stats), (200 if stats["ready"] else 503)
+
+
+@app.route("/healthz/sessions", methods=["GET"])
+def session_stats():
+    stats = {
+        "local": idle_scheduler.stats(),
+        "agents": agent_manager.stats(),
+        "answer_cache": answer_cache.stats(),
+        "embed_cache": embedding_cache.stats(),
+        "embed_batcher": embedding_batcher.stats(),
+        "coalesce_pending": coalescer.pending() if coalescer is not None else 0,
+    }
+    if cluster_finalizer is not None:
+        stats["cluster"] = cluster_finalizer.stats()
+    return jsonify(stats)
+
+
+def _is_text_event(event) -> bool:
+    return isinstance(event, MessageEvent) and isinstance(
+        event.message, TextMessageContent
+    )
+
+
+def _event_id(event, idx: int) -> str:
+    return getattr(event, "webhook_event_id", None) or f"noid-{idx}"
+
+
+def _claim_event(event) -> str:
+    """
+    依 webhookEventId 去重：首次出現回 "new"、「重送且上次失敗」回 "retry"，其餘回 "" 表示略過。
+    LINE 重送（deliveryContext.isRedelivery）時，已完成/處理中/已入列的事件一律略過；
+    處理中的 PROCESSING 為短 TTL 並持續續約，處理的行程當掉後狀態過期，重送會被視為新事件。
+    失敗事件的訊息鎖為 FAILED、緩衝未清除，重送時 handle_user_message 會完整重新處理。
+    """
+    event_id = getattr(event, "webhook_event_id", None)
+    if not event_id:
+        return "new"
+    prev = claim_webhook_event(event_id)
+    if prev is None:
+        return "new"
+    delivery = getattr(event, "delivery_context", None)
+    if (
+        prev == "FAILED"
+        and getattr(delivery, "is_redelivery", False)
+        and reclaim_failed_webhook_event(event_id)
+    ):
+        return "retry"
+    print(f"[去重] 略過重複的 webhook 事件 {event_id}（狀態: {prev}）")
+    return ""
+
+
+def dispatch_webhook_events(body: str, signature: str) -> dict:
+    """
+    將一個 webhook payload 拆成事件並行處理：同一使用者的事件依序排入同一條 lane，
+    不同使用者平行；等待全部完成後回傳各事件結果（done/failed/duplicate/ignored）。
+    """
+    events = line_handler.parser.parse(body, signature)
+    outcomes = {}
+    futures = {}
+    for idx, event in enumerate(events):
+        event_id = _event_id(event, idx)
+        if not _is_text_event(event):
+            outcomes[event_id] = "ignored"
+            continue
+        claim = _claim_event(event)
+        if not claim:
+            outcomes[event_id] = "duplicate"
+            continue
+        user_id = event.source.user_id
+        if not event_id.startswith("noid-"):
+            # 處理期間續約 PROCESSING；行程當掉時狀態自動過期，LINE 重送不會被當成重複而丟棄
+            processing_leases.hold(webhook_event_key(event_id))
+        if coalescer is not None:
+            # 收件當下就寫入合併緩衝（重送的失敗事件文字仍在緩衝中，不重複寫入）
+            seq = note_message(user_id, event.message.text, buffer=claim == "new")
+            futures[event_id] = coalescer.submit(
+                user_id, seq, lambda text, e=event: handle_message(e, text)
+            )
+        else:
+            futures[event_id] = lane_executor.submit(user_id, handle_message, event)
+    for event_id, fut in futures.items():
+        try:
+            fut.result()
+            outcomes[event_id] = "done"
+            status = "DONE"
+        except Exception as e:
+            print(f"❌ [Webhook] 事件 {event_id} 處理失敗: {e}")
+            outcomes[event_id] = "failed"
+            status = "FAILED"
+        if not event_id.startswith("noid-"):
+            processing_leases.release(webhook_event_key(event_id))
+            set_webhook_event_status(event_id, status)
+    if len(events) > 1:
+        print(f"📦 [Webhook] 本次 payload 共 {len(events)} 個事件: {outcomes}")
+    return outcomes
+
+
+def enqueue_webhook_events(body: str, signature: str) -> int:
+    """驗簽後把文字訊息事件寫入工作 Stream，不做任何 LLM 處理；回傳入列筆數。"""
+    events = line_handler.parser.parse(body, signature)
+    n = 0
+    for idx, event in enumerate(events):
+        if not _is_text_event(event):
+            continue
+        claim = _claim_event(event)
+        if not claim:
+            continue
+        event_id = getattr(event, "webhook_event_id", None) or ""
+        try:
+            seq = (
+                note_message(event.source.user_id, event.message.text, buffer=claim == "new")
+                if COALESCE_ENABLED
+                else ""
+            )
+            xid = xadd_job(
+                {
+                    "user_id": event.source.user_id,
+                    "text": event.message.text,
+                    "message_id": event.message.id,
+                    "reply_token": event.reply_token,
+                    "event_ts": event.timestamp,
+                    "event_id": event_id,
+                    "coalesce_seq": seq,
+                    "attempt": 0,
+                }
+            )
+        except Exception:
+            if event_id:
+                set_webhook_event_status(event_id, "FAILED")
+            raise
+        if event_id:
+            set_webhook_event_status(event_id, "QUEUED")
+        print(f"📥 [Queue] {event.source.user_id} 的訊息已入列 ({xid})")
+        n += 1
+    return n
+
+
+def handle_message(event, query: Optional[str] = None):
+    """處理單一文字訊息事件（於該使用者的 lane 上執行）；query 為合併後的連發訊息文字。"""
     user_id = event.source.user_id
-    query = event.message.text
+    query = query or event.message.text
 
     print(f"收到來自 {user_id} 的訊息: {query}")
 
-    # 確保每個使用者都有一個 session
-    if user_id not in session_pool:
-        session_pool[user_id] = UserSession(user_id, agent_manager)
-
-    session = session_pool[user_id]
-    session.update_activity()  # 更新活動時間
+    touch_session(user_id)
 
-    # 呼叫您現有的核心處理邏輯
-    reply_text = handle_user_message(agent_manager, user_id, query)
+    # 呼叫您現有的核心處理邏輯；以 LINE message id 當處理鎖 ID，重送時直接回快取
+    reply_text = handle_user_message(
+        agent_manager, user_id, query, audio_id=event.message.id
+    )
 
     # 使用 LINE SDK 回覆訊息
-    with ApiClient(line_config) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(
-                reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]
-            )
+    get_line_api().reply_message_with_http_info(
+        ReplyMessageRequest(
+            reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]
         )
+    )
+
+
+# --- Queue worker ---
+
+
+def process_job(fields: dict, query: Optional[str] = None) -> None:
+    user_id = fields["user_id"]
+    query = query or fields.get("text", "")
+    print(f"收到來自 {user_id} 的訊息（queue）: {query}")
+
+    touch_session(user_id)
+    # 以 LINE message id 當處理鎖 ID：重送的同一則訊息只會處理一次，之後直接回快取
+    reply_text = handle_user_message(
+        agent_manager, user_id, query, audio_id=fields.get("message_id") or None
+    )
+    delivered = reply_or_push(
+        user_id,
+        fields.get("reply_token"),
+        reply_text,
+        int(fields.get("event_ts") or 0),
+    )
+    if not delivered:
+        # 拋出讓工作重新入列；回覆已由 set_audio_result 快取，重試不會再跑 LLM
+        raise RuntimeError(f"回覆與 Push 皆失敗，無法送達 {user_id}")
+
+
+def _run_job(consumer: str, xid: str, fields: dict) -> None:
+    try:
+        process_job(fields)
+    except Exception as e:
+        _finish_job(consumer, xid, fields, e)
+    else:
+        _finish_job(consumer, xid, fields, None)
+
+
+def _finish_job(consumer: str, xid: str, fields: dict, error: Optional[BaseException]) -> None:
+    """成功標記 DONE；失敗則重新入列（保留 coalesce_seq，緩衝仍在），超過次數標記 FAILED。最後 ack。"""
+    event_id = fields.get("event_id")
+    if error is None:
+        if event_id:
+            set_webhook_event_status(event_id, "DONE")
+    else:
+        attempt = int(fields.get("attempt") or 0) + 1
+        if attempt < JOB_MAX_ATTEMPTS:
+            print(f"❌ [Worker {consumer}] 工作 {xid} 失敗（第 {attempt} 次），重新入列: {error}")
+            xadd_job({**fields, "attempt": attempt})
+        else:
+            print(f"❌ [Worker {consumer}] 工作 {xid} 已失敗 {attempt} 次，放棄: {error}")
+            if event_id:
+                set_webhook_event_status(event_id, "FAILED")
+    xack_job(xid)
+
+
+def run_job_worker(consumer: str, stop_event: threading.Event) -> None:
+    """
+    持續消費工作 Stream，依 user_id 分派到 lane_executor：同一使用者依序、跨使用者平行。
+    啟動時與每輪讀取前會先接手逾時未 ack 的工作。
+    """
+    ensure_job_group()
+    inflight = threading.BoundedSemaphore(JOB_MAX_INFLIGHT)
+    print(f"🛠️ [Worker {consumer}] 開始消費 Redis Stream")
+    while not stop_event.is_set():
+        try:
+            jobs = xclaim_stale_jobs(consumer, JOB_CLAIM_IDLE_MS) or xread_jobs(
+                consumer
+            )
+        except Exception as e:
+            print(f"❌ [Worker {consumer}] 讀取 Stream 失敗: {e}")
+            time.sleep(1)
+            continue
+        for xid, fields in jobs:
+            # 限制在途工作數，避免 lane 塞滿時仍不斷從 Stream 拉取
+            inflight.acquire()
+            user_id = fields.get("user_id", "")
+            if coalescer is not None and fields.get("coalesce_seq"):
+                # 安靜期在計時執行緒上等待；結果（含已併入後續訊息）回來後才標記狀態並 ack
+                fut = coalescer.submit(
+                    user_id,
+                    int(fields["coalesce_seq"]),
+                    lambda text, f=fields: process_job(f, text),
+                )
+                fut.add_done_callback(
+                    lambda f, x=xid, fl=fields: _finish_job(consumer, x, fl, f.exception())
+                )
+            else:
+                fut = lane_executor.submit(user_id, _run_job, consumer, xid, fields)
+            fut.add_done_callback(lambda _f: inflight.release())
 
 
 def run_app():
     # 啟動 Flask 應用
     # 注意：在生產環境中應使用 Gunicorn 或其他 WSGI 伺服器
+    warmup.start()
     app.run(port=5000, debug=True, use_reloader=False)
 
 
@@ -302,25 +687,32 @@ def main() -> None:
     )
     am = AgentManager()
     uid = os.getenv("TEST_USER_ID", "test_user")
-    sess = UserSession(uid, am)
+    finalized = threading.Event()
+
+    def _on_idle(user_id: str) -> None:
+        print(f"\n⏳ 閒置超過 {SESSION_IDLE_TIMEOUT}s，開始收尾...")
+        finalize_session(user_id)
+        finalized.set()
+
+    idle = IdleScheduler(SESSION_IDLE_TIMEOUT, _on_idle, workers=1)
     print("✅ 啟動完成，閒置 5 分鐘：補分段摘要→Refine→Purge")
     try:
-        am.get_health_agent(uid)
-        while not sess.stop_event.is_set():
+        am.health_pool.prewarm(1)
+        while not finalized.is_set():
             try:
                 q = input("🧓 長輩：").strip()
             except (KeyboardInterrupt, EOFError):
                 break
             if not q:
                 continue
-            sess.update_activity()
+            idle.touch(uid)
             a = handle_user_message(am, uid, q)
             print("👧 金孫：", a)
     finally:
-        if not sess.stop_event.is_set():
+        idle.stop()
+        if not finalized.is_set():
             print("\n📝 結束對話：收尾...")
             finalize_session(uid)
-        am.release_health_agent(uid)
         print("👋 系統已關閉")
 
 
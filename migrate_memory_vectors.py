@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+user_memory 向量格式遷移與「召回率 vs 記憶體」報告
+
+使用方法:
+python migrate_memory_vectors.py report  --source user_memory --dims 1536,768,512,256
+python migrate_memory_vectors.py migrate --source user_memory --target user_memory_f16 --mode float16 --dim 768
+python migrate_memory_vectors.py migrate --source user_memory --target user_memory_pk --mode float32 --partition-key
+
+report：抽樣既有向量，離線模擬 float32 / float16 / int8(SQ8) 與各截短維度，
+        以同一使用者內 leave-one-out 的 top-k 與 MEM_THRESHOLD 判定和 float32 全維比較。
+migrate：建立新格式（可選 user_id partition key 佈局）的 collection 並分批複製（text/user_id/updated_at 原樣保留），
+        完成後把 MEM_COLLECTION 與 MEM_VECTOR_MODE / MEM_VECTOR_DIM / MEM_PARTITION_KEY 指向新設定即可切換。
+        新 collection 的主鍵會重新產生；應用程式偵測到 MEM_COLLECTION 變更時會自動重建每人的 LTM 索引。
+"""
+
+import argparse
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, List
+
+import numpy as np
+from dotenv import load_dotenv
+from pymilvus import Collection, connections, utility
+
+from toolkits import mem_vectors
+
+load_dotenv()
+
+MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
+MEM_THRESHOLD = float(os.getenv("MEM_THRESHOLD", "0.80"))
+FIELDS = ["user_id", "updated_at", "text", "embedding"]
+
+
+def iter_rows(col: Collection, batch: int) -> Iterator[List[Dict]]:
+    """分批讀出所有記錄；有 query_iterator 就用（不受 offset+limit 上限影響）。"""
+    if hasattr(col, "query_iterator"):
+        it = col.query_iterator(batch_size=batch, expr="id >= 0", output_fields=FIELDS)
+        try:
+            while True:
+                rows = it.next()
+                if not rows:
+                    break
+                yield rows
+        finally:
+            it.close()
+        return
+    offset = 0
+    while True:
+        rows = col.query(expr="id >= 0", output_fields=FIELDS, offset=offset, limit=batch)
+        if not rows:
+            break
+        yield rows
+        offset += len(rows)
+
+
+def source_dim(col: Collection) -> int:
+    for f in col.schema.fields:
+        if f.name == "embedding":
+            return int(f.params["dim"])
+    raise ValueError(f"{col.name} 沒有 embedding 欄位")
+
+
+def migrate(source: str, target: str, mode: str, dim: int, batch: int, drop: bool,
+            partition_key: bool = False, num_partitions: int = mem_vectors.MEM_NUM_PARTITIONS) -> None:
+    src = Collection(source)
+    src.load()
+    new_dim = mem_vectors.target_dim(source_dim(src), dim)
+    if utility.has_collection(target):
+        if not drop:
+            raise SystemExit(f"❌ {target} 已存在；確認要覆蓋請加 --drop-target")
+        Collection(target).drop()
+    dst = mem_vectors.create_memory_collection(target, new_dim, mode, partition_key, num_partitions)
+    t0, copied = time.time(), 0
+    for rows in iter_rows(src, batch):
+        dst.insert([
+            [r["user_id"] for r in rows],
+            [r["updated_at"] for r in rows],
+            [r["text"] for r in rows],
+            # encode 會先把 float16 位元組解碼成 float32，可從壓縮格式的 collection 遷移
+            [mem_vectors.encode(r["embedding"], new_dim, mode) for r in rows],
+        ])
+        copied += len(rows)
+        print(f"  … 已複製 {copied} 筆")
+    dst.flush()
+    dst.load()
+    layout = f"partition key ×{num_partitions}" if partition_key else "flat"
+    print(f"✅ {source} → {target}（{mode}, {new_dim} 維, {layout}）：{copied} 筆，{time.time() - t0:.1f}s")
+    print(f"   切換方式：MEM_COLLECTION={target} MEM_VECTOR_MODE={mode} MEM_VECTOR_DIM={new_dim if dim else 0}"
+          f" MEM_PARTITION_KEY={int(partition_key)}")
+
+
+def recall_table(user_ids: List[str], mat: np.ndarray, modes: List[str], dims: List[int],
+                 k: int, threshold: float) -> List[Dict]:
+    """
+    以 float32 全維為基準：每筆向量當查詢，在同一使用者的其他記錄中取 top-k。
+    recall@k = 壓縮後 top-k 與基準 top-k 的交集比例；thr_agree = top-1 是否過 threshold 的判定一致率。
+    """
+    groups = defaultdict(list)
+    for i, u in enumerate(user_ids):
+        groups[u].append(i)
+    groups = {u: np.array(ix) for u, ix in groups.items() if len(ix) > 1}
+    base = mem_vectors.simulate(mat, 0, "float32")
+
+    def topk(vecs: np.ndarray, ix: np.ndarray):
+        s = vecs[ix] @ vecs[ix].T
+        np.fill_diagonal(s, -np.inf)
+        kk = min(k, len(ix) - 1)
+        order = np.argsort(-s, axis=1)[:, :kk]
+        return order, s[np.arange(len(ix)), order[:, 0]]
+
+    truth = {u: topk(base, ix) for u, ix in groups.items()}
+    out = []
+    for mode in modes:
+        for dim in dims:
+            sim = mem_vectors.simulate(mat, dim, mode)
+            hits = total = agree = n = 0
+            for u, ix in groups.items():
+                t_order, t_top1 = truth[u]
+                order, _ = topk(sim, ix)
+                # 判定用的分數以基準向量重算會失真，這裡用壓縮後向量自己的 top-1 分數
+                s_top1 = np.sum(sim[ix] * sim[ix][order[:, 0]], axis=1)
+                for a, b in zip(t_order, order):
+                    hits += len(set(a.tolist()) & set(b.tolist()))
+                    total += len(a)
+                agree += int(np.sum((t_top1 >= threshold) == (s_top1 >= threshold)))
+                n += len(ix)
+            eff_dim = mem_vectors.target_dim(mat.shape[1], dim)
+            out.append({
+                "mode": mode, "dim": eff_dim,
+                "bytes": mem_vectors.bytes_per_vector(eff_dim, mode),
+                "recall": hits / total if total else 1.0,
+                "thr_agree": agree / n if n else 1.0,
+            })
+    return out
+
+
+def report(source: str, sample: int, k: int, dims: List[int], threshold: float) -> None:
+    col = Collection(source)
+    col.load()
+    total_rows = col.num_entities
+    user_ids, vecs = [], []
+    for rows in iter_rows(col, 1000):
+        for r in rows:
+            # float16 collection 讀回的是位元組，需先解碼
+            v = mem_vectors.as_float_vector(r["embedding"])
+            if not r.get("text") or not np.any(v):
+                continue  # 空記錄/零向量不參與
+            user_ids.append(r["user_id"]); vecs.append(v)
+        if len(vecs) >= sample:
+            break
+    if len(vecs) < 2:
+        raise SystemExit("❌ 可用的記錄太少，無法評估")
+    mat = np.vstack(vecs[:sample])
+    full = mat.shape[1]
+    dims = sorted({mem_vectors.target_dim(full, d) for d in dims}, reverse=True)
+    rows = recall_table(user_ids[:sample], mat, list(mem_vectors.VECTOR_MODES), dims, k, threshold)
+    base_bytes = mem_vectors.bytes_per_vector(full, "float32")
+    print(f"📊 {source}：抽樣 {len(mat)} 筆（共 {total_rows} 筆），基準 float32×{full}，k={k}，threshold={threshold}")
+    print(f"{'模式':<8}{'維度':>6}{'B/向量':>9}{'相對':>7}{'recall@k':>10}{'門檻一致':>9}{'全量估計':>11}")
+    for r in rows:
+        mb = r["bytes"] * total_rows / 1e6
+        print(f"{r['mode']:<8}{r['dim']:>6}{r['bytes']:>9}{r['bytes'] / base_bytes:>7.2f}"
+              f"{r['recall']:>10.3f}{r['thr_agree']:>9.3f}{mb:>9.1f}MB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="user_memory 向量格式遷移 / 召回率報告")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate")
+    m.add_argument("--source", default=os.getenv("MEM_COLLECTION", "user_memory"))
+    m.add_argument("--target", required=True)
+    m.add_argument("--mode", choices=mem_vectors.VECTOR_MODES, default="float16")
+    m.add_argument("--dim", type=int, default=0, help="截短後維度；0 表示維持原維度")
+    m.add_argument("--batch", type=int, default=1000)
+    m.add_argument("--drop-target", action="store_true")
+    m.add_argument("--partition-key", action="store_true", help="以 user_id 作為 partition key")
+    m.add_argument("--num-partitions", type=int, default=mem_vectors.MEM_NUM_PARTITIONS)
+    r = sub.add_parser("report")
+    r.add_argument("--source", default=os.getenv("MEM_COLLECTION", "user_memory"))
+    r.add_argument("--sample", type=int, default=5000)
+    r.add_argument("--k", type=int, default=1)
+    r.add_argument("--dims", default="0,768,512,256", help="逗號分隔；0 表示原維度")
+    r.add_argument("--threshold", type=float, default=MEM_THRESHOLD)
+    args = ap.parse_args()
+
+    connections.connect(alias="default", uri=MILVUS_URI)
+    if args.cmd == "migrate":
+        migrate(args.source, args.target, args.mode, args.dim, args.batch, args.drop_target,
+                args.partition_key, args.num_partitions)
+    else:
+        report(args.source, args.sample, args.k, [int(d) for d in args.dims.split(",")], args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# 讓測試可直接 import 專案根目錄下的 toolkits / HealthBot 等套件
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from toolkits.agent_pool import AgentPool
+
+
+class Agent:
+    pass
+
+
+def test_reuses_most_recently_released_agent():
+    pool = AgentPool(Agent, max_size=4, max_idle=4, idle_ttl=0)
+    a, b = pool.acquire(), pool.acquire()
+    pool.release(a)
+    pool.release(b)
+    assert pool.acquire() is b
+    assert pool.stats()["created"] == 2
+
+
+def test_acquire_times_out_when_pool_is_full():
+    pool = AgentPool(Agent, max_size=1, idle_ttl=0)
+    pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+
+
+def test_waiting_acquire_gets_released_agent():
+    pool = AgentPool(Agent, max_size=1, idle_ttl=0)
+    a = pool.acquire()
+    got = []
+    t = threading.Thread(target=lambda: got.append(pool.acquire(timeout=2)))
+    t.start()
+    pool.release(a)
+    t.join(2)
+    assert got == [a]
+
+
+def test_idle_agents_beyond_max_idle_are_evicted():
+    pool = AgentPool(Agent, max_size=4, max_idle=1, idle_ttl=0)
+    agents = [pool.acquire() for _ in range(3)]
+    for agent in agents:
+        pool.release(agent)
+    stats = pool.stats()
+    assert stats["idle"] == 1
+    assert stats["evicted"] == 2
+    assert pool.acquire() is agents[-1]
+
+
+def test_idle_ttl_expires_agents():
+    pool = AgentPool(Agent, max_size=2, max_idle=2, idle_ttl=1e-9)
+    a = pool.acquire()
+    pool.release(a)
+    assert pool.acquire() is not a
+    assert pool.stats()["evicted"] == 1
+
+
+def test_factory_failure_frees_the_slot():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return Agent()
+
+    pool = AgentPool(factory, max_size=1, idle_ttl=0)
+    with pytest.raises(RuntimeError):
+        pool.acquire(timeout=0.1)
+    assert isinstance(pool.acquire(timeout=0.1), Agent)
+
+
+def test_prewarm_and_lease():
+    pool = AgentPool(Agent, max_size=4, max_idle=2, idle_ttl=0)
+    assert pool.prewarm(5) == 2
+    assert pool.stats()["idle"] == 2
+    with pool.lease() as agent:
+        assert pool.stats()["in_use"] == 1
+    assert pool.stats()["in_use"] == 0
+    assert pool.acquire() is agent
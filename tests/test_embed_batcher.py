@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from toolkits.embed_batcher import EmbeddingBatcher
+
+
+def test_concurrent_submits_share_one_call_and_deduplicate():
+    calls = []
+    gate = threading.Event()
+
+    def embed(texts):
+        gate.wait(1)
+        calls.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    batcher = EmbeddingBatcher(embed, max_batch=16, max_wait_ms=200)
+    futures = [batcher.submit(t) for t in ["a", "bb", "a", "ccc"]]
+    gate.set()
+    assert [f.result(2) for f in futures] == [[1.0], [2.0], [1.0], [3.0]]
+    assert calls == [["a", "bb", "ccc"]]
+    stats = batcher.stats()
+    assert stats["requests"] == 4 and stats["texts_sent"] == 3 and stats["batches"] == 1
+
+
+def test_batches_respect_max_batch():
+    calls = []
+
+    def embed(texts):
+        calls.append(len(texts))
+        return [[0.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(embed, max_batch=2, max_wait_ms=50)
+    assert len(batcher.embed_many([str(i) for i in range(5)], timeout=2)) == 5
+    assert max(calls) <= 2
+    assert sum(calls) == 5
+
+
+def test_embed_errors_propagate_to_every_caller():
+    def embed(texts):
+        raise RuntimeError("api down")
+
+    batcher = EmbeddingBatcher(embed, max_batch=8, max_wait_ms=20)
+    futures = [batcher.submit("x"), batcher.submit("y")]
+    for f in futures:
+        with pytest.raises(RuntimeError):
+            f.result(2)
+    assert batcher.stats()["errors"] >= 1
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+import numpy as np
+
+from toolkits.embedding_providers import (
+    HashEmbeddingProvider,
+    LocalEmbeddingProvider,
+    OpenAIEmbeddingProvider,
+)
+
+
+def test_hash_provider_is_deterministic_and_normalized():
+    p = HashEmbeddingProvider(dim=64)
+    a, b = p.embed(["肺阻塞要注意什麼", "肺阻塞要注意什麼"])
+    assert a == b
+    assert len(a) == 64
+    assert np.isclose(np.linalg.norm(a), 1.0)
+    assert p.name == "hash:64"
+
+
+def test_hash_provider_similar_text_scores_higher():
+    p = HashEmbeddingProvider(dim=256)
+    q, near, far = (np.array(v) for v in p.embed(["吸入器怎麼用", "吸入器要怎麼用", "今天天氣很好"]))
+    assert q @ near > q @ far
+
+
+def test_hash_provider_empty_text_is_zero_vector():
+    assert HashEmbeddingProvider(dim=8).embed([""])[0] == [0.0] * 8
+
+
+class _FakeModel:
+    def get_sentence_embedding_dimension(self):
+        return 8
+
+    def encode(self, texts, **kwargs):
+        return np.tile(np.arange(1, 9, dtype=np.float32), (len(texts), 1))
+
+
+def test_local_provider_truncates_and_renormalizes_to_requested_dim():
+    p = LocalEmbeddingProvider(dim=4)
+    p._model = _FakeModel()
+    vecs = p.embed(["a", "b"])
+    assert p.dim == 4
+    assert [len(v) for v in vecs] == [4, 4]
+    assert np.isclose(np.linalg.norm(vecs[0]), 1.0)
+    assert p.name.endswith(":4")
+
+
+def test_openai_provider_requests_the_configured_dimensions(monkeypatch):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[0.0] * 256)])
+
+    client = SimpleNamespace(embeddings=SimpleNamespace(create=create))
+    monkeypatch.setattr("utils.llm_client.get_openai_client", lambda: client)
+    p = OpenAIEmbeddingProvider(dim=256)
+    assert p.dim == 256
+    assert len(p.embed(["x"])[0]) == 256
+    assert calls[0]["dimensions"] == 256
+    assert OpenAIEmbeddingProvider(dim=0).dim == 1536
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from toolkits.idle_scheduler import IdleScheduler
+
+
+def _collector():
+    fired, event = [], threading.Event()
+
+    def on_idle(user_id):
+        fired.append(user_id)
+        event.set()
+
+    return fired, event, on_idle
+
+
+def test_fires_once_after_timeout():
+    fired, event, on_idle = _collector()
+    sched = IdleScheduler(0.05, on_idle, workers=1)
+    try:
+        sched.touch("u1")
+        assert sched.is_live("u1")
+        assert event.wait(2)
+        time.sleep(0.1)
+        assert fired == ["u1"]
+        assert not sched.is_live("u1")
+    finally:
+        sched.stop()
+
+
+def test_touch_postpones_deadline():
+    fired, event, on_idle = _collector()
+    sched = IdleScheduler(0.2, on_idle, workers=1)
+    try:
+        start = time.monotonic()
+        sched.touch("u1")
+        time.sleep(0.1)
+        sched.touch("u1")
+        assert event.wait(2)
+        assert time.monotonic() - start >= 0.28
+        assert fired == ["u1"]
+    finally:
+        sched.stop()
+
+
+def test_cancel_prevents_firing():
+    fired, event, on_idle = _collector()
+    sched = IdleScheduler(0.05, on_idle, workers=1)
+    try:
+        sched.touch("u1")
+        sched.cancel("u1")
+        assert not event.wait(0.3)
+        assert fired == []
+        assert sched.stats()["live"] == 0
+    finally:
+        sched.stop()
+
+
+def test_callback_errors_do_not_stop_scheduler():
+    fired = []
+    done = threading.Event()
+
+    def on_idle(user_id):
+        if user_id == "bad":
+            raise RuntimeError("boom")
+        fired.append(user_id)
+        done.set()
+
+    sched = IdleScheduler(0.05, on_idle, workers=1)
+    try:
+        sched.touch("bad")
+        time.sleep(0.15)
+        sched.touch("good")
+        assert done.wait(2)
+        assert fired == ["good"]
+    finally:
+        sched.stop()
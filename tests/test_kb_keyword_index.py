@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from toolkits.kb_keyword_index import KeywordIndex, rrf
+
+ROWS = [
+    {"id": 1, "question": "什麼是肺阻塞", "keywords": "COPD, 肺阻塞"},
+    {"id": 2, "question": "吸入器要怎麼使用", "keywords": "吸入器、噴霧"},
+    {"id": 3, "question": "運動時會喘怎麼辦", "keywords": "運動;呼吸訓練"},
+    {"id": 4, "question": "可以吃類固醇嗎", "keywords": ""},
+]
+
+
+def test_rrf_sums_reciprocal_ranks():
+    fused = dict(rrf([[1, 2, 3], [3, 1]], k=60))
+    assert fused[1] == 1 / 61 + 1 / 62
+    assert fused[3] == 1 / 63 + 1 / 61
+    assert fused[2] == 1 / 62
+
+
+def test_rrf_orders_by_fused_score_and_rewards_agreement():
+    ranked = [doc for doc, _ in rrf([[1, 2, 3], [2, 3, 1], [2]])]
+    assert ranked[0] == 2
+    assert set(ranked) == {1, 2, 3}
+
+
+def test_rrf_empty():
+    assert rrf([]) == []
+    assert rrf([[], []]) == []
+
+
+def test_keyword_hit_ranks_first_and_reports_keyword_score():
+    idx = KeywordIndex(ROWS)
+    hits = idx.search("我的吸入器好像壞了", limit=3)
+    assert hits[0][0] == 2
+    assert hits[0][2] >= 1.0
+
+
+def test_keywords_are_normalized_case_insensitively():
+    hits = KeywordIndex(ROWS).search("copd 會好嗎")
+    assert hits[0][0] == 1
+
+
+def test_question_bigrams_match_without_keywords():
+    hits = KeywordIndex(ROWS).search("類固醇")
+    assert hits[0][0] == 4
+    assert hits[0][2] == 0.0
+
+
+def test_no_match_and_limit():
+    idx = KeywordIndex(ROWS)
+    assert idx.search("今天天氣真好") == []
+    assert len(idx.search("肺阻塞 吸入器 運動", limit=2)) == 2
+
+
+def test_empty_index():
+    assert KeywordIndex([]).search("肺阻塞") == []
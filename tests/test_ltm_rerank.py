@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+import numpy as np
+
+from toolkits import ltm_rerank
+from toolkits.ltm_rerank import mmr, pack, relevance
+
+DAY_MS = 86400 * 1000
+NOW = 1_700_000_000_000
+
+
+def test_relevance_prefers_recent_memory_at_equal_similarity():
+    sims = np.array([0.8, 0.8])
+    scores = relevance(sims, np.array([NOW - 90 * DAY_MS, NOW]), NOW)
+    assert scores[1] > scores[0]
+    assert np.isclose(scores[1], 0.8 + ltm_rerank.MEM_RECENCY_WEIGHT)
+
+
+def test_relevance_does_not_reward_future_timestamps():
+    scores = relevance(np.array([0.5]), np.array([NOW + 10 * DAY_MS]), NOW)
+    assert np.isclose(scores[0], 0.5 + ltm_rerank.MEM_RECENCY_WEIGHT)
+
+
+def test_mmr_skips_near_duplicates():
+    vecs = np.array([[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]])
+    scores = np.array([0.9, 0.89, 0.6])
+    assert mmr(scores, vecs, k=2, lam=0.5) == [0, 2]
+
+
+def test_mmr_without_vectors_falls_back_to_score_order():
+    scores = np.array([0.2, 0.9, 0.5])
+    assert mmr(scores, None, k=5) == [1, 2, 0]
+    assert mmr(scores, np.zeros((0, 2)), k=2) == [1, 2]
+    assert mmr(np.array([]), None, k=3) == []
+
+
+def test_pack_prefixes_dates_and_keeps_order():
+    ts = int(datetime(2024, 3, 5, 12).timestamp() * 1000)
+    out = pack(["  早上會喘  ", "有在用吸入器"], [ts, 0], budget=100)
+    assert out.splitlines() == ["[2024-03-05] 早上會喘", "[?] 有在用吸入器"]
+
+
+def test_pack_skips_items_over_budget_but_keeps_later_short_ones():
+    ts = int(datetime(2024, 1, 1, 12).timestamp() * 1000)
+    texts = ["短", "很長" * 50, "也短"]
+    out = pack(texts, [ts] * 3, budget=40)
+    assert out.splitlines() == ["[2024-01-01] 短", "[2024-01-01] 也短"]
+    assert len(out) <= 40
+
+
+def test_pack_empty_budget_returns_nothing():
+    assert pack(["abc"], [NOW], budget=0) == ""
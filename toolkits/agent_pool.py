@@ -0,0 +1,144 @@
+# Filename: toolkits/agent_pool.py
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", 8))
+AGENT_POOL_MAX_IDLE = int(os.getenv("AGENT_POOL_MAX_IDLE", 4))
+AGENT_POOL_IDLE_TTL_SEC = float(os.getenv("AGENT_POOL_IDLE_TTL_SEC", 1800))
+
+
+class AgentPool:
+    """
+    有上限的共用 Agent 池。Agent 定義與使用者無關，借出期間由單一請求獨佔，
+    歸還後可給任何使用者重用；使用者個人狀態一律由 Prompt 上下文提供。
+
+    - 總數（借出 + 閒置）不超過 max_size，額滿時 acquire 會等待歸還。
+    - 閒置 Agent 依最近使用排序：借出取最近用過的，淘汰最久未用的（LRU），
+      閒置數超過 max_idle 或閒置超過 idle_ttl 秒時淘汰。
+    - 第一次建立時以 tracemalloc 估算單一 Agent 的記憶體，用於 stats() 的常駐量估計。
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        max_size: int = AGENT_POOL_SIZE,
+        max_idle: int = AGENT_POOL_MAX_IDLE,
+        idle_ttl: float = AGENT_POOL_IDLE_TTL_SEC,
+        name: str = "agent",
+    ):
+        self.name = name
+        self._factory = factory
+        self.max_size = max(max_size, 1)
+        self.max_idle = max(min(max_idle, self.max_size), 0)
+        self.idle_ttl = idle_ttl
+        self._idle: "OrderedDict[int, tuple]" = OrderedDict()  # id -> (agent, last_used)
+        self._in_use = 0
+        self._creating = 0
+        self._created = 0
+        self._evicted = 0
+        self._bytes_per_agent: Optional[int] = None
+        self._cv = threading.Condition()
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        agent = self.acquire(timeout=timeout)
+        try:
+            yield agent
+        finally:
+            self.release(agent)
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            while True:
+                self._evict_expired()
+                if self._idle:
+                    _, (agent, _) = self._idle.popitem(last=True)
+                    self._in_use += 1
+                    return agent
+                if self._in_use + len(self._idle) + self._creating < self.max_size:
+                    self._creating += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"[{self.name} pool] 等待可用 Agent 逾時")
+                self._cv.wait(timeout=remaining)
+        # 在鎖外建立，避免建構期間卡住其他歸還/借出
+        try:
+            agent = self._build()
+        except Exception:
+            with self._cv:
+                self._creating -= 1
+                self._cv.notify()
+            raise
+        with self._cv:
+            self._creating -= 1
+            self._created += 1
+            self._in_use += 1
+        return agent
+
+    def release(self, agent: Any) -> None:
+        with self._cv:
+            self._in_use -= 1
+            self._idle[id(agent)] = (agent, time.monotonic())
+            while len(self._idle) > self.max_idle:
+                self._idle.popitem(last=False)
+                self._evicted += 1
+            self._cv.notify()
+
+    def prewarm(self, n: int) -> int:
+        """預先建立 n 個閒置 Agent（不超過 max_idle），讓建構成本離開請求路徑。"""
+        agents = []
+        try:
+            for _ in range(min(n, self.max_idle)):
+                agents.append(self.acquire(timeout=0))
+        except TimeoutError:
+            pass
+        for agent in agents:
+            self.release(agent)
+        return len(agents)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            resident = self._in_use + len(self._idle)
+            return {
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "created": self._created,
+                "evicted": self._evicted,
+                "approx_bytes_per_agent": self._bytes_per_agent,
+                "approx_resident_bytes": (
+                    resident * self._bytes_per_agent
+                    if self._bytes_per_agent is not None
+                    else None
+                ),
+            }
+
+    def _build(self) -> Any:
+        if self._bytes_per_agent is not None or tracemalloc.is_tracing():
+            return self._factory()
+        tracemalloc.start()
+        try:
+            agent = self._factory()
+            self._bytes_per_agent = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return agent
+
+    def _evict_expired(self) -> None:
+        if self.idle_ttl <= 0:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._idle:
+            key, (_, last_used) = next(iter(self._idle.items()))
+            if last_used >= cutoff:
+                break
+            del self._idle[key]
+            self._evicted += 1
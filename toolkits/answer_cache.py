@@ -0,0 +1,172 @@
+# Filename: toolkits/answer_cache.py
+# -*- coding: utf-8 -*-
+"""
+衛教問答的語意回答快取：以查詢向量比對先前「有知識庫依據」的回答，相似度達門檻即直接重用，
+省下 Companion 推理、search_milvus 工具呼叫與生成。只適用知識型問題。
+快取的是「只依知識庫、不含任何使用者上下文」另外生成的通用回答（背景執行），
+Companion 針對個人 Profile / LTM / STM 的回覆永遠不進快取，不會跨使用者外流。
+
+儲存於 Redis Stream（所有 replica 共用、只追加），命名空間含知識庫版本：load_article.py 重新匯入 copd_qa
+時遞增版本，舊快取自然失效。各行程保留一份 NumPy 矩陣鏡像，每次只以 XREAD 讀取上次之後新增的項目。
+"""
+import base64
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from toolkits.cluster_stats import ClusterCounter
+from toolkits.redis_store import get_kb_version, get_redis
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "0") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 7 * 86400))
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", 2000))
+ANSWER_CACHE_STATS_KEY = "answer_cache:stats"
+
+# 帶第一人稱或個人狀況描述的問題視為個人化，不查也不存
+_PERSONAL = re.compile(r"(我|阮|咱|俺|自己|阿公|阿嬤|我的|\bmy\b|\bi\b|\bme\b)", re.I)
+
+
+def is_knowledge_query(text: str) -> bool:
+    return bool(text and text.strip()) and not _PERSONAL.search(text)
+
+
+class SemanticAnswerCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._last_id = "0-0"  # 已讀到的 stream id
+        self._ts = []
+        self._answers = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._stats = {"hit": 0, "miss": 0, "store": 0}
+        self._cluster_stats = ClusterCounter(ANSWER_CACHE_STATS_KEY)
+        # 通用回答的生成要多一次 LLM 呼叫，放到背景避免拖慢回覆
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-cache")
+
+    def _key(self, version: str) -> str:
+        return f"answer_cache:{version}:stream"
+
+    def _refresh(self) -> None:
+        r = get_redis()
+        version = get_kb_version()
+        with self._lock:
+            if version != self._version:
+                # 知識庫版本變更：丟棄整份鏡像，從新命名空間的開頭讀起
+                self._version, self._last_id = version, "0-0"
+                self._ts, self._answers = [], []
+                self._matrix = np.zeros((0, 0), dtype=np.float32)
+            last_id = self._last_id
+        resp = r.xread({self._key(version): last_id}, count=ANSWER_CACHE_MAX)
+        entries = resp[0][1] if resp else []
+        ts, answers, vecs = [], [], []
+        for entry_id, fields in entries:
+            last_id = entry_id
+            try:
+                item = (float(fields["ts"]), fields["a"],
+                        np.frombuffer(base64.b64decode(fields["v"]), dtype=np.float32))
+            except Exception:
+                continue
+            ts.append(item[0]); answers.append(item[1]); vecs.append(item[2])
+        cutoff = time.time() - ANSWER_CACHE_TTL
+        with self._lock:
+            if version != self._version:
+                return
+            self._last_id = last_id
+            all_ts = self._ts + ts
+            all_answers = self._answers + answers
+            if vecs:
+                dims = {v.shape[0] for v in vecs} | ({self._matrix.shape[1]} if self._matrix.size else set())
+                if len(dims) > 1:  # 向量維度改變（換了 embedding 模型）：只保留新的
+                    all_ts, all_answers, matrix = ts, answers, np.vstack(vecs)
+                else:
+                    matrix = np.vstack(([self._matrix] if self._matrix.size else []) + vecs)
+            else:
+                matrix = self._matrix
+            # 過期與超量的舊項目只在本地剔除；Redis 端由 XADD MAXLEN 與 key TTL 控制
+            keep = [i for i, t in enumerate(all_ts) if t >= cutoff][-ANSWER_CACHE_MAX:]
+            if len(keep) != len(all_ts):
+                all_ts = [all_ts[i] for i in keep]
+                all_answers = [all_answers[i] for i in keep]
+                matrix = matrix[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+            self._ts, self._answers, self._matrix = all_ts, all_answers, matrix
+
+    def lookup(self, query_vec) -> Optional[str]:
+        if not ANSWER_CACHE_ENABLED or query_vec is None or len(query_vec) == 0:
+            return None
+        try:
+            self._refresh()
+        except Exception as e:
+            print(f"[answer cache] 讀取失敗: {e}")
+            return None
+        q = _unit(query_vec)
+        with self._lock:
+            if self._matrix.size == 0 or self._matrix.shape[1] != q.shape[0]:
+                best = None
+            else:
+                scores = self._matrix @ q
+                i = int(np.argmax(scores))
+                best = self._answers[i] if scores[i] >= ANSWER_CACHE_THRESHOLD else None
+        self._count("hit" if best else "miss")
+        return best
+
+    def store(self, query: str, query_vec, answer: str) -> None:
+        """寫入一筆通用（不含使用者上下文）的知識庫回答。"""
+        if not ANSWER_CACHE_ENABLED or not answer or query_vec is None or len(query_vec) == 0:
+            return
+        try:
+            r = get_redis()
+            key = self._key(get_kb_version())
+            v = _unit(query_vec)
+            fields = {
+                "q": query,
+                "a": answer,
+                "v": base64.b64encode(v.tobytes()).decode("ascii"),
+                "ts": str(time.time()),
+            }
+            with r.pipeline() as p:
+                p.xadd(key, fields, maxlen=ANSWER_CACHE_MAX, approximate=True)
+                p.expire(key, ANSWER_CACHE_TTL)
+                p.execute()
+            self._count("store")
+        except Exception as e:
+            print(f"[answer cache] 寫入失敗: {e}")
+
+    def store_generated(self, query: str, query_vec, generate: Callable[[], str]) -> None:
+        """背景呼叫 generate() 產生只依知識庫的通用回答後寫入；generate 不可帶入任何使用者資料。"""
+        if not ANSWER_CACHE_ENABLED or query_vec is None or len(query_vec) == 0:
+            return
+
+        def _job():
+            try:
+                self.store(query, query_vec, generate())
+            except Exception as e:
+                print(f"[answer cache] 生成通用回答失敗: {e}")
+
+        self._pool.submit(_job)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            out = dict(self._stats)
+            out["entries"] = len(self._answers)
+        total = out["hit"] + out["miss"]
+        out["hit_rate"] = round(out["hit"] / total, 4) if total else 0.0
+        return out
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            self._stats[field] += 1
+        self._cluster_stats.add(**{field: 1})
+
+def _unit(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+
+answer_cache = SemanticAnswerCache()
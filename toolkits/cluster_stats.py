@@ -0,0 +1,72 @@
+# Filename: toolkits/cluster_stats.py
+# -*- coding: utf-8 -*-
+"""
+叢集層級的快取命中統計：計數先累積在行程內，由單一背景執行緒每 STATS_FLUSH_SEC 秒以一次
+HINCRBY pipeline 寫入 Redis（所有 replica 加總），請求路徑上不產生任何 Redis 往返。
+"""
+import atexit
+import os
+import threading
+from collections import Counter
+from typing import List
+
+from toolkits.redis_store import get_redis
+
+STATS_FLUSH_SEC = float(os.getenv("STATS_FLUSH_SEC", 10))
+
+
+class ClusterCounter:
+    def __init__(self, key: str):
+        self.key = key
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        _register(self)
+
+    def add(self, **fields: int) -> None:
+        with self._lock:
+            for k, v in fields.items():
+                if v:
+                    self._pending[k] += v
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return
+        try:
+            p = get_redis().pipeline(transaction=False)
+            for k, v in pending.items():
+                p.hincrby(self.key, k, v)
+            p.execute()
+        except Exception:
+            # Redis 暫時不可用：放回待寫入，下次再送
+            with self._lock:
+                self._pending.update(pending)
+
+
+_counters: List[ClusterCounter] = []
+_counters_lock = threading.Lock()
+_flusher_started = False
+
+
+def _register(counter: ClusterCounter) -> None:
+    global _flusher_started
+    with _counters_lock:
+        _counters.append(counter)
+        if not _flusher_started:
+            _flusher_started = True
+            threading.Thread(target=_flush_loop, name="stats-flush", daemon=True).start()
+            atexit.register(flush_all)
+
+
+def flush_all() -> None:
+    with _counters_lock:
+        counters = list(_counters)
+    for c in counters:
+        c.flush()
+
+
+def _flush_loop() -> None:
+    stop = threading.Event()
+    while not stop.wait(STATS_FLUSH_SEC):
+        flush_all()
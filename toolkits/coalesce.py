@@ -0,0 +1,144 @@
+# Filename: toolkits/coalesce.py
+# -*- coding: utf-8 -*-
+"""
+連發訊息合併：長輩常把一句話拆成好幾則短訊息連續送出。
+收件端（webhook）先把每則訊息放進 per-user 緩衝（沿用 audio segment buffer）並取得序號；
+CoalesceScheduler 以單一計時執行緒（min-heap）等到安靜期結束才把工作送進該使用者的 lane，
+lane 上不做任何等待。只有序號仍是最新的那一則會讀取緩衝、合併成一段文字跑一次流程，
+較早的訊息直接略過（內容已併入）。緩衝在流程成功後才移除已處理的部分，失敗重試時仍在。
+安靜期長度依該使用者的打字間隔 EWMA 自動調整。
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+
+from toolkits.redis_store import (
+    acquire_lease,
+    append_audio_segment,
+    get_coalesce_state,
+    note_coalesce_arrival,
+    peek_audio_segments,
+    release_lease,
+    trim_audio_segments,
+)
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "0") == "1"
+COALESCE_MIN_MS = int(os.getenv("COALESCE_MIN_MS", 1200))
+COALESCE_MAX_MS = int(os.getenv("COALESCE_MAX_MS", 6000))
+# 安靜期 = 打字間隔 EWMA × 係數，再夾在 [MIN, MAX] 之間
+COALESCE_GAP_FACTOR = float(os.getenv("COALESCE_GAP_FACTOR", 1.5))
+# 合併後流程執行期間持有的跨行程鎖；持有者當機時最久卡住這麼久
+COALESCE_LOCK_MS = int(os.getenv("COALESCE_LOCK_MS", 120000))
+COALESCE_BUFFER_ID = "coalesce"
+_RETRY_SEC = 0.5
+
+_RETRY = object()  # 其他行程正在處理同一使用者的緩衝，稍後再檢查
+
+
+def note_message(user_id: str, text: str, buffer: bool = True) -> int:
+    """
+    收件端呼叫：緩衝訊息並回傳此則的序號。須先寫緩衝再遞增序號，確保取出時不漏訊息。
+    重送先前失敗的事件時 buffer=False：其文字仍留在緩衝中，不重複寫入。
+    """
+    if buffer:
+        append_audio_segment(user_id, COALESCE_BUFFER_ID, text)
+    return note_coalesce_arrival(user_id, COALESCE_MIN_MS, COALESCE_MAX_MS)
+
+
+def window_ms(gap_ms: int) -> int:
+    return int(min(max(gap_ms * COALESCE_GAP_FACTOR, COALESCE_MIN_MS), COALESCE_MAX_MS))
+
+
+class CoalesceScheduler:
+    """
+    安靜期計時器：submit() 立即回傳 Future，到期檢查在計時執行緒上進行（只讀 Redis 狀態），
+    確定輪到此序號時才以 submit_to_lane 把合併後的流程排入該使用者的 lane。
+    Future 的結果為 fn(merged_text) 的回傳值；已併入後續訊息或緩衝已被處理時為 None。
+    """
+
+    def __init__(self, submit_to_lane: Callable[..., Future]):
+        self._submit_to_lane = submit_to_lane
+        self._heap: List[Tuple[float, int, tuple]] = []
+        self._counter = itertools.count()
+        self._cv = threading.Condition()
+        threading.Thread(target=self._loop, name="coalesce-timer", daemon=True).start()
+
+    def submit(self, user_id: str, seq: int, fn: Callable[[str], object]) -> Future:
+        fut = Future()
+        self._schedule(0, (user_id, int(seq), fn, fut))
+        return fut
+
+    def pending(self) -> int:
+        with self._cv:
+            return len(self._heap)
+
+    def _schedule(self, delay_sec: float, entry: tuple) -> None:
+        with self._cv:
+            heapq.heappush(self._heap, (time.monotonic() + delay_sec, next(self._counter), entry))
+            self._cv.notify()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cv:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cv.wait(timeout=self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, entry = heapq.heappop(self._heap)
+            self._check(entry)
+
+    def _check(self, entry: tuple) -> None:
+        user_id, seq, _, fut = entry
+        try:
+            latest, last_ms, gap_ms = get_coalesce_state(user_id)
+            if latest != seq:
+                print(f"[合併] {user_id} 的訊息已併入後續訊息一起處理")
+                fut.set_result(None)
+                return
+            remaining = last_ms + window_ms(gap_ms) - int(time.time() * 1000)
+            if remaining > 0:
+                self._schedule(remaining / 1000, entry)
+                return
+            lane_fut = self._submit_to_lane(user_id, _drain_and_run, entry)
+        except Exception as e:
+            fut.set_exception(e)
+            return
+        lane_fut.add_done_callback(lambda f: self._settle(entry, f))
+
+    def _settle(self, entry: tuple, lane_fut: Future) -> None:
+        fut = entry[3]
+        exc = lane_fut.exception()
+        if exc is not None:
+            fut.set_exception(exc)
+        elif lane_fut.result() is _RETRY:
+            self._schedule(_RETRY_SEC, entry)
+        else:
+            fut.set_result(lane_fut.result())
+
+
+def _drain_and_run(entry: tuple):
+    """在 lane 上執行：持鎖讀取緩衝並跑 fn；成功後才移除已處理的片段，失敗時緩衝原樣保留。"""
+    user_id, seq, fn, _ = entry
+    lease, owner = f"coalesce:{user_id}", f"{seq}:{uuid.uuid4().hex}"
+    if not acquire_lease(lease, owner, COALESCE_LOCK_MS):
+        return _RETRY
+    try:
+        if get_coalesce_state(user_id)[0] != seq:
+            print(f"[合併] {user_id} 的訊息已併入後續訊息一起處理")
+            return None
+        parts = peek_audio_segments(user_id, COALESCE_BUFFER_ID)
+        merged = " ".join(p for p in parts if p)
+        if not merged:
+            return None  # 內容已由先前成功的流程處理
+        result = fn(merged)
+        trim_audio_segments(user_id, COALESCE_BUFFER_ID, len(parts))
+        return result
+    finally:
+        try:
+            release_lease(lease, owner)
+        except Exception as e:
+            print(f"[coalesce] 釋放鎖失敗（將於逾時後自動釋放）: {e}")
+
@@ -0,0 +1,72 @@
+# Filename: toolkits/context.py
+# -*- coding: utf-8 -*-
+"""請求範圍的執行情境：取代以 os.environ 在行程層級傳遞 CURRENT_USER_ID。"""
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+_current_user_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_user_id", default=None
+)
+
+# 單次訊息處理（turn）期間的旗標，例如工具是否取得衛教檢索結果
+_turn_flags: contextvars.ContextVar[Optional[Set[str]]] = contextvars.ContextVar(
+    "turn_flags", default=None
+)
+# 單次訊息處理期間的附帶資料，例如本輪檢索到的衛教知識文字
+_turn_notes: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar(
+    "turn_notes", default=None
+)
+
+
+def bind_user_id(user_id: str) -> contextvars.Token:
+    return _current_user_id.set(user_id)
+
+
+def reset_user_id(token: contextvars.Token) -> None:
+    _current_user_id.reset(token)
+
+
+def get_current_user_id(default: str = "unknown") -> str:
+    return _current_user_id.get() or default
+
+
+@contextmanager
+def user_context(user_id: str) -> Iterator[None]:
+    token = bind_user_id(user_id)
+    try:
+        yield
+    finally:
+        reset_user_id(token)
+
+
+def begin_turn() -> Tuple[contextvars.Token, contextvars.Token]:
+    return _turn_flags.set(set()), _turn_notes.set({})
+
+
+def end_turn(token: Tuple[contextvars.Token, contextvars.Token]) -> None:
+    flags_token, notes_token = token
+    _turn_notes.reset(notes_token)
+    _turn_flags.reset(flags_token)
+
+
+def mark_turn(flag: str) -> None:
+    flags = _turn_flags.get()
+    if flags is not None:
+        flags.add(flag)
+
+
+def turn_has(flag: str) -> bool:
+    flags = _turn_flags.get()
+    return bool(flags) and flag in flags
+
+
+def note_turn(key: str, value: str) -> None:
+    notes = _turn_notes.get()
+    if notes is not None:
+        notes[key] = value
+
+
+def turn_note(key: str, default: str = "") -> str:
+    notes = _turn_notes.get()
+    return notes.get(key, default) if notes else default
@@ -0,0 +1,96 @@
+# Filename: toolkits/embed_batcher.py
+# -*- coding: utf-8 -*-
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Sequence
+
+EMBED_BATCHING = os.getenv("EMBED_BATCHING", "1") == "1"
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", 64))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", 8))
+EMBED_BATCH_TIMEOUT = float(os.getenv("EMBED_BATCH_TIMEOUT", 30))
+
+
+class EmbeddingBatcher:
+    """
+    微批次 embedding 派送：各執行緒送進來的單筆文字先在佇列等待至多 max_wait_ms，
+    湊滿 max_batch 或時間到就合成一次 embed_fn(texts) 呼叫，再把結果分送回各自的 Future。
+    同一批內重複的文字只送一次。背景執行緒在第一次 submit 時才啟動。
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        max_batch: int = EMBED_BATCH_MAX,
+        max_wait_ms: float = EMBED_BATCH_WAIT_MS,
+        name: str = "embed-batcher",
+    ):
+        self._embed_fn = embed_fn
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max(max_wait_ms, 0) / 1000.0
+        self._name = name
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "texts_sent": 0, "errors": 0}
+
+    def submit(self, text: str) -> Future:
+        self._ensure_started()
+        fut: Future = Future()
+        self._queue.put((text, fut))
+        return fut
+
+    def embed_many(self, texts: Sequence[str], timeout: float = EMBED_BATCH_TIMEOUT) -> List[List[float]]:
+        futures = [self.submit(t) for t in texts]
+        return [f.result(timeout=timeout) for f in futures]
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["queued"] = self._queue.qsize()
+        out["avg_batch"] = round(out["texts_sent"] / out["batches"], 2) if out["batches"] else 0.0
+        return out
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._loop, name=self._name, daemon=True)
+                t.start()
+                self._thread = t
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            texts = list(dict.fromkeys(t for t, _ in batch))
+            with self._stats_lock:
+                self._stats["requests"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["texts_sent"] += len(texts)
+            try:
+                vectors = dict(zip(texts, self._embed_fn(texts)))
+            except Exception as e:
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for text, fut in batch:
+                fut.set_result(vectors[text])
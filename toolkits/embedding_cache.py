@@ -0,0 +1,107 @@
+# Filename: toolkits/embedding_cache.py
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from toolkits.cluster_stats import ClusterCounter
+from toolkits.redis_store import get_redis_bytes
+
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") == "1"
+EMBED_CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", 30 * 86400))
+EMBED_CACHE_LOCAL_SIZE = int(os.getenv("EMBED_CACHE_LOCAL_SIZE", 4096))
+EMBED_CACHE_STATS_KEY = "embed:cache:stats"
+
+
+class EmbeddingCache:
+    """
+    以內容定址的 embedding 快取：行程內 LRU 在前，Redis 共用層在後。
+    key = emb:{model}:{sha1(文字)}；向量以 float32 原始位元組存放（1536 維約 6KB）。
+    文字不做正規化 —— embedding 對字面差異敏感，只有完全相同的輸入才重用。
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self._local: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hit_local": 0, "hit_redis": 0, "miss": 0}
+        self._cluster_stats = ClusterCounter(EMBED_CACHE_STATS_KEY)
+
+    def _key(self, text: str) -> str:
+        return f"emb:{self.model}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """批次查詢；回傳與 texts 對齊的列表，未命中的位置為 None。"""
+        if not EMBED_CACHE_ENABLED or not texts:
+            return [None] * len(texts)
+        keys = [self._key(t) for t in texts]
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        remote_idx = []
+        with self._lock:
+            for i, k in enumerate(keys):
+                vec = self._local.get(k)
+                if vec is not None:
+                    self._local.move_to_end(k)
+                    out[i] = vec.tolist()
+                else:
+                    remote_idx.append(i)
+        hit_local = len(texts) - len(remote_idx)
+        hit_redis = 0
+        if remote_idx:
+            try:
+                raws = get_redis_bytes().mget([keys[i] for i in remote_idx])
+            except Exception:
+                raws = [None] * len(remote_idx)
+            for i, raw in zip(remote_idx, raws):
+                if raw:
+                    vec = np.frombuffer(raw, dtype=np.float32)
+                    self._remember(keys[i], vec)
+                    out[i] = vec.tolist()
+                    hit_redis += 1
+        self._count(hit_local=hit_local, hit_redis=hit_redis,
+                    miss=len(remote_idx) - hit_redis)
+        return out
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        if not EMBED_CACHE_ENABLED or not texts:
+            return
+        try:
+            p = get_redis_bytes().pipeline(transaction=False)
+            for text, vec in zip(texts, vectors):
+                if not vec:
+                    continue
+                key = self._key(text)
+                arr = np.asarray(vec, dtype=np.float32)
+                self._remember(key, arr)
+                p.set(key, arr.tobytes(), ex=EMBED_CACHE_TTL)
+            p.execute()
+        except Exception as e:
+            print(f"[embed cache] 寫入 Redis 失敗: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            out = dict(self._stats)
+            out["local_size"] = len(self._local)
+        total = out["hit_local"] + out["hit_redis"] + out["miss"]
+        out["hit_rate"] = round((out["hit_local"] + out["hit_redis"]) / total, 4) if total else 0.0
+        return out
+
+    def _remember(self, key: str, vec: np.ndarray) -> None:
+        with self._lock:
+            self._local[key] = vec
+            self._local.move_to_end(key)
+            while len(self._local) > EMBED_CACHE_LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    def _count(self, **fields: int) -> None:
+        fields = {k: v for k, v in fields.items() if v}
+        if not fields:
+            return
+        with self._lock:
+            for k, v in fields.items():
+                self._stats[k] += v
+        self._cluster_stats.add(**fields)
@@ -0,0 +1,151 @@
+# Filename: toolkits/embedding_providers.py
+# -*- coding: utf-8 -*-
+"""
+Embedding 提供者：to_vector / safe_to_vector 背後的可替換實作，以 EMBED_PROVIDER 選擇。
+  - openai：OpenAI embeddings API（預設，維持原本行為）
+  - local ：本機 CPU 多語模型（sentence-transformers，可選 ONNX / 量化後端），免網路往返
+  - hash  ：字元 n-gram 雜湊的確定性向量，供測試與離線開發使用
+每個提供者提供 name（快取命名空間）、dim（維度，決定 Milvus schema）與 embed(texts)。
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "openai").lower()
+EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
+EMBED_LOCAL_MODEL = os.getenv(
+    "EMBED_LOCAL_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+)
+# torch | onnx | openvino（後兩者需 sentence-transformers>=3.2 與對應 extras）
+EMBED_LOCAL_BACKEND = os.getenv("EMBED_LOCAL_BACKEND", "onnx")
+EMBED_LOCAL_BATCH = int(os.getenv("EMBED_LOCAL_BATCH", 32))
+EMBED_LOCAL_THREADS = int(os.getenv("EMBED_LOCAL_THREADS", 2))
+EMBED_HASH_DIM = int(os.getenv("EMBED_HASH_DIM", 256))
+# 指定輸出維度（0 = 模型原生維度）：OpenAI text-embedding-3 由 API 直接輸出此維度，本機模型截短後重新正規化
+EMBED_DIM = int(os.getenv("EMBED_DIM", 0))
+
+# 已知 OpenAI 模型維度，免為了查維度而打一次 API
+_OPENAI_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+class OpenAIEmbeddingProvider:
+    def __init__(self, model: str = EMBED_MODEL, dim: int = EMBED_DIM):
+        self.model = model
+        # 指定維度時快取命名空間需區隔，避免取到原生維度的舊向量
+        self._requested_dim = dim
+        self.name = f"openai:{model}:{dim}" if dim else f"openai:{model}"
+        self._dim = dim or _OPENAI_DIMS.get(model)
+
+    @property
+    def dim(self) -> int:
+        if not self._dim:
+            self._dim = len(self.embed(["test"])[0])
+        return self._dim
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        from utils.llm_client import get_openai_client
+
+        kwargs = {"dimensions": self._requested_dim} if self._requested_dim else {}
+        response = get_openai_client().embeddings.create(model=self.model, input=texts, **kwargs)
+        return [r.embedding for r in response.data]
+
+
+class LocalEmbeddingProvider:
+    """
+    CPU 上的多語 sentence-transformers 模型。模型在第一次使用時才載入；
+    輸入切成 EMBED_LOCAL_BATCH 大小的區塊，由小型執行緒池平行推論（ONNX / torch 推論期間會釋放 GIL）。
+    """
+
+    def __init__(self, model: str = EMBED_LOCAL_MODEL, backend: str = EMBED_LOCAL_BACKEND,
+                 batch_size: int = EMBED_LOCAL_BATCH, threads: int = EMBED_LOCAL_THREADS,
+                 dim: int = EMBED_DIM):
+        self.model_name = model
+        self.backend = backend
+        self.batch_size = max(batch_size, 1)
+        self._requested_dim = dim
+        self.name = f"local:{model}:{backend}:{dim}" if dim else f"local:{model}:{backend}"
+        self._model = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(threads, 1), thread_name_prefix="embed-local")
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    kwargs = {"device": "cpu"}
+                    if self.backend != "torch":
+                        kwargs["backend"] = self.backend
+                    try:
+                        self._model = SentenceTransformer(self.model_name, **kwargs)
+                    except Exception as e:
+                        # 沒裝 onnxruntime / optimum 時退回 torch 後端
+                        print(f"[embedding] {self.backend} 後端載入失敗，改用 torch: {e}")
+                        self._model = SentenceTransformer(self.model_name, device="cpu")
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        native = int(self._get_model().get_sentence_embedding_dimension())
+        return min(self._requested_dim, native) if self._requested_dim else native
+
+    def _encode(self, chunk: List[str]) -> List[List[float]]:
+        vecs = self._get_model().encode(
+            chunk, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+        if self._requested_dim and vecs.shape[1] > self._requested_dim:
+            # 截短到指定維度後重新 L2 正規化，維度與 Milvus schema 一致
+            vecs = vecs[:, :self._requested_dim]
+            norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+            vecs = vecs / np.where(norms > 0, norms, 1.0)
+        return vecs.tolist()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        chunks = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(chunks) == 1:
+            return self._encode(chunks[0])
+        out: List[List[float]] = []
+        for part in self._pool.map(self._encode, chunks):
+            out.extend(part)
+        return out
+
+
+class HashEmbeddingProvider:
+    """字元 unigram + bigram 的 signed feature hashing，L2 正規化。相同文字永遠得到相同向量，字面相近的文字相似度也較高。"""
+
+    def __init__(self, dim: int = EMBED_HASH_DIM):
+        self.dim = dim
+        self.name = f"hash:{dim}"
+
+    def _one(self, text: str) -> List[float]:
+        v = np.zeros(self.dim, dtype=np.float32)
+        t = (text or "").strip().lower()
+        grams = list(t) + [t[i:i + 2] for i in range(len(t) - 1)]
+        for g in grams:
+            h = int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        n = float(np.linalg.norm(v))
+        return (v / n if n else v).tolist()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._one(t) for t in texts]
+
+
+@lru_cache(maxsize=1)
+def get_provider():
+    if EMBED_PROVIDER == "local":
+        return LocalEmbeddingProvider()
+    if EMBED_PROVIDER == "hash":
+        return HashEmbeddingProvider()
+    if EMBED_PROVIDER != "openai":
+        print(f"[embedding] 未知的 EMBED_PROVIDER={EMBED_PROVIDER}，改用 openai")
+    return OpenAIEmbeddingProvider()
@@ -0,0 +1,41 @@
+# Filename: toolkits/executor.py
+# -*- coding: utf-8 -*-
+import os
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List
+
+from toolkits.context import user_context
+
+USER_LANES = int(os.getenv("USER_LANES", 8))
+
+
+class UserLaneExecutor:
+    """
+    依 user_id 雜湊到固定 lane：同一使用者的工作在同一條單執行緒 lane 上依序執行，
+    不同使用者落在不同 lane 時可平行處理。工作執行期間會綁定該使用者的請求情境。
+    """
+
+    def __init__(self, lanes: int = USER_LANES, name: str = "lane"):
+        self._lanes: List[ThreadPoolExecutor] = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-{i}")
+            for i in range(max(lanes, 1))
+        ]
+
+    def lane_of(self, user_id: str) -> int:
+        # crc32 跨行程穩定（內建 hash() 每次啟動都會隨機化）
+        return zlib.crc32(user_id.encode("utf-8")) % len(self._lanes)
+
+    def submit(self, user_id: str, fn: Callable, *args, **kwargs) -> Future:
+        return self._lanes[self.lane_of(user_id)].submit(
+            _run_as_user, user_id, fn, args, kwargs
+        )
+
+    def shutdown(self, wait: bool = True) -> None:
+        for lane in self._lanes:
+            lane.shutdown(wait=wait)
+
+
+def _run_as_user(user_id: str, fn: Callable, args: tuple, kwargs: dict):
+    with user_context(user_id):
+        return fn(*args, **kwargs)
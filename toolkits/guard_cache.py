@@ -0,0 +1,113 @@
+# Filename: toolkits/guard_cache.py
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from toolkits.cluster_stats import ClusterCounter
+from toolkits.redis_store import get_redis
+
+GUARD_CACHE_ENABLED = os.getenv("GUARD_CACHE_ENABLED", "1") == "1"
+# OK 與 BLOCK 分開設定 TTL（秒）；設為 0 代表該類判定不快取
+GUARD_CACHE_OK_TTL = int(os.getenv("GUARD_CACHE_OK_TTL", 7 * 86400))
+GUARD_CACHE_BLOCK_TTL = int(os.getenv("GUARD_CACHE_BLOCK_TTL", 86400))
+GUARD_CACHE_LOCAL_SIZE = int(os.getenv("GUARD_CACHE_LOCAL_SIZE", 2048))
+GUARD_CACHE_LOCAL_TTL = int(os.getenv("GUARD_CACHE_LOCAL_TTL", 600))
+GUARD_CACHE_STATS_KEY = "guard:cache:stats"
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCT = "。．.！!？?～~，,、…"
+
+
+def normalize_text(text: str) -> str:
+    """全半形統一、去頭尾與連續空白、轉小寫、去掉句尾標點，讓「早安！」與「早安」命中同一筆。"""
+    t = unicodedata.normalize("NFKC", text or "")
+    t = _SPACES.sub(" ", t).strip().lower()
+    return t.rstrip(_TRAILING_PUNCT + " ")
+
+
+class GuardVerdictCache:
+    """
+    Guardrail 判定快取：行程內 LRU 在前，Redis 共用層在後。
+    key = sha1(scope | model | prompt 版本 | 正規化文字)，scope 區分輸入/輸出檢查。
+    """
+
+    def __init__(self, model: str, prompt_version: str):
+        self.model = model
+        self.prompt_version = prompt_version
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (verdict, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {"hit_local": 0, "hit_redis": 0, "miss": 0}
+        # 叢集層級的命中統計（所有 replica 加總），於背景定期寫入
+        self._cluster_stats = ClusterCounter(GUARD_CACHE_STATS_KEY)
+
+    def _key(self, scope: str, text: str) -> str:
+        raw = f"{scope}|{self.model}|{self.prompt_version}|{normalize_text(text)}"
+        return f"guard:v:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def _ttl_for(self, verdict: str) -> int:
+        return GUARD_CACHE_OK_TTL if verdict.startswith("OK") else GUARD_CACHE_BLOCK_TTL
+
+    def get(self, scope: str, text: str) -> Optional[str]:
+        if not GUARD_CACHE_ENABLED:
+            return None
+        key = self._key(scope, text)
+        now = time.monotonic()
+        with self._lock:
+            item = self._local.get(key)
+            if item and item[1] > now:
+                self._local.move_to_end(key)
+            else:
+                item = None
+        if item:
+            self._count("hit_local")
+            return item[0]
+        try:
+            verdict = get_redis().get(key)
+        except Exception:
+            verdict = None
+        if verdict:
+            self._remember(key, verdict)
+            self._count("hit_redis")
+            return verdict
+        self._count("miss")
+        return None
+
+    def put(self, scope: str, text: str, verdict: str) -> None:
+        if not GUARD_CACHE_ENABLED or not verdict:
+            return
+        ttl = self._ttl_for(verdict)
+        if ttl <= 0:
+            return
+        key = self._key(scope, text)
+        self._remember(key, verdict, ttl)
+        try:
+            get_redis().set(key, verdict, ex=ttl)
+        except Exception as e:
+            print(f"[guard cache] 寫入 Redis 失敗: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._stats)
+            out["local_size"] = len(self._local)
+        total = out["hit_local"] + out["hit_redis"] + out["miss"]
+        out["hit_rate"] = round((out["hit_local"] + out["hit_redis"]) / total, 4) if total else 0.0
+        return out
+
+    def _remember(self, key: str, verdict: str, ttl: Optional[int] = None) -> None:
+        ttl = min(ttl or self._ttl_for(verdict), GUARD_CACHE_LOCAL_TTL)
+        with self._lock:
+            self._local[key] = (verdict, time.monotonic() + ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > GUARD_CACHE_LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            self._stats[field] += 1
+        self._cluster_stats.add(**{field: 1})
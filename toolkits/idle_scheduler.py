@@ -0,0 +1,180 @@
+# Filename: toolkits/idle_scheduler.py
+# -*- coding: utf-8 -*-
+import heapq
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from toolkits.redis_store import (
+    acquire_lease,
+    claim_idle_users,
+    complete_idle_user,
+    idle_tracking_stats,
+    requeue_stale_idle_claims,
+)
+
+FINALIZE_WORKERS = int(os.getenv("FINALIZE_WORKERS", 4))
+IDLE_FINALIZER_INTERVAL_SEC = float(os.getenv("IDLE_FINALIZER_INTERVAL_SEC", 5))
+IDLE_FINALIZER_LEASE_MS = int(os.getenv("IDLE_FINALIZER_LEASE_MS", 30000))
+# 認領後超過此時間仍未完成，視為收尾者已當機，放回閒置集合重試
+IDLE_CLAIM_STALE_MS = int(os.getenv("IDLE_CLAIM_STALE_MS", 600000))
+
+
+class IdleScheduler:
+    """
+    行程內唯一的閒置計時器：以 min-heap 保存各使用者的到期時間，由單一執行緒等待最近的到期點。
+    touch() 只推入新的 (deadline, user_id)，舊項目於彈出時比對 _deadlines 丟棄（lazy deletion）。
+    到期的使用者移出 live 集合，交由收尾執行緒池呼叫 on_idle(user_id)。
+    """
+
+    def __init__(
+        self,
+        timeout: float,
+        on_idle: Callable[[str], None],
+        workers: int = FINALIZE_WORKERS,
+    ):
+        self.timeout = timeout
+        self._on_idle = on_idle
+        self._deadlines: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._finalizing: Set[str] = set()
+        self._cv = threading.Condition()
+        self._stopped = False
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="finalize"
+        )
+        threading.Thread(target=self._loop, name="idle-scheduler", daemon=True).start()
+
+    def touch(self, user_id: str) -> None:
+        deadline = time.monotonic() + self.timeout
+        with self._cv:
+            self._deadlines[user_id] = deadline
+            heapq.heappush(self._heap, (deadline, user_id))
+            # 過期項目太多時重建 heap，避免高頻對話讓 heap 無限膨脹
+            if len(self._heap) > 2 * len(self._deadlines) + 1024:
+                self._heap = [(d, u) for u, d in self._deadlines.items()]
+                heapq.heapify(self._heap)
+            if self._heap[0][1] == user_id:
+                self._cv.notify()
+
+    def cancel(self, user_id: str) -> None:
+        with self._cv:
+            self._deadlines.pop(user_id, None)
+
+    def is_live(self, user_id: str) -> bool:
+        with self._cv:
+            return user_id in self._deadlines
+
+    def stats(self) -> Dict[str, int]:
+        with self._cv:
+            return {
+                "live": len(self._deadlines),
+                "pending_finalization": len(self._finalizing),
+            }
+
+    def stop(self) -> None:
+        with self._cv:
+            self._stopped = True
+            self._cv.notify()
+        self._pool.shutdown(wait=False)
+
+    def _loop(self) -> None:
+        with self._cv:
+            while not self._stopped:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, user_id = heapq.heappop(self._heap)
+                    if self._deadlines.get(user_id) != deadline:
+                        continue  # 已被更新的 deadline 取代
+                    del self._deadlines[user_id]
+                    self._finalizing.add(user_id)
+                    self._pool.submit(self._fire, user_id)
+                wait = self._heap[0][0] - now if self._heap else None
+                self._cv.wait(timeout=wait)
+
+    def _fire(self, user_id: str) -> None:
+        try:
+            self._on_idle(user_id)
+        except Exception as e:
+            print(f"❌ [Idle] {user_id} 收尾失敗: {e}")
+        finally:
+            with self._cv:
+                self._finalizing.discard(user_id)
+
+
+class ClusterIdleFinalizer:
+    """
+    叢集共用的閒置收尾者：活動時間記錄在 Redis sorted set（append_round 寫入），
+    任一 replica 都可啟動本元件，但只有持有 lease 的那一個會認領閒置使用者並呼叫 on_idle。
+    認領以 Lua 原子地 ZREM + 移入收尾集合，同一使用者只會被一個收尾者取得。
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float,
+        on_idle: Callable[[str], None],
+        workers: int = FINALIZE_WORKERS,
+        owner: Optional[str] = None,
+    ):
+        self.idle_ms = int(idle_timeout * 1000)
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self._on_idle = on_idle
+        self._workers = max(workers, 1)
+        self._pool = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="cluster-finalize"
+        )
+        self._inflight = threading.BoundedSemaphore(self._workers)
+        self._stop = threading.Event()
+        self.is_leader = False
+
+    def start(self) -> "ClusterIdleFinalizer":
+        threading.Thread(
+            target=self._loop, name="cluster-idle-finalizer", daemon=True
+        ).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._pool.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            out = idle_tracking_stats()
+        except Exception:
+            out = {}
+        out["leader"] = int(self.is_leader)
+        return out
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.is_leader = acquire_lease(
+                    "idle_finalizer", self.owner, IDLE_FINALIZER_LEASE_MS
+                )
+                if self.is_leader:
+                    requeue_stale_idle_claims(IDLE_CLAIM_STALE_MS)
+                    # 只認領目前有空檔能處理的數量，其餘留在 Redis 給下一輪
+                    free = 0
+                    while free < self._workers and self._inflight.acquire(blocking=False):
+                        free += 1
+                    users = claim_idle_users(self.idle_ms, limit=free) if free else []
+                    for _ in range(free - len(users)):
+                        self._inflight.release()
+                    for user_id in users:
+                        self._pool.submit(self._fire, user_id)
+            except Exception as e:
+                print(f"❌ [Idle] 叢集收尾輪詢失敗: {e}")
+            self._stop.wait(IDLE_FINALIZER_INTERVAL_SEC)
+
+    def _fire(self, user_id: str) -> None:
+        try:
+            self._on_idle(user_id)
+            complete_idle_user(user_id)
+        except Exception as e:
+            # 不移出收尾集合：逾時後由 requeue_stale_idle_claims 放回重試
+            print(f"❌ [Idle] {user_id} 收尾失敗: {e}")
+        finally:
+            self._inflight.release()
@@ -0,0 +1,125 @@
+# Filename: toolkits/kb_keyword_index.py
+# -*- coding: utf-8 -*-
+"""
+copd_qa 的本地關鍵詞索引，與 Milvus 稠密搜尋做 reciprocal rank fusion（RRF）。
+知識庫只有數百筆，整份問答放在行程內：關鍵詞（keywords 欄位）以 Aho-Corasick 一次掃描比對，
+問題文字以字元 bigram 做 BM25。每次查詢仍只有一次 Milvus 呼叫，關鍵詞端為純記憶體運算。
+索引在第一次使用時自 Milvus 載入，知識庫版本（load_article.py 遞增）改變時重載。
+"""
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from toolkits.preclassifier import AhoCorasick
+from toolkits.redis_store import KB_INDEX_CHECK_SEC, get_kb_version
+
+KB_HYBRID = os.getenv("KB_HYBRID", "1") == "1"
+KB_RRF_K = int(os.getenv("KB_RRF_K", 60))
+# 關鍵詞端至少要有一個完整關鍵詞命中，才讓「稠密端沒找到」的結果進入輸出
+KB_KEYWORD_MIN_SCORE = float(os.getenv("KB_KEYWORD_MIN_SCORE", 1.0))
+
+_SPLIT = re.compile(r"[,，、;；/|\s]+")
+_BM25_K1, _BM25_B = 1.2, 0.75
+
+
+def _norm(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").strip().lower()
+
+
+def _bigrams(text: str) -> List[str]:
+    chars = [c for c in _norm(text) if c.isalnum()]
+    return [a + b for a, b in zip(chars, chars[1:])] or chars
+
+
+class KeywordIndex:
+    def __init__(self, rows: List[Dict]):
+        self.docs = {r["id"]: r for r in rows}
+        # 關鍵詞 → 文件；idf 讓罕見詞（藥名等）權重較高
+        kw_docs: Dict[str, set] = defaultdict(set)
+        for r in rows:
+            for kw in _SPLIT.split(_norm(r.get("keywords", ""))):
+                if len(kw) >= 2:
+                    kw_docs[kw].add(r["id"])
+        n = max(len(rows), 1)
+        self._kw_docs = kw_docs
+        self._kw_idf = {kw: math.log(1 + n / len(ids)) for kw, ids in kw_docs.items()}
+        self._matcher = AhoCorasick({kw: [kw] for kw in kw_docs}) if kw_docs else None
+        # 問題文字的 bigram BM25
+        self._tf = {r["id"]: Counter(_bigrams(r.get("question", ""))) for r in rows}
+        self._len = {i: sum(tf.values()) for i, tf in self._tf.items()}
+        self._avg_len = (sum(self._len.values()) / n) or 1.0
+        df = Counter(g for tf in self._tf.values() for g in tf)
+        self._idf = {g: math.log(1 + (n - c + 0.5) / (c + 0.5)) for g, c in df.items()}
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, float, float]]:
+        """回傳 [(id, 總分, 關鍵詞分)]，依總分由高到低。"""
+        scores: Dict[int, float] = defaultdict(float)
+        kw_scores: Dict[int, float] = defaultdict(float)
+        if self._matcher is not None:
+            for kw in {label for label, _ in self._matcher.find(_norm(query))}:
+                # 關鍵詞完整命中：以 idf 加權，並正規化到「至少 1 分」
+                w = 1.0 + self._kw_idf[kw]
+                for doc_id in self._kw_docs[kw]:
+                    kw_scores[doc_id] += w
+        q = set(_bigrams(query))
+        for doc_id, tf in self._tf.items():
+            s = 0.0
+            dl = self._len[doc_id]
+            for g in q:
+                f = tf.get(g)
+                if f:
+                    s += self._idf[g] * f * (_BM25_K1 + 1) / (f + _BM25_K1 * (1 - _BM25_B + _BM25_B * dl / self._avg_len))
+            if s:
+                scores[doc_id] += s
+        for doc_id, s in kw_scores.items():
+            scores[doc_id] += 2.0 * s
+        ranked = sorted(scores.items(), key=lambda kv: -kv[1])[:limit]
+        return [(doc_id, s, kw_scores.get(doc_id, 0.0)) for doc_id, s in ranked]
+
+
+def rrf(rankings: List[List[int]], k: int = KB_RRF_K) -> List[Tuple[int, float]]:
+    """Reciprocal rank fusion：各路排名的 1/(k + rank) 加總。"""
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda kv: -kv[1])
+
+
+_index: Optional[KeywordIndex] = None
+_index_version: Optional[str] = None
+_index_checked = 0.0
+_index_lock = threading.Lock()
+
+
+def milvus_rows(collection) -> Callable[[], List[Dict]]:
+    return lambda: collection.query(
+        expr="id >= 0",
+        output_fields=["id", "category", "question", "answer", "keywords"],
+        limit=16384,
+    )
+
+
+def get_keyword_index(load_rows: Callable[[], List[Dict]]) -> KeywordIndex:
+    """取得（必要時重載）關鍵詞索引；版本檢查最多每 KB_INDEX_CHECK_SEC 秒一次。load_rows 提供問答資料。"""
+    global _index, _index_version, _index_checked
+    now = time.monotonic()
+    if _index is not None and now - _index_checked < KB_INDEX_CHECK_SEC:
+        return _index
+    with _index_lock:
+        if _index is not None and now - _index_checked < KB_INDEX_CHECK_SEC:
+            return _index
+        try:
+            version = get_kb_version()
+        except Exception:
+            version = _index_version  # Redis 不可用時沿用現有索引
+        if _index is None or version != _index_version:
+            _index = KeywordIndex(load_rows())
+            _index_version = version
+        _index_checked = now
+    return _index
@@ -0,0 +1,176 @@
+# Filename: toolkits/kb_local_index.py
+# -*- coding: utf-8 -*-
+"""
+copd_qa 的行程內向量索引（KB_LOCAL_INDEX=1 時啟用）。
+load_article.py 匯入後把正規化的 embedding 匯出成 .npy、問答內容匯出成 .meta.json；
+各 worker 以 np.load(mmap_mode="r") 開啟（多行程共用 page cache），top-k 只是一次矩陣-向量乘積。
+Milvus 仍是資料來源：知識庫版本（Redis）與檔案版本不符時，自 Milvus 重新匯出後重載。
+"""
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from toolkits.redis_store import KB_INDEX_CHECK_SEC, get_kb_version
+
+KB_LOCAL_INDEX = os.getenv("KB_LOCAL_INDEX", "0") == "1"
+KB_LOCAL_DIR = os.getenv("KB_LOCAL_DIR", "data/kb_index")
+META_FIELDS = ["id", "category", "question", "answer", "keywords", "notes"]
+
+
+def _paths(version: str, base: str = KB_LOCAL_DIR):
+    return (
+        os.path.join(base, f"copd_qa.v{version}.npy"),
+        os.path.join(base, f"copd_qa.v{version}.meta.json"),
+        os.path.join(base, "CURRENT"),
+    )
+
+
+_VERSION_FILE_RE = re.compile(r"^copd_qa\.v(\d+)\.")
+
+
+def _version_num(version: Optional[str]) -> int:
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        return -1
+
+
+def _atomic_write(path: str, write: Callable) -> None:
+    tmp = f"{path}.tmp.{os.getpid()}"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def export_kb_index(rows: List[Dict], vectors, version: str, base: str = KB_LOCAL_DIR) -> str:
+    """匯出一個版本的索引檔（向量先正規化，搜尋時內積即 cosine）。回傳 .npy 路徑。"""
+    os.makedirs(base, exist_ok=True)
+    mat = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    mat = np.divide(mat, norms, out=np.zeros_like(mat), where=norms > 0)
+    npy, meta, current = _paths(version, base)
+
+    def _save_npy(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, mat)
+
+    def _save_meta(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump([{k: r.get(k) for k in META_FIELDS} for r in rows], f, ensure_ascii=False)
+
+    def _save_current(tmp):
+        with open(tmp, "w") as f:
+            f.write(version)
+
+    _atomic_write(npy, _save_npy)
+    _atomic_write(meta, _save_meta)
+    # 最後才切換 CURRENT，讀者不會看到半套檔案；同時有較新版本的匯出已完成時不倒退
+    if _version_num(exported_version(base)) <= _version_num(version):
+        _atomic_write(current, _save_current)
+    # 只清掉比本次更舊的版本檔（已開啟的 mmap 不受影響）；並行匯出中的較新版本不能刪
+    for name in os.listdir(base):
+        m = _VERSION_FILE_RE.match(name)
+        if m and int(m.group(1)) < _version_num(version):
+            try:
+                os.remove(os.path.join(base, name))
+            except OSError:
+                pass
+    return npy
+
+
+def export_from_milvus(collection, version: str, base: str = KB_LOCAL_DIR) -> str:
+    rows = collection.query(expr="id >= 0", output_fields=META_FIELDS + ["embedding"], limit=16384)
+    vectors = [r.pop("embedding") for r in rows]
+    return export_kb_index(rows, vectors, version, base)
+
+
+class _Entity(dict):
+    pass
+
+
+class LocalHit:
+    """介面與 pymilvus 的 Hit 相容（id / score / entity.get），可直接沿用既有的結果處理。"""
+
+    __slots__ = ("id", "score", "entity")
+
+    def __init__(self, doc_id: int, score: float, row: Dict):
+        self.id = doc_id
+        self.score = score
+        self.entity = _Entity(row)
+
+
+class LocalKBIndex:
+    def __init__(self, version: str, base: str = KB_LOCAL_DIR):
+        npy, meta, _ = _paths(version, base)
+        self.version = version
+        self.matrix = np.load(npy, mmap_mode="r")
+        with open(meta, encoding="utf-8") as f:
+            self.rows: List[Dict] = json.load(f)
+
+    def search(self, qv, limit: int = 10) -> Optional[List[LocalHit]]:
+        q = np.asarray(qv, dtype=np.float32)
+        if q.ndim != 1 or q.shape[0] != self.matrix.shape[1]:
+            return None  # 維度不符（例如換了 embedding 提供者）→ 交回 Milvus
+        n = float(np.linalg.norm(q))
+        if not n or not len(self.rows):
+            return []
+        scores = self.matrix @ (q / n)
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [LocalHit(self.rows[i]["id"], float(scores[i]), self.rows[i]) for i in top]
+
+
+_local: Optional[LocalKBIndex] = None
+_checked = 0.0
+_failed_at = -1e9
+_lock = threading.Lock()
+
+
+def exported_version(base: str = KB_LOCAL_DIR) -> Optional[str]:
+    try:
+        with open(_paths("", base)[2]) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def get_local_index(get_collection: Callable) -> Optional[LocalKBIndex]:
+    """
+    取得目前版本的本地索引；版本檢查最多每 KB_INDEX_CHECK_SEC 秒一次。
+    檔案落後於知識庫版本時自 Milvus 重新匯出。任何錯誤都回 None，由呼叫端改走 Milvus。
+    """
+    global _local, _checked, _failed_at
+    if not KB_LOCAL_INDEX:
+        return None
+    now = time.monotonic()
+    if _local is not None and now - _checked < KB_INDEX_CHECK_SEC:
+        return _local
+    if _local is None and now - _failed_at < KB_INDEX_CHECK_SEC:
+        return None  # 上次載入失敗，稍後再試
+    with _lock:
+        if _local is not None and now - _checked < KB_INDEX_CHECK_SEC:
+            return _local
+        try:
+            try:
+                version = get_kb_version()
+            except Exception:
+                version = _local.version if _local is not None else exported_version()
+            if _local is None or _local.version != version:
+                if version is None:
+                    return None
+                if exported_version() != version:
+                    print(f"[kb local index] 匯出知識庫版本 {version} 的本地索引")
+                    export_from_milvus(get_collection(), version)
+                _local = LocalKBIndex(version)
+            _checked = now
+        except Exception as e:
+            # 不沿用可能過期的舊索引；退回 Milvus 直到下次檢查
+            print(f"[kb local index error] {e}")
+            _local, _failed_at = None, now
+            return None
+    return _local
@@ -0,0 +1,64 @@
+# Filename: toolkits/ltm_rerank.py
+# -*- coding: utf-8 -*-
+"""
+LTM 候選記憶的本地重排：一次 Milvus 呼叫取回 top-k 候選（含向量）後，
+以 NumPy 向量化計算「相似度 + 時間衰減」分數，再用 MMR 挑出彼此不重複的記憶，最後依字數預算打包。
+"""
+import os
+from datetime import datetime
+from typing import List, Sequence
+
+import numpy as np
+
+MEM_RECENCY_WEIGHT = float(os.getenv("MEM_RECENCY_WEIGHT", "0.15"))
+MEM_HALF_LIFE_DAYS = float(os.getenv("MEM_HALF_LIFE_DAYS", "30"))
+MEM_MMR_LAMBDA = float(os.getenv("MEM_MMR_LAMBDA", "0.7"))
+
+_DAY_MS = 86400 * 1000
+
+
+def relevance(sims: np.ndarray, updated_at: np.ndarray, now_ms: int) -> np.ndarray:
+    """相似度加上半衰期為 MEM_HALF_LIFE_DAYS 的新近度加分。"""
+    age_days = np.maximum(now_ms - updated_at, 0) / _DAY_MS
+    recency = np.exp2(-age_days / max(MEM_HALF_LIFE_DAYS, 1e-6))
+    return sims + MEM_RECENCY_WEIGHT * recency
+
+
+def mmr(scores: np.ndarray, vecs: np.ndarray, k: int, lam: float = MEM_MMR_LAMBDA) -> List[int]:
+    """
+    Maximal Marginal Relevance：每次挑 lam*分數 - (1-lam)*與已選記憶的最大相似度 最高者。
+    vecs 為空（例如 Milvus 未回傳向量）時退化為依分數排序。
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    if vecs is None or len(vecs) != n:
+        return [int(i) for i in np.argsort(-scores)[:k]]
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    unit = np.divide(vecs, norms, out=np.zeros_like(vecs), where=norms > 0)
+    pair = unit @ unit.T
+    chosen = [int(np.argmax(scores))]
+    max_sim = pair[chosen[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[chosen[0]] = False
+    while len(chosen) < k:
+        mmr_score = np.where(available, lam * scores - (1 - lam) * max_sim, -np.inf)
+        i = int(np.argmax(mmr_score))
+        chosen.append(i)
+        available[i] = False
+        max_sim = np.maximum(max_sim, pair[i])
+    return chosen
+
+
+def pack(texts: Sequence[str], updated_at: Sequence[int], budget: int) -> str:
+    """依挑選順序放入記憶（加上日期），超出字數預算的略過，後面較短的仍可放入。"""
+    parts, used = [], 0
+    for text, ts in zip(texts, updated_at):
+        day = datetime.fromtimestamp(ts / 1000).strftime("%Y-%m-%d") if ts else "?"
+        item = f"[{day}] {text.strip()}"
+        if used + len(item) > budget:
+            continue
+        parts.append(item)
+        used += len(item) + 1
+    return "\n".join(parts)
@@ -0,0 +1,138 @@
+# Filename: toolkits/mem_vectors.py
+# -*- coding: utf-8 -*-
+"""
+user_memory（LTM）向量的儲存格式。MEM_VECTOR_MODE 選擇：
+  - float32：FLOAT_VECTOR + HNSW（原本的格式，預設）
+  - float16：FLOAT16_VECTOR + HNSW，原始向量與索引都減半
+  - int8   ：FLOAT_VECTOR + HNSW_SQ（SQ8 純量量化索引），載入記憶體的索引約為 1/4
+MEM_VECTOR_DIM > 0 時再把向量截短到該維度並重新正規化（text-embedding-3 為 Matryoshka 訓練，
+截短後重正規化與 API 的 dimensions 參數等價），embedding 快取與其他 collection 不受影響。
+"""
+import os
+from typing import Dict
+
+import numpy as np
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema
+
+MEM_VECTOR_MODE = os.getenv("MEM_VECTOR_MODE", "float32").lower()
+MEM_VECTOR_DIM = int(os.getenv("MEM_VECTOR_DIM", 0))
+# user_id 作為 partition key：Milvus 依雜湊把使用者分到 MEM_NUM_PARTITIONS 個分區，
+# 帶 user_id == "..." 的搜尋/查詢只會掃描該使用者所在的分區（僅影響新建的 collection）
+MEM_PARTITION_KEY = os.getenv("MEM_PARTITION_KEY", "0") == "1"
+MEM_NUM_PARTITIONS = int(os.getenv("MEM_NUM_PARTITIONS", 64))
+
+VECTOR_MODES = ("float32", "float16", "int8")
+_BYTES_PER_DIM = {"float32": 4, "float16": 2, "int8": 1}
+
+
+def target_dim(full_dim: int, dim: int = MEM_VECTOR_DIM) -> int:
+    return min(dim, full_dim) if dim > 0 else full_dim
+
+
+def vector_dtype(mode: str = MEM_VECTOR_MODE):
+    return DataType.FLOAT16_VECTOR if mode == "float16" else DataType.FLOAT_VECTOR
+
+
+def index_params(mode: str = MEM_VECTOR_MODE) -> Dict:
+    if mode == "int8":
+        return {"index_type": "HNSW_SQ", "metric_type": "COSINE",
+                "params": {"M": 16, "efConstruction": 200, "sq_type": "SQ8"}}
+    return {"index_type": "HNSW", "metric_type": "COSINE", "params": {"M": 16, "efConstruction": 200}}
+
+
+def bytes_per_vector(dim: int, mode: str = MEM_VECTOR_MODE) -> int:
+    """索引中每筆向量的大約位元組數（不含圖結構），用於容量估算。"""
+    return dim * _BYTES_PER_DIM.get(mode, 4)
+
+
+def as_float_vector(vec) -> np.ndarray:
+    """讀回的向量轉成 float32：FLOAT16_VECTOR 欄位由 pymilvus 以位元組（或只含一個位元組串的 list）回傳。"""
+    if isinstance(vec, (list, tuple)) and len(vec) == 1 and isinstance(vec[0], (bytes, bytearray)):
+        vec = vec[0]
+    if isinstance(vec, (bytes, bytearray)):
+        return np.frombuffer(vec, dtype=np.float16).astype(np.float32)
+    return np.asarray(vec, dtype=np.float32)
+
+
+def reduce_dim(vec, dim: int) -> np.ndarray:
+    v = as_float_vector(vec)
+    if 0 < dim < v.shape[-1]:
+        v = v[..., :dim]
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    return np.divide(v, n, out=np.zeros_like(v), where=n > 0)
+
+
+def encode(vec, dim: int = MEM_VECTOR_DIM, mode: str = MEM_VECTOR_MODE):
+    """轉成寫入/查詢 Milvus 用的格式：float16 模式回傳 np.float16 陣列，其餘回傳 list[float]。"""
+    v = reduce_dim(vec, dim)
+    if mode == "float16":
+        return v.astype(np.float16)
+    return v.tolist()
+
+
+def create_memory_collection(
+    name: str,
+    dim: int,
+    mode: str = MEM_VECTOR_MODE,
+    partition_key: bool = MEM_PARTITION_KEY,
+    num_partitions: int = MEM_NUM_PARTITIONS,
+) -> Collection:
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+        FieldSchema(name="user_id", dtype=DataType.VARCHAR, max_length=64, is_partition_key=partition_key),
+        FieldSchema(name="updated_at", dtype=DataType.INT64),
+        FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=8192),
+        FieldSchema(name="embedding", dtype=vector_dtype(mode), dim=dim),
+    ]
+    schema = CollectionSchema(fields, description=f"per-user memory (text + embedding, {mode})")
+    if partition_key:
+        col = Collection(name=name, schema=schema, num_partitions=num_partitions)
+        try:
+            # 分區鍵隔離：HNSW 索引依分區鍵值各自建圖，過濾搜尋不必走過其他使用者的節點（Milvus 2.4.11+）
+            col.set_properties({"partitionkey.isolation": True})
+        except Exception as e:
+            print(f"[mem schema] 不支援 partitionkey.isolation，僅使用分區裁剪: {e}")
+    else:
+        col = Collection(name=name, schema=schema)
+    # 向量索引 + user_id 索引
+    try:
+        col.create_index("embedding", index_params(mode))
+    except Exception as e:
+        if mode != "int8":
+            raise
+        # 舊版 Milvus 沒有 HNSW_SQ：改用 IVF_SQ8
+        print(f"[mem schema] HNSW_SQ 不可用，改用 IVF_SQ8: {e}")
+        col.create_index("embedding", {"index_type": "IVF_SQ8", "metric_type": "COSINE", "params": {"nlist": 128}})
+    try:
+        col.create_index("user_id", {"index_type": "TRIE"})
+    except Exception:
+        # 某些版本不支援 TRIE，忽略即可
+        pass
+    return col
+
+
+def search_params(mode: str = MEM_VECTOR_MODE) -> Dict:
+    return {"metric_type": "COSINE", "params": {"ef": 64, "nprobe": 16}}
+
+
+def uses_partition_key(col: Collection) -> bool:
+    return any(getattr(f, "is_partition_key", False) for f in col.schema.fields)
+
+
+def quantize_sq8(mat: np.ndarray) -> np.ndarray:
+    """模擬 SQ8：逐維 min/max 線性量化到 256 階再還原，用於離線召回率評估。"""
+    lo = mat.min(axis=0)
+    span = np.maximum(mat.max(axis=0) - lo, 1e-12)
+    q = np.round((mat - lo) / span * 255.0)
+    return (q / 255.0 * span + lo).astype(np.float32)
+
+
+def simulate(mat: np.ndarray, dim: int, mode: str) -> np.ndarray:
+    """把 float32 全維向量轉成指定模式下「實際參與比分」的向量。"""
+    v = reduce_dim(mat, dim)
+    if mode == "float16":
+        return v.astype(np.float16).astype(np.float32)
+    if mode == "int8":
+        return quantize_sq8(v)
+    return v
+
@@ -0,0 +1,249 @@
+# Filename: toolkits/preclassifier.py
+# -*- coding: utf-8 -*-
+"""
+Guardrail 前置的本地分類層（不呼叫 LLM）：
+1) Aho-Corasick 多模式比對中文/台語風險詞庫（自傷、毒品、劑量/用藥指示等）。
+2) 極小型字元 bigram 朴素貝氏分類器，判斷是否為明確無害的日常閒聊。
+只有「確定無害」直接放行、「明確的本人自傷意圖」直接攔截；其餘一律交給 LLM Guardrail，
+模稜兩可的自傷相關字詞（吞藥、想死…）只作為提示附給 LLM，不直接攔截。
+種子語料很小，分類器不能單獨放行：只有完全符合寒暄白名單，或「很短且每個字元/bigram
+都出現在無害語料中」且高信心的訊息才會在本地判定無害。
+"""
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+PRECLASSIFIER_ENABLED = os.getenv("PRECLASSIFIER_ENABLED", "1") == "1"
+# 無害機率需達此門檻才跳過 LLM
+PRECLASSIFIER_PASS_THRESHOLD = float(os.getenv("PRECLASSIFIER_PASS_THRESHOLD", "0.97"))
+# 非白名單訊息超過此長度（去除標點空白後）一律交給 LLM
+PRECLASSIFIER_MAX_CHARS = int(os.getenv("PRECLASSIFIER_MAX_CHARS", 12))
+
+# ---- 風險詞庫（類別 → 詞彙）----
+RISK_LEXICON: Dict[str, List[str]] = {
+    # 明確的本人自傷意圖：命中即攔截並通報
+    "self_harm": [
+        "想自殺", "要自殺", "想自殘", "想輕生", "想尋死", "我想去死", "我要去死", "不想活",
+        "活不下去", "想結束生命", "結束自己的生命", "了結自己", "想傷害自己", "想割腕",
+        "想跳樓", "想上吊", "想燒炭", "想離開這個世界", "我死了算了", "毋想活", "無想欲活",
+    ],
+    # 可能與自傷有關、但常見於日常用語（吞藥困難、想死你了、叫他去死）：交給 LLM 並附上提示
+    "self_harm_hint": [
+        "自殺", "自殘", "自傷", "輕生", "尋死", "想死", "去死", "割腕", "跳樓", "上吊",
+        "燒炭", "吞藥", "安眠藥吞", "死了算了", "死死咧", "傷害自己", "結束生命",
+    ],
+    "drugs": [
+        "毒品", "安非他命", "海洛因", "大麻", "K他命", "愷他命", "搖頭丸", "古柯鹼",
+        "冰毒", "嗎啡", "買藥頭",
+    ],
+    "dosage": [
+        "劑量", "吃幾顆", "吃幾粒", "食幾粒", "幾毫克", "mg", "加量", "減量", "停藥",
+        "自己調藥", "類固醇", "抗生素", "處方", "開藥", "安眠藥", "止痛藥", "吃多少",
+        "藥要吃", "可以吃藥", "換藥",
+    ],
+    "violence": ["殺人", "炸彈", "槍枝", "打死", "報復"],
+}
+
+# 涵蓋自傷詞的無害說法：命中範圍被這些詞完整包住時不算自傷
+SELF_HARM_EXCEPTIONS: List[str] = ["不想活動", "活不下去的魚", "活不下去的花"]
+
+# 明確自傷詞緊接在否定詞之後（我不想自殺、我沒有想自殺、我不會再想自殺）時降級為提示，交給 LLM 判斷
+NEGATION_WORDS: List[str] = ["不", "沒", "沒有", "不會", "不是"]
+# 否定詞與自傷詞之間允許的虛字
+_NEGATION_FILLERS = "再會要是有曾真的"
+_NEGATION_RE = re.compile("(?:" + "|".join(map(re.escape, NEGATION_WORDS)) + ")[" + _NEGATION_FILLERS + "]{0,3}$")
+
+
+class AhoCorasick:
+    """純 Python 的 Aho-Corasick 自動機：一次掃描即可找出所有詞庫命中。"""
+
+    def __init__(self, patterns: Dict[str, List[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, str]]] = [[]]
+        for label, words in patterns.items():
+            for w in words:
+                self._add(_normalize(w), label)
+        self._build()
+
+    def _add(self, word: str, label: str) -> None:
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((label, word))
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[nxt] = cand if cand != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[str, str]]:
+        return [(label, word) for _, label, word in self.find_spans(text)]
+
+    def find_spans(self, text: str) -> List[Tuple[int, str, str]]:
+        """同 find，另回傳每個命中的結束位置（不含）。"""
+        hits = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for label, word in self._out[node]:
+                hits.append((i + 1, label, word))
+        return hits
+
+
+# ---- 極小型朴素貝氏（字元 unigram + bigram）----
+# 種子語料刻意偏保守：只有非常典型的寒暄/生活閒聊才算 benign，其餘（含症狀、用藥、情緒）皆歸 other。
+_SEED_CORPUS = {
+    "benign": [
+        "早安", "午安", "晚安", "你好", "哈囉", "嗨", "謝謝", "多謝", "感謝你", "好的",
+        "好喔", "知道了", "了解", "收到", "沒問題", "再見", "拜拜", "明天見", "吃飽了",
+        "我吃飽了", "今天天氣很好", "今天好熱", "今天有點冷", "我去散步", "我剛散步回來",
+        "我在看電視", "孫子來看我", "我去市場買菜", "中午吃麵", "晚上吃稀飯", "你吃飯了沒",
+        "今天心情不錯", "哈哈", "呵呵", "好啦", "對啊", "是喔", "真的嗎", "不錯喔",
+        "我要去睡了", "我起床了", "食飽未", "食飽矣", "勞力", "多謝你", "好勢", "真好",
+        "今仔日天氣真好", "阮欲去散步", "我去公園走走", "我在泡茶", "在聽廣播",
+    ],
+    "other": [
+        "我今天咳嗽", "喘不過氣", "胸口悶", "痰很多", "藥要怎麼吃", "吸入器怎麼用",
+        "我要不要去看醫生", "血壓很高", "頭很暈", "晚上睡不著", "我很難過", "心情很差",
+        "一個人好孤單", "沒有人理我", "可以停藥嗎", "類固醇吃多少", "什麼是肺阻塞",
+        "COPD 要注意什麼", "我跌倒了", "腳很痛", "發燒了", "呼吸很喘", "要吃什麼藥",
+        "醫生說要開刀", "我想去急診", "氧氣機怎麼調", "走路會喘", "咳到睡不著",
+        "我不想活了", "活著好累", "藥吃完了怎麼辦", "能不能多吃一顆", "幫我看報告",
+        "投資股票好嗎", "怎麼買", "肺部有陰影", "血氧很低", "抽菸會怎樣", "戒菸好難",
+    ],
+}
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").strip().lower()
+
+
+def _compact(text: str) -> str:
+    """正規化並去除空白、標點與符號（「早安！」「早安~」視為同一句）。"""
+    return "".join(c for c in _normalize(text) if not c.isspace() and unicodedata.category(c)[0] not in "PS")
+
+
+def _features(text: str) -> List[str]:
+    chars = [c for c in _normalize(text) if not c.isspace()]
+    return chars + [a + b for a, b in zip(chars, chars[1:])]
+
+
+class TinyNaiveBayes:
+    def __init__(self, corpus: Dict[str, List[str]], alpha: float = 0.5):
+        self.alpha = alpha
+        self.labels = list(corpus)
+        self.counts = {c: Counter() for c in self.labels}
+        self.totals: Dict[str, int] = {}
+        total_docs = sum(len(v) for v in corpus.values())
+        self.priors = {c: math.log(len(v) / total_docs) for c, v in corpus.items()}
+        vocab = set()
+        for c, docs in corpus.items():
+            for d in docs:
+                feats = _features(d)
+                self.counts[c].update(feats)
+                vocab.update(feats)
+        self.vocab_size = len(vocab)
+        for c in self.labels:
+            self.totals[c] = sum(self.counts[c].values())
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        feats = _features(text)
+        scores = {}
+        for c in self.labels:
+            denom = self.totals[c] + self.alpha * (self.vocab_size + 1)
+            s = self.priors[c]
+            for f in feats:
+                s += math.log((self.counts[c][f] + self.alpha) / denom)
+            scores[c] = s
+        m = max(scores.values())
+        exp = {c: math.exp(v - m) for c, v in scores.items()}
+        z = sum(exp.values())
+        return {c: v / z for c, v in exp.items()}
+
+
+_matcher = AhoCorasick(dict(RISK_LEXICON, _exception=SELF_HARM_EXCEPTIONS))
+_classifier = TinyNaiveBayes(_SEED_CORPUS)
+# 寒暄/閒聊白名單：完全相符才直接放行
+_ALLOWLIST = frozenset(_compact(t) for t in _SEED_CORPUS["benign"])
+
+
+def _negated(text: str, start: int) -> bool:
+    return bool(_NEGATION_RE.search(text[max(0, start - 5):start]))
+
+
+def scan_risk_terms(text: str) -> List[Tuple[str, str]]:
+    """
+    回傳 (類別, 詞) 命中；被 SELF_HARM_EXCEPTIONS 完整涵蓋的自傷詞會被剔除，
+    前方有否定詞的明確自傷詞降級為 self_harm_hint。
+    """
+    text = _normalize(text)
+    spans = _matcher.find_spans(text)
+    safe = [(end - len(w), end) for end, label, w in spans if label == "_exception"]
+    hits = []
+    for end, label, w in spans:
+        if label == "_exception":
+            continue
+        start = end - len(w)
+        if label.startswith("self_harm") and any(s <= start and end <= e for s, e in safe):
+            continue
+        if label == "self_harm" and _negated(text, start):
+            label = "self_harm_hint"
+        hits.append((label, w))
+    return hits
+
+
+def preclassify(text: str) -> Tuple[Optional[str], str]:
+    """
+    回傳 (verdict, detail)：
+    - ("BLOCK: <原因>", ...)：命中明確的本人自傷意圖，直接攔截（原因含「自傷」，由呼叫端通報個管師）。
+    - ("OK", ...)：無任何風險詞，且完全符合寒暄白名單；或很短、全部特徵都在無害語料中，
+      且分類器高信心判定為日常閒聊。
+    - (None, ...)：不確定，需交給 LLM Guardrail；只命中模稜兩可的自傷字詞時
+      detail 為 "self_harm_hint:<詞>"，供 LLM 判斷時參考（被否定的明確自傷詞也屬此類）。
+    """
+    if not PRECLASSIFIER_ENABLED or not text or not text.strip():
+        return None, "disabled"
+    hits = scan_risk_terms(text)
+    labels = {label for label, _ in hits}
+    if "self_harm" in labels:
+        words = "、".join(sorted({w for label, w in hits if label == "self_harm"}))
+        return "BLOCK: 自傷風險（本地詞庫命中：" + words + "）", "self_harm"
+    if "self_harm_hint" in labels:
+        words = "、".join(sorted({w for label, w in hits if label == "self_harm_hint"}))
+        return None, "self_harm_hint:" + words
+    if hits:
+        return None, "risk_terms:" + ",".join(sorted(labels))
+    compact = _compact(text)
+    if compact in _ALLOWLIST:
+        return "OK", "allowlist"
+    if len(compact) > PRECLASSIFIER_MAX_CHARS:
+        return None, "too_long"
+    # 出現無害語料沒見過的字或詞組（搶、槍、放火…）時分類器沒有依據，交給 LLM
+    benign_vocab = _classifier.counts["benign"]
+    if any(f not in benign_vocab for f in _features(compact)):
+        return None, "out_of_vocab"
+    p_benign = _classifier.predict_proba(compact).get("benign", 0.0)
+    if p_benign >= PRECLASSIFIER_PASS_THRESHOLD:
+        return "OK", f"benign:{p_benign:.3f}"
+    return None, f"uncertain:{p_benign:.3f}"
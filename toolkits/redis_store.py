@@ -12,6 +12,16 @@ import redis
 REDIS_TTL_SECONDS = int(os.getenv("REDIS_TTL_SECONDS", 86400))
 ALERT_STREAM_KEY = os.getenv("ALERT_STREAM_KEY", "alerts:stream")
 ALERT_STREAM_GROUP = os.getenv("ALERT_STREAM_GROUP", "case_mgr")
+JOB_STREAM_KEY = os.getenv("JOB_STREAM_KEY", "jobs:stream")
+JOB_STREAM_GROUP = os.getenv("JOB_STREAM_GROUP", "chat_workers")
+JOB_STREAM_MAXLEN = int(os.getenv("JOB_STREAM_MAXLEN", 10000))
+WEBHOOK_EVENT_TTL_SECONDS = int(os.getenv("WEBHOOK_EVENT_TTL_SECONDS", 86400))
+# PROCESSING 狀態的短 TTL：處理中由持有者續約，行程當掉時在此時間內自動過期，重試可重新取得
+PROCESSING_LEASE_MS = int(os.getenv("PROCESSING_LEASE_MS", 60000))
+# local：本行程計時並收尾；redis：活動時間記錄於 Redis，由持有 lease 的 replica 統一收尾
+IDLE_TRACKING = os.getenv("IDLE_TRACKING", "local").lower()
+IDLE_ZSET_KEY = os.getenv("IDLE_ZSET_KEY", "sessions:last_active")
+IDLE_CLAIM_KEY = os.getenv("IDLE_CLAIM_KEY", "sessions:finalizing")
 
 
 @lru_cache(maxsize=1)
@@ -20,6 +30,13 @@ def get_redis() -> redis.Redis:
     return redis.Redis.from_url(url, decode_responses=True)
 
 
+@lru_cache(maxsize=1)
+def get_redis_bytes() -> redis.Redis:
+    """不做字串解碼的連線，供存放二進位資料（例如 float32 向量）使用。"""
+    url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    return redis.Redis.from_url(url, decode_responses=False)
+
+
 def _touch_ttl(keys: List[str]) -> None:
     if not keys:
         return
@@ -100,6 +117,9 @@ def append_round(user_id: str, round_obj: Dict) -> None:
     key = f"session:{user_id}:history"
     r.rpush(key, json.dumps(round_obj, ensure_ascii=False))
     ensure_active_state(user_id)
+    # 只有 Redis 閒置追蹤會認領並移除 ZSET 成員；local 模式寫入只會讓它無限增長
+    if IDLE_TRACKING == "redis":
+        touch_idle(user_id)
     _touch_ttl(
         [
             key,
@@ -232,6 +252,315 @@ def pop_all_alerts(user_id: str) -> List[Dict]:
     return [json.loads(x) for x in items]
 
 
+# --- Jobs：webhook 先 ack，訊息以 Streams 交給 worker 處理 ---
+def ensure_job_group() -> None:
+    r = get_redis()
+    try:
+        # id="0"：群組建立前已寫入的工作也要被消費
+        r.xgroup_create(
+            name=JOB_STREAM_KEY, groupname=JOB_STREAM_GROUP, id="0", mkstream=True
+        )
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def xadd_job(fields: Dict) -> str:
+    r = get_redis()
+    payload = {k: "" if v is None else str(v) for k, v in fields.items()}
+    payload.setdefault("enqueued_ts", str(int(time.time() * 1000)))
+    return r.xadd(
+        JOB_STREAM_KEY, payload, maxlen=JOB_STREAM_MAXLEN, approximate=True
+    )
+
+
+def xread_jobs(
+    consumer: str, count: int = 10, block_ms: int = 5000
+) -> List[Tuple[str, Dict]]:
+    r = get_redis()
+    res = r.xreadgroup(
+        groupname=JOB_STREAM_GROUP,
+        consumername=consumer,
+        streams={JOB_STREAM_KEY: ">"},
+        count=count,
+        block=block_ms,
+    )
+    if not res:
+        return []
+    # [[stream, [(xid, fields), ...]]]
+    return [(xid, fields) for xid, fields in res[0][1]]
+
+
+def xclaim_stale_jobs(
+    consumer: str, min_idle_ms: int, count: int = 10
+) -> List[Tuple[str, Dict]]:
+    """接手其他 consumer 已讀取但逾時未 ack 的工作（worker 當機或重啟）。"""
+    r = get_redis()
+    res = r.xautoclaim(
+        JOB_STREAM_KEY,
+        JOB_STREAM_GROUP,
+        consumer,
+        min_idle_time=min_idle_ms,
+        start_id="0-0",
+        count=count,
+    )
+    # redis-py 回傳 [next_id, [(xid, fields), ...], (deleted_ids)]
+    msgs = res[1] if res and len(res) > 1 else []
+    return [(xid, fields) for xid, fields in msgs if fields]
+
+
+def xack_job(xid: str) -> int:
+    return get_redis().xack(JOB_STREAM_KEY, JOB_STREAM_GROUP, xid)
+
+
+# --- Webhook 事件去重（webhookEventId → 處理狀態） ---
+def webhook_event_key(event_id: str) -> str:
+    return f"webhook:event:{event_id}"
+
+
+def claim_webhook_event(event_id: str) -> Optional[str]:
+    """
+    首次看到此事件回 None 並標記 PROCESSING；否則回傳既有狀態（PROCESSING/QUEUED/DONE/FAILED）。
+    PROCESSING 只有 PROCESSING_LEASE_MS 的短 TTL（處理中由持有者續約），行程當掉後重送可重新取得。
+    """
+    r = get_redis()
+    if r.set(webhook_event_key(event_id), "PROCESSING", nx=True, px=PROCESSING_LEASE_MS):
+        return None
+    return r.get(webhook_event_key(event_id)) or ""
+
+
+# 只有目前為 FAILED 時才改回 PROCESSING：同一事件的多次重送只會有一個重新處理
+_RECLAIM_FAILED_EVENT_LUA = """
+if redis.call('GET', KEYS[1]) == 'FAILED' then
+  redis.call('SET', KEYS[1], 'PROCESSING', 'PX', ARGV[1])
+  return 1
+end
+return 0
+"""
+
+
+def reclaim_failed_webhook_event(event_id: str) -> bool:
+    return bool(
+        get_redis().eval(
+            _RECLAIM_FAILED_EVENT_LUA, 1, webhook_event_key(event_id), PROCESSING_LEASE_MS
+        )
+    )
+
+
+def set_webhook_event_status(event_id: str, status: str) -> None:
+    get_redis().set(webhook_event_key(event_id), status, ex=WEBHOOK_EVENT_TTL_SECONDS)
+
+
+# --- 衛教知識庫版本（load_article.py 重新匯入時遞增，讓依賴它的快取失效） ---
+KB_VERSION_KEY = os.getenv("KB_VERSION_KEY", "kb:copd_qa:version")
+# 行程內的知識庫索引（關鍵詞索引、本地向量索引）最多每 KB_INDEX_CHECK_SEC 秒檢查一次版本
+KB_INDEX_CHECK_SEC = int(os.getenv("KB_INDEX_CHECK_SEC", 30))
+
+
+def get_kb_version() -> str:
+    return get_redis().get(KB_VERSION_KEY) or "0"
+
+
+def bump_kb_version() -> str:
+    return str(get_redis().incr(KB_VERSION_KEY))
+
+
+# 匯入中途中斷（已寫入 Milvus、尚未遞增版本）的標記：重跑時即使沒有差異也會補做版本遞增與匯出
+KB_DIRTY_KEY = os.getenv("KB_DIRTY_KEY", "kb:copd_qa:dirty")
+
+
+def mark_kb_dirty() -> None:
+    get_redis().set(KB_DIRTY_KEY, str(int(time.time())))
+
+
+def is_kb_dirty() -> bool:
+    return bool(get_redis().exists(KB_DIRTY_KEY))
+
+
+def clear_kb_dirty() -> None:
+    get_redis().delete(KB_DIRTY_KEY)
+
+
+# --- LTM（user_memory）記錄索引：每位使用者一個 sorted set（member = Milvus id，score = updated_at） ---
+# 讓保留策略只處理「超出的那幾筆」，不必每次寫入都掃描該使用者全部記錄。
+# 不在 purge_user_session 清除 —— LTM 跨 session 保存。
+LTM_INDEXED_KEY = "ltm:indexed"  # 已建立索引的使用者集合
+
+
+def _ltm_index_key(user_id: str) -> str:
+    return f"ltm:index:{user_id}"
+
+
+def ltm_index_is_built(user_id: str) -> bool:
+    return bool(get_redis().sismember(LTM_INDEXED_KEY, user_id))
+
+
+def ltm_index_build(user_id: str, rows: List[Tuple[int, int]]) -> None:
+    """以 (id, updated_at) 全量重建索引（冷啟動或索引遺失時執行一次）。"""
+    r = get_redis()
+    key = _ltm_index_key(user_id)
+    with r.pipeline() as p:
+        p.delete(key)
+        if rows:
+            p.zadd(key, {str(i): ts for i, ts in rows})
+        p.sadd(LTM_INDEXED_KEY, user_id)
+        p.execute()
+
+
+def ltm_index_add(user_id: str, rows: List[Tuple[int, int]]) -> int:
+    """登記新寫入的記錄，回傳該使用者目前的記錄數。"""
+    r = get_redis()
+    key = _ltm_index_key(user_id)
+    with r.pipeline() as p:
+        if rows:
+            p.zadd(key, {str(i): ts for i, ts in rows})
+        p.zcard(key)
+        return int(p.execute()[-1])
+
+
+def ltm_index_oldest(user_id: str, n: int) -> List[Tuple[int, int]]:
+    if n <= 0:
+        return []
+    pairs = get_redis().zrange(_ltm_index_key(user_id), 0, n - 1, withscores=True)
+    return [(int(i), int(ts)) for i, ts in pairs]
+
+
+def ltm_index_remove(user_id: str, ids: List[int]) -> None:
+    if ids:
+        get_redis().zrem(_ltm_index_key(user_id), *[str(i) for i in ids])
+
+
+def ltm_index_reset(user_ids: Optional[List[str]] = None) -> None:
+    """資料被外部工具直接刪除後，讓索引在下次寫入時重建；user_ids=None 代表全部使用者。"""
+    r = get_redis()
+    if user_ids is None:
+        user_ids = list(r.smembers(LTM_INDEXED_KEY))
+    if not user_ids:
+        return
+    with r.pipeline() as p:
+        for uid in user_ids:
+            p.delete(_ltm_index_key(uid))
+            p.srem(LTM_INDEXED_KEY, uid)
+        p.execute()
+
+
+def ltm_index_bind_collection(collection: str) -> bool:
+    """記錄索引對應的 collection；切換 MEM_COLLECTION（例如遷移後）時主鍵全變，清掉索引重建。回傳是否重設。"""
+    prev = get_redis().getset("ltm:collection", collection)
+    if prev is not None and prev != collection:
+        ltm_index_reset()
+        return True
+    return False
+
+
+def ltm_index_drop_older(cutoff_ms: int) -> int:
+    """年齡保留策略在 Milvus 批次刪除後，同步清掉所有使用者索引中過期的成員。"""
+    r = get_redis()
+    removed = 0
+    for user_id in r.sscan_iter(LTM_INDEXED_KEY, count=500):
+        removed += int(r.zremrangebyscore(_ltm_index_key(user_id), "-inf", f"({cutoff_ms}"))
+    return removed
+
+
+# --- 叢集共用的閒置追蹤：sorted set（score = 最後活動毫秒） ---
+# 原子地取出閒置超過門檻的使用者，並移入「收尾中」集合（score = 認領時間）
+_CLAIM_IDLE_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, id in ipairs(ids) do
+  redis.call('ZREM', KEYS[1], id)
+  redis.call('ZADD', KEYS[2], ARGV[2], id)
+end
+return ids
+"""
+
+# 認領後逾時未完成（收尾者當機）→ 放回閒置集合；已重新活躍者保留新的分數
+_REQUEUE_CLAIMS_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, id in ipairs(ids) do
+  redis.call('ZREM', KEYS[2], id)
+  redis.call('ZADD', KEYS[1], 'NX', 0, id)
+end
+return #ids
+"""
+
+_RENEW_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def touch_idle(user_id: str, now_ms: Optional[int] = None) -> None:
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    get_redis().zadd(IDLE_ZSET_KEY, {user_id: now_ms})
+
+
+def last_active_ms(user_id: str) -> Optional[int]:
+    """使用者在閒置集合中的最後活動時間；已被認領且之後沒有新活動時回 None。"""
+    score = get_redis().zscore(IDLE_ZSET_KEY, user_id)
+    return None if score is None else int(score)
+
+
+def claim_idle_users(idle_ms: int, limit: int = 50) -> List[str]:
+    now_ms = int(time.time() * 1000)
+    return get_redis().eval(
+        _CLAIM_IDLE_LUA,
+        2,
+        IDLE_ZSET_KEY,
+        IDLE_CLAIM_KEY,
+        now_ms - idle_ms,
+        now_ms,
+        limit,
+    )
+
+
+def complete_idle_user(user_id: str) -> None:
+    get_redis().zrem(IDLE_CLAIM_KEY, user_id)
+
+
+def requeue_stale_idle_claims(stale_ms: int) -> int:
+    cutoff = int(time.time() * 1000) - stale_ms
+    return int(
+        get_redis().eval(_REQUEUE_CLAIMS_LUA, 2, IDLE_ZSET_KEY, IDLE_CLAIM_KEY, cutoff)
+    )
+
+
+def idle_tracking_stats() -> Dict[str, int]:
+    r = get_redis()
+    with r.pipeline() as p:
+        p.zcard(IDLE_ZSET_KEY)
+        p.zcard(IDLE_CLAIM_KEY)
+        live, finalizing = p.execute()
+    return {"live": live, "pending_finalization": finalizing}
+
+
+def acquire_lease(name: str, owner: str, ttl_ms: int) -> bool:
+    """取得或續約具名 lease；只有持有者能續約。"""
+    r = get_redis()
+    key = f"lease:{name}"
+    if r.set(key, owner, nx=True, px=ttl_ms):
+        return True
+    return bool(r.eval(_RENEW_LEASE_LUA, 1, key, owner, ttl_ms))
+
+
+_RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+def release_lease(name: str, owner: str) -> bool:
+    """只有持有者能釋放 lease。"""
+    return bool(get_redis().eval(_RELEASE_LEASE_LUA, 1, f"lease:{name}", owner))
+
+
+def renew_key_if(key: str, value: str, ttl_ms: int) -> bool:
+    """鍵目前的值仍為 value 時才續約 TTL（用於 PROCESSING 狀態的續約）。"""
+    return bool(get_redis().eval(_RENEW_LEASE_LUA, 1, key, value, ttl_ms))
+
+
 # --- Purge 整個 user session ---
 def purge_user_session(user_id: str) -> int:
     r = get_redis()
@@ -250,7 +579,11 @@ def purge_user_session(user_id: str) -> int:
 
 
 # --- CAS-style setter for session state ---
-def set_state_if(user_id: str, expect: str, to: str) -> bool:
+def state_key(user_id: str) -> str:
+    return f"session:{user_id}:state"
+
+
+def set_state_if(user_id: str, expect: str, to: str, ttl_ms: Optional[int] = None) -> bool:
     """
     Conditionally set the user's session state with a compare-and-set semantic.
 
@@ -258,12 +591,13 @@ def set_state_if(user_id: str, expect: str, to: str) -> bool:
         user_id: the user/session id
         expect: expected current state; if None or empty, allow set when no state is present
         to: new state to set
+        ttl_ms: optional short TTL for the new state (e.g. a PROCESSING lease); defaults to REDIS_TTL_SECONDS
 
     Returns:
         True if state is set successfully; False if the current state mismatches `expect` or a contention occurs.
     """
     r = get_redis()
-    key = f"session:{user_id}:state"
+    key = state_key(user_id)
     try:
         with r.pipeline() as pipe:
             while True:
@@ -281,6 +615,10 @@ def set_state_if(user_id: str, expect: str, to: str) -> bool:
                             pipe.unwatch()
                             return False
                     pipe.multi()
+                    if ttl_ms:
+                        pipe.set(key, to, px=ttl_ms)
+                        pipe.execute()
+                        return True
                     pipe.set(key, to)
                     pipe.execute()
                     try:
@@ -324,6 +662,63 @@ def read_and_clear_audio_segments(user_id: str, audio_id: str) -> str:
     return " ".join([p.strip() for p in parts if p])
 
 
+def peek_audio_segments(user_id: str, audio_id: str) -> List[str]:
+    """讀取緩衝片段但不清除；處理成功後再以 trim_audio_segments 移除已處理的部分。"""
+    parts = get_redis().lrange(f"audio:{user_id}:{audio_id}:buf", 0, -1)
+    return [
+        (x if isinstance(x, str) else x.decode("utf-8", "ignore")).strip()
+        for x in parts
+        if x
+    ]
+
+
+def trim_audio_segments(user_id: str, audio_id: str, n: int) -> None:
+    """移除最前面 n 個已處理的片段；處理期間新追加的片段保留。"""
+    if n > 0:
+        get_redis().ltrim(f"audio:{user_id}:{audio_id}:buf", n, -1)
+
+
+# --- 連發訊息合併（debounce）：序號、最後到達時間、打字間隔 EWMA ---
+# 只把「同一波」內的間隔（<= ARGV[3]）納入 EWMA，隔很久的新對話不影響節奏估計
+_NOTE_ARRIVAL_LUA = """
+local prev = tonumber(redis.call('HGET', KEYS[1], 'last_ms') or '0')
+local gap = tonumber(redis.call('HGET', KEYS[1], 'gap_ms') or ARGV[2])
+local now = tonumber(ARGV[1])
+if prev > 0 and now - prev <= tonumber(ARGV[3]) then
+  gap = math.floor(0.7 * gap + 0.3 * (now - prev))
+end
+redis.call('HSET', KEYS[1], 'last_ms', now, 'gap_ms', gap)
+local seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return seq
+"""
+
+
+def note_coalesce_arrival(
+    user_id: str, initial_gap_ms: int, max_gap_ms: int, ttl_sec: int = 3600
+) -> int:
+    now_ms = int(time.time() * 1000)
+    return int(
+        get_redis().eval(
+            _NOTE_ARRIVAL_LUA,
+            1,
+            f"coalesce:{user_id}",
+            now_ms,
+            initial_gap_ms,
+            max_gap_ms,
+            ttl_sec * 1000,
+        )
+    )
+
+
+def get_coalesce_state(user_id: str) -> Tuple[int, int, int]:
+    """回傳 (最新序號, 最後到達毫秒, 打字間隔 EWMA 毫秒)。"""
+    seq, last_ms, gap_ms = get_redis().hmget(
+        f"coalesce:{user_id}", "seq", "last_ms", "gap_ms"
+    )
+    return int(seq or 0), int(last_ms or 0), int(float(gap_ms or 0))
+
+
 def get_audio_result(user_id: str, audio_id: str) -> Optional[str]:
     return get_redis().get(f"audio:{user_id}:{audio_id}:result")
 
@@ -0,0 +1,50 @@
+# Filename: toolkits/state_lease.py
+# -*- coding: utf-8 -*-
+"""
+處理中狀態（PROCESSING）的續約：狀態以短 TTL（PROCESSING_LEASE_MS）寫入，
+處理期間由單一背景執行緒每 1/3 TTL 續約一次；行程當掉時不再續約，狀態在 TTL 內自動過期，
+重試 / 重送即可重新取得，不會卡在 PROCESSING 長達 24 小時。
+"""
+import threading
+from typing import Dict
+
+from toolkits.redis_store import PROCESSING_LEASE_MS, renew_key_if
+
+
+class ProcessingLeases:
+    def __init__(self, ttl_ms: int = PROCESSING_LEASE_MS):
+        self.ttl_ms = ttl_ms
+        self._held: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def hold(self, key: str, value: str = "PROCESSING") -> None:
+        """開始續約 key（其值仍為 value 時才續約）。"""
+        with self._lock:
+            self._held[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="processing-leases", daemon=True)
+                self._thread.start()
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._held.pop(key, None)
+
+    def renew_all(self) -> None:
+        with self._lock:
+            held = list(self._held.items())
+        for key, value in held:
+            try:
+                if not renew_key_if(key, value, self.ttl_ms):
+                    # 狀態已被改寫（完成 / 失敗）或已過期：不再續約
+                    self.release(key)
+            except Exception as e:
+                print(f"⚠️ [Lease] 續約 {key} 失敗: {e}")
+
+    def _loop(self) -> None:
+        stop = threading.Event()
+        while not stop.wait(self.ttl_ms / 3000):
+            self.renew_all()
+
+
+processing_leases = ProcessingLeases()
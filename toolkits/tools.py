@@ -1,50 +1,99 @@
 from crewai.tools import BaseTool
 from pymilvus import Collection, connections
 from embedding import to_vector
-import os, json
-from openai import OpenAI
-from datetime import datetime
+import os, hashlib, threading
 
+from toolkits.context import get_current_user_id, mark_turn, note_turn
+from toolkits.kb_keyword_index import KB_HYBRID, KB_KEYWORD_MIN_SCORE, get_keyword_index, milvus_rows, rrf
+from toolkits.kb_local_index import get_local_index
 from toolkits.redis_store import (
     commit_summary_chunk,
     xadd_alert,
 )
+from utils.llm_client import get_openai_client
 
 # === Milvus ===
-_milvus_loaded = False
 _collection = None
+_collection_lock = threading.Lock()
+
+def get_qa_collection() -> Collection:
+    """copd_qa 於第一次查詢時才連線並載入；多執行緒同時首查只會初始化一次。"""
+    global _collection
+    if _collection is not None:
+        return _collection
+    with _collection_lock:
+        if _collection is None:
+            # 避免重複連線，檢查是否已連線
+            try:
+                connections.get_connection("default")
+            except:
+                connections.connect(alias="default", uri=os.getenv("MILVUS_URI", "http://localhost:19530"))
+            col = Collection("copd_qa"); col.load()
+            _collection = col
+    return _collection
 
 class SearchMilvusTool(BaseTool):
     name: str = "search_milvus"
     description: str = "在 Milvus 中搜尋 COPD 相關問答，回傳相似問題與答案"
-    print(description)
     def _run(self, query: str) -> str:
-        global _milvus_loaded, _collection
         try:
-            if not _milvus_loaded:
-                # 避免重複連線，檢查是否已連線
-                try:
-                    connections.get_connection("default")
-                except:
-                    connections.connect(alias="default", uri=os.getenv("MILVUS_URI", "http://localhost:19530"))
-                _collection = Collection("copd_qa"); _collection.load(); _milvus_loaded = True
             thr = float(os.getenv("SIMILARITY_THRESHOLD", 0.6))
             vec = to_vector(query)
             if not isinstance(vec, list): vec = vec.tolist() if hasattr(vec,'tolist') else list(vec)
-            res = _collection.search(
-                data=[vec], anns_field="embedding",
-                param={"metric_type":"COSINE", "params":{"nprobe":10}}, limit=5,
-                output_fields=["question","answer","category"],
-            )
-            out = []
-            for hit in res[0]:
-                if hit.score >= thr:
-                    q = hit.entity.get("question"); a = hit.entity.get("answer"); cat = hit.entity.get("category")
-                    out.append(f"[{cat}] (相似度: {hit.score:.3f})\nQ: {q}\nA: {a}")
+            limit = 10 if KB_HYBRID else 5
+            # 啟用本地索引時以 mmap 的向量矩陣直接算 top-k；不可用或維度不符時走 Milvus
+            local = get_local_index(get_qa_collection)
+            hits = local.search(vec, limit) if local is not None else None
+            if hits is None:
+                local = None
+                res = get_qa_collection().search(
+                    data=[vec], anns_field="embedding",
+                    param={"metric_type":"COSINE", "params":{"nprobe":10}}, limit=limit,
+                    output_fields=["question","answer","category"],
+                )
+                hits = res[0]
+            rows = (lambda: local.rows) if local is not None else milvus_rows(get_qa_collection())
+            out = _fuse_hybrid(rows, query, hits, thr) if KB_HYBRID else None
+            if out is None:
+                out = []
+                for hit in hits[:5]:
+                    if hit.score >= thr:
+                        q = hit.entity.get("question"); a = hit.entity.get("answer"); cat = hit.entity.get("category")
+                        out.append(f"[{cat}] (相似度: {hit.score:.3f})\nQ: {q}\nA: {a}")
+            if out:
+                # 本輪回覆有衛教知識庫依據，可供語意回答快取判斷（並保留檢索內容供生成通用回答）
+                mark_turn("kb_grounded")
+                note_turn("kb_context", "\n\n".join(out))
             return "\n\n".join(out) if out else "[查無高相似度結果]"
         except Exception as e:
             return f"[Milvus 錯誤] {e}"
 
+def _fuse_hybrid(load_rows, query: str, dense_hits, thr: float, limit: int = 5):
+    """
+    稠密結果與本地關鍵詞索引以 RRF 融合。稠密端需達相似度門檻、關鍵詞端需有完整關鍵詞命中才會輸出，
+    避免只靠排名把不相關的問答帶進來。索引不可用時回 None，由呼叫端退回純稠密搜尋。
+    """
+    try:
+        index = get_keyword_index(load_rows)
+        kw_hits = index.search(query, limit=10)
+    except Exception as e:
+        print(f"[kb keyword index error] {e}")
+        return None
+    dense = {hit.id: hit for hit in dense_hits}
+    keyword = {doc_id: kw for doc_id, _, kw in kw_hits}
+    out = []
+    for doc_id, _ in rrf([[hit.id for hit in dense_hits], [doc_id for doc_id, _, _ in kw_hits]]):
+        hit = dense.get(doc_id)
+        if hit is not None and hit.score >= thr:
+            q = hit.entity.get("question"); a = hit.entity.get("answer"); cat = hit.entity.get("category")
+            out.append(f"[{cat}] (相似度: {hit.score:.3f})\nQ: {q}\nA: {a}")
+        elif keyword.get(doc_id, 0.0) >= KB_KEYWORD_MIN_SCORE and doc_id in index.docs:
+            doc = index.docs[doc_id]
+            out.append(f"[{doc.get('category')}] (關鍵詞命中)\nQ: {doc.get('question')}\nA: {doc.get('answer')}")
+        if len(out) >= limit:
+            break
+    return out
+
 # === 分段摘要（每 5 輪）：LLM 後 CAS 提交 ===
 
 def summarize_chunk_and_commit(user_id: str, start_round: int, history_chunk: list) -> bool:
@@ -52,7 +101,7 @@ def summarize_chunk_and_commit(user_id: str, start_round: int, history_chunk: li
     text = "".join([f"第{start_round+i+1}輪:\n長輩: {h['input']}\n金孫: {h['output']}\n\n" for i,h in enumerate(history_chunk)])
     prompt = f"請將下列對話做 80-120 字摘要，聚焦：健康問題、情緒、生活要點。\n\n{text}"
     try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        client = get_openai_client()
         res = client.chat.completions.create(
             model=os.getenv("MODEL_NAME", "gpt-4o-mini"),
             messages=[{"role":"system","content":"你是專業的對話摘要助手。"},{"role":"user","content":prompt}],
@@ -64,13 +113,34 @@ def summarize_chunk_and_commit(user_id: str, start_round: int, history_chunk: li
     except Exception as e:
         print(f"[摘要錯誤] {e}"); return False
 
+def generate_kb_answer(query: str, kb_context: str) -> str:
+    """只依衛教知識庫內容回答一般性問題（不帶任何使用者資料），供語意回答快取跨使用者共用。"""
+    if not kb_context:
+        return ""
+    prompt = (
+        f"衛教知識庫檢索結果：\n{kb_context}\n\n"
+        f"長輩的問題：{query}\n"
+        "請只根據上面的知識庫內容，用簡單、溫暖的口吻回答這個一般性問題（100 字內）。"
+        "不要提及任何個人狀況、稱呼或先前對話；知識庫沒有的內容就建議詢問醫師或個管師。"
+    )
+    try:
+        client = get_openai_client()
+        res = client.chat.completions.create(
+            model=os.getenv("MODEL_NAME", "gpt-4o-mini"),
+            messages=[{"role":"system","content":"你是 COPD 衛教助手「金孫」，只提供一般衛教資訊。"},{"role":"user","content":prompt}],
+            temperature=0.3,
+        )
+        return (res.choices[0].message.content or "").strip()
+    except Exception as e:
+        print(f"[通用回答生成錯誤] {e}"); return ""
+
 class AlertCaseManagerTool(BaseTool):
     name: str = "alert_case_manager"
     description: str = "通報個管師：以 Redis Streams 送出即時告警，另存 per-user 快照。"
 
     def _run(self, reason: str) -> str:
         try:
-            uid = self.runtime_context.get("user_id") or os.getenv("CURRENT_USER_ID", "unknown")
+            uid = get_current_user_id()
             xid = xadd_alert(user_id=uid, reason=reason, severity="high")
             return f"⚠️ 已通報個管師（事件ID: {xid}），事由：{reason}"
         except Exception as e:
@@ -78,44 +148,62 @@ class AlertCaseManagerTool(BaseTool):
 
 
 # ==== LLM-based Guardrail ====
+GUARDRAIL_SYSTEM_PROMPT = (
+    "你是安全審查器，需精準判斷是否必須攔截。\n"
+    "【允許（回 OK）】以下情況一律放行：\n"
+    "- 症狀敘述或一般健康資訊的詢問（例如：症狀、成因、風險因子、何時就醫的提醒）。\n"
+    "- 一般生活保健/衛教/注意事項等非個案化、非指令性的建議。\n"
+    "【必須攔截（回 BLOCK: <原因>）】符合任一條件：\n"
+    "1) 違法/危險行為的教學、買賣、製作或規避（毒品、武器、暴力、駭客、爆裂物等）。\n"
+    "2) 自傷/他傷/自殺/自殘的指導或鼓勵。\n"
+    "3) 成人性內容或未成年相關不當內容的請求。\n"
+    "4) 醫療/用藥/劑量/診斷/處置等『具體、個案化、可執行』的專業指示或方案。\n"
+    "5) 法律、投資、稅務等高風險領域之『具體、可執行』的專業指導。\n"
+    "【判斷原則】僅在請求明確落入上述攔截條件時才 BLOCK；\n"
+    "若是描述狀況或尋求一般性說明/保健建議，請回 OK。若不確定，預設回 OK。\n"
+    "【輸出格式】只能是：\n"
+    "OK\n"
+    "或\n"
+    "BLOCK: <極簡原因>\n"
+)
+# Prompt 版本：修改上方規則時自動變更，讓判定快取失效
+GUARDRAIL_PROMPT_VERSION = hashlib.sha1(GUARDRAIL_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:8]
+GUARDRAIL_ERROR_REASON = "guardrail 服務錯誤"
+
+
+def guard_model_name() -> str:
+    return os.getenv("GUARD_MODEL", os.getenv("MODEL_NAME", "gpt-4o-mini"))
+
+
+def classify_guardrail(text: str, source: str = "使用者輸入", hint: str = "") -> str:
+    """以單次 LLM 呼叫判斷文字是否需攔截；只回 OK 或 BLOCK: <原因>。hint 為本地詞庫的自傷字詞提示。"""
+    try:
+        client = get_openai_client()
+        guard_model = guard_model_name()
+        user = f"{source}：{text}\n"
+        if hint:
+            # 提示只供參考：吞藥困難、「想死你了」、罵人的「去死」等都不是自傷
+            user += f"（本地詞庫偵測到可能的自傷相關字詞：{hint}；請判斷是否為本人自傷意圖，若是，原因須含「自傷」。）\n"
+        user += "請依規則只輸出 OK 或 BLOCK: <原因>。"
+        res = client.chat.completions.create(
+            model=guard_model,
+            messages=[{"role":"system","content":GUARDRAIL_SYSTEM_PROMPT},{"role":"user","content":user}],
+            temperature=0,
+            max_tokens=24,
+        )
+        out = (res.choices[0].message.content or "").strip()
+        # 保底格式：預設放行以降低誤攔
+        if not out.startswith("OK") and not out.startswith("BLOCK:"):
+            out = "OK"
+        return out
+    except Exception as e:
+        # 失敗時寧可保守攔截（維持不變）
+        return f"BLOCK: {GUARDRAIL_ERROR_REASON}（{e}）"
+
+
 class ModelGuardrailTool(BaseTool):
     name: str = "model_guardrail"
     description: str = "使用 LLM 判斷輸入是否涉及違法、危險、自傷，或屬於需專業人士回覆的內容；只回 OK 或 BLOCK: <原因>"
 
     def _run(self, text: str) -> str:
-        try:
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            guard_model = os.getenv("GUARD_MODEL", os.getenv("MODEL_NAME", "gpt-4o-mini"))
-            sys = (
-                "你是安全審查器，需精準判斷是否必須攔截。\n"
-                "【允許（回 OK）】以下情況一律放行：\n"
-                "- 症狀敘述或一般健康資訊的詢問（例如：症狀、成因、風險因子、何時就醫的提醒）。\n"
-                "- 一般生活保健/衛教/注意事項等非個案化、非指令性的建議。\n"
-                "【必須攔截（回 BLOCK: <原因>）】符合任一條件：\n"
-                "1) 違法/危險行為的教學、買賣、製作或規避（毒品、武器、暴力、駭客、爆裂物等）。\n"
-                "2) 自傷/他傷/自殺/自殘的指導或鼓勵。\n"
-                "3) 成人性內容或未成年相關不當內容的請求。\n"
-                "4) 醫療/用藥/劑量/診斷/處置等『具體、個案化、可執行』的專業指示或方案。\n"
-                "5) 法律、投資、稅務等高風險領域之『具體、可執行』的專業指導。\n"
-                "【判斷原則】僅在請求明確落入上述攔截條件時才 BLOCK；\n"
-                "若是描述狀況或尋求一般性說明/保健建議，請回 OK。若不確定，預設回 OK。\n"
-                "【輸出格式】只能是：\n"
-                "OK\n"
-                "或\n"
-                "BLOCK: <極簡原因>\n"
-            )
-            user = f"使用者輸入：{text}\n請依規則只輸出 OK 或 BLOCK: <原因>。"
-            res = client.chat.completions.create(
-                model=guard_model,
-                messages=[{"role":"system","content":sys},{"role":"user","content":user}],
-                temperature=0,
-                max_tokens=24,
-            )
-            out = (res.choices[0].message.content or "").strip()
-            # 保底格式：預設放行以降低誤攔
-            if not out.startswith("OK") and not out.startswith("BLOCK:"):
-                out = "OK"
-            return out
-        except Exception as e:
-            # 失敗時寧可保守攔截（維持不變）
-            return f"BLOCK: guardrail 服務錯誤（{e}）"
\ No newline at end of file
+        return classify_guardrail(text)
@@ -0,0 +1,80 @@
+# Filename: toolkits/warmup.py
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from typing import Callable, Dict, List
+
+WARMUP_RETRY_SEC = float(os.getenv("WARMUP_RETRY_SEC", 5))
+WARMUP_RETRY_MAX_SEC = float(os.getenv("WARMUP_RETRY_MAX_SEC", 60))
+
+
+class WarmupRunner:
+    """
+    開機暖機：所有依賴的預熱步驟平行執行，失敗者以指數退避重試直到成功。
+    ready() 只在每個 required 步驟都成功過後才回 True，供 /healthz/ready 判斷是否接流量。
+    start() 可重複呼叫（只會啟動一次）；import 時不做任何事。
+    """
+
+    def __init__(self, name: str = "warmup"):
+        self._name = name
+        self._steps: List[tuple] = []  # (名稱, fn, required)
+        self._status: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._started_at = 0.0
+
+    def register(self, name: str, fn: Callable[[], object], required: bool = True) -> None:
+        self._steps.append((name, fn, required))
+        self._status[name] = {"state": "pending", "required": required, "attempts": 0}
+
+    def start(self) -> "WarmupRunner":
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+            self._started_at = time.monotonic()
+        # 每個步驟一條 daemon 執行緒：持續失敗的重試不會擋住行程結束
+        for step in self._steps:
+            threading.Thread(
+                target=self._run_step, args=step, name=f"{self._name}-{step[0]}", daemon=True
+            ).start()
+        return self
+
+    def ready(self) -> bool:
+        with self._lock:
+            return self._started and all(
+                s["state"] == "ok" for s in self._status.values() if s["required"]
+            )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            steps = {k: dict(v) for k, v in self._status.items()}
+            started = self._started
+        return {
+            "started": started,
+            "ready": self.ready(),
+            "uptime_sec": round(time.monotonic() - self._started_at, 1) if started else 0.0,
+            "steps": steps,
+        }
+
+    def _run_step(self, name: str, fn: Callable[[], object], required: bool) -> None:
+        delay = WARMUP_RETRY_SEC
+        while True:
+            t0 = time.monotonic()
+            with self._lock:
+                self._status[name]["attempts"] += 1
+            try:
+                fn()
+                self._set(name, state="ok", elapsed_ms=int((time.monotonic() - t0) * 1000), error=None)
+                print(f"🔥 [暖機] {name} 完成（{self._status[name]['elapsed_ms']} ms）")
+                return
+            except Exception as e:
+                self._set(name, state="failed", error=str(e)[:200])
+                print(f"⚠️ [暖機] {name} 失敗，{delay:.0f}s 後重試: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_MAX_SEC)
+
+    def _set(self, name: str, **fields) -> None:
+        with self._lock:
+            self._status[name].update(fields)
@@ -1,4 +1,7 @@
 import os
+import time
+from functools import lru_cache
+from typing import Optional
 
 import requests
 from dotenv import load_dotenv
@@ -7,6 +10,28 @@ load_dotenv()
 
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "")
 LINE_API_URL = "https://api.line.me/v2/bot/message/push"
+LINE_REPLY_API_URL = "https://api.line.me/v2/bot/message/reply"
+LINE_BOT_INFO_URL = "https://api.line.me/v2/bot/info"
+# reply token 約一分鐘內有效；超過就直接改用 push，省一次必定失敗的呼叫
+REPLY_TOKEN_MAX_AGE_SEC = int(os.getenv("REPLY_TOKEN_MAX_AGE_SEC", 50))
+
+
+@lru_cache(maxsize=1)
+def _session() -> requests.Session:
+    # 共用連線池：重用 TLS 連線，暖機時建立的連線可直接被第一則訊息使用
+    return requests.Session()
+
+
+def warm_line_connection() -> None:
+    """暖機：以 bot info API 建立 TLS 連線並驗證 token，失敗時拋出例外。"""
+    if not LINE_CHANNEL_ACCESS_TOKEN:
+        raise RuntimeError("缺少 LINE_CHANNEL_ACCESS_TOKEN")
+    response = _session().get(
+        LINE_BOT_INFO_URL,
+        headers={"Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}"},
+        timeout=10,
+    )
+    response.raise_for_status()
 
 
 def send_line_message(user_id: str, message: str) -> bool:
@@ -22,7 +47,7 @@ def send_line_message(user_id: str, message: str) -> bool:
     data = {"to": user_id, "messages": [{"type": "text", "text": message}]}
 
     try:
-        response = requests.post(LINE_API_URL, headers=headers, json=data, timeout=10)
+        response = _session().post(LINE_API_URL, headers=headers, json=data, timeout=10)
         if response.status_code == 200:
             print(f"✅ [LINE Push] 成功發送訊息給 {user_id}")
             return True
@@ -34,3 +59,44 @@ def send_line_message(user_id: str, message: str) -> bool:
     except Exception as e:
         print(f"❌ [LINE Push] 發送時發生錯誤: {e}")
         return False
+
+
+def reply_line_message(reply_token: str, message: str) -> bool:
+    """以 reply token 回覆 LINE 訊息（token 過期或已使用時回 False）"""
+    if not LINE_CHANNEL_ACCESS_TOKEN or not reply_token or not message.strip():
+        return False
+
+    headers = {
+        "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
+        "Content-Type": "application/json",
+    }
+    data = {"replyToken": reply_token, "messages": [{"type": "text", "text": message}]}
+
+    try:
+        response = _session().post(
+            LINE_REPLY_API_URL, headers=headers, json=data, timeout=10
+        )
+        if response.status_code == 200:
+            return True
+        print(
+            f"⚠️ [LINE Reply] 回覆失敗 (HTTP {response.status_code}): {response.text}"
+        )
+        return False
+    except Exception as e:
+        print(f"❌ [LINE Reply] 回覆時發生錯誤: {e}")
+        return False
+
+
+def reply_or_push(
+    user_id: str,
+    reply_token: Optional[str],
+    message: str,
+    event_ts_ms: Optional[int] = None,
+) -> bool:
+    """優先使用 reply token 回覆；token 已過期或回覆失敗時改用 Push Message。"""
+    fresh = True
+    if event_ts_ms:
+        fresh = (time.time() * 1000 - event_ts_ms) < REPLY_TOKEN_MAX_AGE_SEC * 1000
+    if reply_token and fresh and reply_line_message(reply_token, message):
+        return True
+    return send_line_message(user_id, message)
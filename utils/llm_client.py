@@ -0,0 +1,14 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+@lru_cache(maxsize=1)
+def get_openai_client():
+    """共用的 OpenAI client；第一次呼叫時才建立（import 期間不做任何初始化）。"""
+    from openai import OpenAI
+
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
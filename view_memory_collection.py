@@ -16,9 +16,11 @@ import os
 import json
 import time
 from datetime import datetime
-from pymilvus import connections, Collection
+from pymilvus import connections, Collection, DataType
 from dotenv import load_dotenv
 
+from toolkits import mem_vectors
+
 load_dotenv()
 
 MEM_COLLECTION = os.getenv("MEM_COLLECTION", "user_memory")
@@ -143,6 +145,14 @@ def view_user_records(col: Collection, user_id: str, limit: int = 20):
     except Exception as e:
         print(f"❌ 查看使用者記錄失敗: {e}")
 
+def memory_vector_format(col: Collection):
+    """collection 的 (向量維度, 寫入格式)；FLOAT16_VECTOR 為 float16，其餘（含 SQ8 索引）以 float32 寫入。"""
+    for f in col.schema.fields:
+        if f.name == "embedding":
+            mode = "float16" if f.dtype == DataType.FLOAT16_VECTOR else "float32"
+            return int(f.params["dim"]), mode
+    raise ValueError(f"{col.name} 沒有 embedding 欄位")
+
 def search_similar_records(col: Collection, query_text: str, user_id: str = None):
     """搜索相似記錄"""
     try:
@@ -157,6 +167,9 @@ def search_similar_records(col: Collection, query_text: str, user_id: str = None
         if not query_vector:
             print("❌ 無法向量化查詢文本")
             return
+        # 依 collection 實際的向量格式編碼查詢（MEM_VECTOR_DIM 截短 / float16），與應用程式寫入時一致
+        dim, mode = memory_vector_format(col)
+        query_vector = mem_vectors.encode(query_vector, dim, mode)
         
         # 構建搜索表達式
         expr = f'user_id == "{user_id}"' if user_id else "id >= 0"
@@ -165,7 +178,7 @@ def search_similar_records(col: Collection, query_text: str, user_id: str = None
         results = col.search(
             data=[query_vector],
             anns_field="embedding",
-            param={"metric_type": "COSINE", "params": {"ef": 64}},
+            param=mem_vectors.search_params(mode),
             limit=10,
             expr=expr,
             output_fields=["user_id", "updated_at", "text"]
@@ -0,0 +1,37 @@
+import os
+import socket
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from main import run_job_worker, warmup  # noqa: E402
+
+# 每個 reader 執行緒負責拉取工作，實際處理由 main.lane_executor 依使用者分 lane 平行執行
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+
+
+def main() -> None:
+    warmup.start()  # 背景預熱依賴，第一筆工作不必等冷啟動
+    stop_event = threading.Event()
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    threads = [
+        threading.Thread(
+            target=run_job_worker, args=(f"{prefix}-{i}", stop_event), daemon=True
+        )
+        for i in range(JOB_WORKERS)
+    ]
+    for t in threads:
+        t.start()
+    print(f"🚀 已啟動 {JOB_WORKERS} 個訊息讀取 worker")
+    try:
+        for t in threads:
+            t.join()
+    except (KeyboardInterrupt, SystemExit):
+        stop_event.set()
+        print("🛑 worker 已停止。")
+
+
+if __name__ == "__main__":
+    main()